@@ -1,44 +1,973 @@
+import time
+_process_started = time.perf_counter()
+
 import sys
 import os
+import asyncio
+import hmac
+import json
+import random
+import threading
+import urllib.request
+import warnings
 import uvicorn
-from fastapi import FastAPI, UploadFile, File
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack, asynccontextmanager, nullcontext
+from typing import List, Literal, Optional
+from fastapi import FastAPI, UploadFile, File, Header, Query
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from PIL import Image
-import io
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.join(current_dir, 'frontend_streamlit'))
 
-try:
-    from model_loader import detector
-except ImportError:
-    class MockDetector:
-        def predict(self, image):
-            import random
-            is_forged = random.choice([True, False])
-            confidence = random.uniform(0.70, 0.99)
-            return {
-                "is_forged": is_forged,
-                "confidence": confidence,
-                "label": "Forged" if is_forged else "Authentic"
-            }
-    detector = MockDetector()
-
-app = FastAPI()
+from admission import AdmissionController, Overloaded
+from batching import MicroBatcher
+from documents import iter_documents
+from duplicates import (ENABLED as DUPLICATES_ENABLED, REUSE as DUPLICATE_REUSE, DuplicateIndex, describe_matches,
+                        image_signature, reused_result)
+from job_queue import JobLeaseLost, JobQueue
+from memory_usage import RequestMemoryStats, current_rss_bytes
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsRegistry
+from model_registry import ACTIVE_VERSION, DEFAULT_VERSION, ModelEntry, ModelRegistry, UnknownModelVersion, discover_versions
+from pages import UnsupportedDocument, document_verdict, inspect_document, is_paged, iter_pages
+from prefork import WORKERS, PreforkServer, SharedValue, bind_socket, threads_per_worker
+from preprocessing import JPEG_DRAFT, ImageTooLarge, load_image
+from response_formats import JSON, NotAcceptable, encode_result, negotiate
+from result_cache import ResultCache, content_digest
+from startup import Startup
+from tiling import TILE_BUDGET, TILE_EARLY_EXIT, tiled_cache_variant
+from uploads import MULTIPART_OVERHEAD, BodySizeLimitMiddleware, UploadRejected, check_upload_size, file_digest
 
-@app.post("/analyze")
-async def analyze_document(file: UploadFile = File(...)):
-    try:
-        contents = await file.read()
-        image = Image.open(io.BytesIO(contents))
-        # Convert to RGB if needed
-        if image.mode != "RGB":
-            image = image.convert("RGB")
-            
-        result = detector.predict(image)
+class MockDetector:
+    def __init__(self, models_dir=None):
+        self.models_dir = models_dir
+
+    def predict(self, image, explain=True, heatmap_format="overlay"):
+        import random
+        is_forged = random.choice([True, False])
+        confidence = random.uniform(0.70, 0.99)
+        return {
+            "is_forged": is_forged,
+            "confidence": confidence,
+            "label": "Forged" if is_forged else "Authentic"
+        }
+
+    def predict_batch(self, images, explain=True, heatmap_format="overlay"):
+        return [self.predict(image, explain=explain) for image in images]
+
+    def predict_tiled(self, image, explain=True, heatmap_format="overlay", **tiling):
+        return self.predict(image, explain=explain)
+
+MAX_BATCH_SIZE = int(os.environ.get("FORGERY_MAX_BATCH_SIZE", "8"))
+MAX_BATCH_WAIT_MS = float(os.environ.get("FORGERY_MAX_BATCH_WAIT_MS", "5"))
+
+MAX_CONCURRENCY = int(os.environ.get("FORGERY_MAX_CONCURRENCY", "16"))
+MAX_QUEUE = int(os.environ.get("FORGERY_MAX_QUEUE", "64"))
+QUEUE_TIMEOUT_S = float(os.environ.get("FORGERY_QUEUE_TIMEOUT_S", "10"))
+RETRY_AFTER_S = int(os.environ.get("FORGERY_RETRY_AFTER_S", "1"))
+# Documents decoded or queued for inference at once per batch request.
+BATCH_STREAM_WINDOW = int(os.environ.get("FORGERY_BATCH_STREAM_WINDOW", str(2 * MAX_BATCH_SIZE)))
+CACHE_SIZE = int(os.environ.get("FORGERY_CACHE_SIZE", "1024"))
+CACHE_DIR = os.environ.get("FORGERY_CACHE_DIR") or None
+MAX_UPLOAD_BYTES = int(os.environ.get("FORGERY_MAX_UPLOAD_BYTES", str(64 * 1024 * 1024)))
+MAX_BATCH_UPLOAD_BYTES = int(os.environ.get("FORGERY_MAX_BATCH_UPLOAD_BYTES", str(2 * 1024 * 1024 * 1024)))
+MAX_IMAGE_PIXELS = int(os.environ.get("FORGERY_MAX_IMAGE_PIXELS", "50000000"))
+MAX_PAGES = int(os.environ.get("FORGERY_MAX_PAGES", "500"))
+# Pages of one document decoded or queued for inference at once.
+PAGE_WINDOW = int(os.environ.get("FORGERY_PAGE_WINDOW", str(2 * MAX_BATCH_SIZE)))
+# Run one dummy batch through the model before reporting ready.
+WARMUP = os.environ.get("FORGERY_WARMUP", "1") != "0"
+# SQLite file of the /jobs queue; uploads are spooled next to it until their job finishes.
+JOB_DB = os.environ.get("FORGERY_JOB_DB", os.path.join(current_dir, "jobs", "jobs.sqlite3"))
+# Jobs run at once per process; each scores up to BATCH_STREAM_WINDOW documents concurrently.
+JOB_WORKERS = int(os.environ.get("FORGERY_JOB_WORKERS", "2"))
+JOB_POLL_S = float(os.environ.get("FORGERY_JOB_POLL_S", "1"))
+WEBHOOK_TIMEOUT_S = float(os.environ.get("FORGERY_WEBHOOK_TIMEOUT_S", "10"))
+WEBHOOK_RETRIES = int(os.environ.get("FORGERY_WEBHOOK_RETRIES", "3"))
+# Shared secret for the /admin endpoints, sent as X-Admin-Token; unset disables them.
+ADMIN_TOKEN = os.environ.get("FORGERY_ADMIN_TOKEN") or None
+
+# Also makes PIL itself refuse decompression bombs on any path that opens images.
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+# Images between the limit and twice it only get a PIL warning; the header
+# check in load_image/iter_pages rejects them with ImageTooLarge anyway.
+warnings.filterwarnings("ignore", category=Image.DecompressionBombWarning)
+
+# Set by load_detector once the active model version is loaded and warmed up.
+registry = None
+# Pre-fork mode only: detectors loaded by the parent for its workers to inherit,
+# the active version shared between workers, and this worker's index.
+preloaded = {}
+shared_active = None
+worker_index = None
+# Opened by lifespan, so pre-fork workers each get their own SQLite connections.
+job_queue = None
+# Perceptual hashes of every analysed image; loaded by load_detector.
+duplicate_index = None
+# How often pre-fork workers check whether another worker activated a version.
+ACTIVE_POLL_S = 1.0
+startup = Startup(started=_process_started)
+admission = AdmissionController(
+    max_concurrency=MAX_CONCURRENCY,
+    max_queue=MAX_QUEUE,
+    queue_timeout=QUEUE_TIMEOUT_S,
+    retry_after=RETRY_AFTER_S,
+)
+result_cache = ResultCache(max_entries=CACHE_SIZE, disk_dir=CACHE_DIR)
+# Decoding is CPU-bound PIL work; keep it off the event loop.
+decode_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY, thread_name_prefix="decode")
+# Tiled documents batch their own tiles; one at a time keeps their latency
+# bounded instead of splitting the CPU between several large jobs.
+tile_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tiles")
+# Loads model versions on demand (activation or a pin to a version not yet resident).
+model_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="models")
+# SQLite calls and webhook deliveries for the job queue.
+job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS + 2, thread_name_prefix="jobs")
+memory_stats = RequestMemoryStats()
+
+metrics = MetricsRegistry()
+stage_seconds = metrics.histogram(
+    "forgery_stage_seconds",
+    "Wall time per pipeline stage; digest, decode and inference are per document, the model stages per batch",
+    ["stage"],
+)
+request_seconds = metrics.histogram("forgery_request_seconds", "Handler latency per endpoint", ["endpoint"])
+requests_total = metrics.counter("forgery_requests_total", "Requests per endpoint and HTTP status", ["endpoint", "status"])
+documents_total = metrics.counter("forgery_documents_total", "Analysed documents by where the result came from", ["outcome"])
+errors_total = metrics.counter("forgery_errors_total", "Documents that failed, by error code", ["code"])
+model_info = metrics.gauge("forgery_model_info", "Model versions by identity: 1 while resident, 0 once unloaded", ["version", "backend", "fingerprint", "mock"])
+active_model = metrics.gauge("forgery_model_active", "1 for the version serving requests that do not pin one", ["version"])
+version_documents_total = metrics.counter("forgery_model_documents_total", "Documents answered per model version", ["version"])
+metrics.gauge("forgery_ready", "1 once the model is loaded and warmed up", function=lambda: int(startup.ready.is_set()))
+metrics.gauge("forgery_requests_in_flight", "Requests holding an admission slot", function=lambda: admission.active)
+metrics.gauge("forgery_requests_waiting", "Requests waiting for an admission slot", function=lambda: admission.waiting)
+job_documents_total = metrics.counter("forgery_job_documents_total", "Documents scored by job workers in this process", ["outcome"])
+metrics.gauge("forgery_jobs_queued", "Jobs waiting for a worker (all processes)", function=lambda: job_queue.counts()["queued"] if job_queue else 0)
+metrics.gauge("forgery_jobs_running", "Jobs being run (all processes)", function=lambda: job_queue.counts()["running"] if job_queue else 0)
+metrics.gauge("forgery_batcher_queue_depth", "Images queued for the next batch, over all resident versions",
+              function=lambda: sum(entry.batcher.pending() for entry in registry.resident()) if registry else 0)
+
+def model_stage_timer(stage):
+    return stage_seconds.time(stage=stage)
+
+def load_detector(startup):
+    # Runs on the startup thread, so uvicorn binds and /healthz answers while
+    # torch and the weights are still loading.
+    global registry, duplicate_index
+    if DUPLICATES_ENABLED:
+        with startup.stage("load_duplicate_index"):
+            duplicate_index = DuplicateIndex()
+    with startup.stage("import_model_loader"):
+        try:
+            from model_loader import MODELS_DIR, ForgeryDetectionModel
+            list_versions = lambda: discover_versions(MODELS_DIR)
+        except ImportError as e:
+            print(f"Model dependencies unavailable ({e}), using the mock detector")
+            ForgeryDetectionModel = MockDetector
+            list_versions = lambda: {DEFAULT_VERSION: None}
+
+    def load_entry(version, path):
+        # The first load is part of startup and shows up in its timings.
+        stage = nullcontext if startup.ready.is_set() else startup.stage
+        with stage("load_model"):
+            loaded = preloaded.pop(version, None) or ForgeryDetectionModel(models_dir=path)
+        is_mock = getattr(loaded, "backend", None) is None
+        if is_mock and version != DEFAULT_VERSION:
+            # Only the default version may fall back to mock results.
+            raise RuntimeError(f"Model version '{version}' has no loadable artifact in {path}")
+        loaded_batcher = MicroBatcher(loaded, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_BATCH_WAIT_MS)
+        if WARMUP:
+            with stage("warmup"):
+                # Goes through the batcher so the worker thread and every lazy
+                # initialisation on the inference path are exercised once.
+                loaded_batcher.submit(Image.new("RGB", (224, 224)), explain=True).result()
+        # Attached after warmup so the dummy batch stays out of the latency histograms.
+        loaded.stage_timer = model_stage_timer
+        labels = {
+            "version": version,
+            "backend": getattr(loaded, "backend_name", "mock"),
+            "fingerprint": (getattr(loaded, "fingerprint", None) or "")[:16],
+            "mock": str(is_mock).lower(),
+        }
+        model_info.set(1, **labels)
+        return ModelEntry(version, loaded, loaded_batcher, on_close=lambda: model_info.set(0, **labels))
+
+    active = shared_active.get()[1] if shared_active is not None else ACTIVE_VERSION
+    loaded_registry = ModelRegistry(load_entry, list_versions, active=active)
+    loaded_registry.release(loaded_registry.acquire())
+    active_model.set(1, version=loaded_registry.active_version)
+    registry = loaded_registry
+
+def preload_models():
+    # Runs in the pre-fork parent. Modules and weights loaded here are shared
+    # copy-on-write by every worker; nothing here may start a thread or run
+    # inference, since forked children only inherit the forking thread.
+    try:
+        from model_loader import DEFAULT_BACKEND, MODELS_DIR, ForgeryDetectionModel
+    except ImportError as e:
+        print(f"Model dependencies unavailable ({e}), workers will use the mock detector")
+        return
+    path = discover_versions(MODELS_DIR).get(ACTIVE_VERSION)
+    # ONNX Runtime starts its thread pools when the session is created, so
+    # each worker builds its own session (the file is still shared through the page cache).
+    if path is not None and DEFAULT_BACKEND != "onnx":
+        preloaded[ACTIVE_VERSION] = ForgeryDetectionModel(models_dir=path)
+
+def configure_worker(index, threads):
+    global worker_index
+    worker_index = index
+    # Startup timings and mock results are per worker, not inherited from the parent.
+    startup.started = time.perf_counter()
+    random.seed()
+    try:
+        from model_loader import set_num_threads
+        set_num_threads(threads)
+    except ImportError:
+        pass
+
+def switch_active(version):
+    previous = registry.activate(version)
+    if previous != version:
+        active_model.set(0, version=previous)
+    active_model.set(1, version=version)
+    return previous
+
+def follow_active_version(stop):
+    # Another worker may have activated a version; load and switch to it here too.
+    seen = shared_active.get()[0]
+    while not stop.wait(ACTIVE_POLL_S):
+        generation, version = shared_active.get()
+        if generation == seen or registry is None:
+            continue
+        seen = generation
+        if version != registry.active_version:
+            try:
+                switch_active(version)
+            except Exception as e:
+                print(f"Worker {worker_index} could not activate model version '{version}': {e}")
+
+@asynccontextmanager
+async def lifespan(app):
+    global job_queue
+    startup.run_in_background(load_detector)
+    stop = threading.Event()
+    if shared_active is not None:
+        threading.Thread(target=follow_active_version, args=(stop,), name="active-version", daemon=True).start()
+    job_queue = JobQueue(JOB_DB)
+    workers = [asyncio.ensure_future(job_worker(f"{os.getpid()}-{slot}")) for slot in range(JOB_WORKERS)]
+    yield
+    for worker in workers:
+        worker.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    stop.set()
+    if registry is not None:
+        registry.close()
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(BodySizeLimitMiddleware, limits={
+    "/analyze": MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD,
+    "/analyze/batch": MAX_BATCH_UPLOAD_BYTES,
+    "/analyze/pages": MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD,
+    "/jobs": MAX_BATCH_UPLOAD_BYTES,
+    "/duplicates": MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD,
+})
+
+def decode_image(source, draft=True):
+    # Reduced-resolution decode where the format allows it (draft=False keeps
+    # every pixel for tiling), converted to RGB. The pixel limit is checked
+    # from the header before anything is decoded.
+    rss_before = current_rss_bytes()
+    try:
+        image = load_image(source, draft=JPEG_DRAFT and draft, max_pixels=MAX_IMAGE_PIXELS)
+    except ImageTooLarge as e:
+        raise UploadRejected("image_too_large", str(e))
+    memory_stats.observe(current_rss_bytes() - rss_before)
+    return image
+
+def source_digest(source):
+    if isinstance(source, (bytes, bytearray)):
+        return content_digest(source)
+    return file_digest(source)
+
+def rejected_response(e):
+    return JSONResponse(status_code=e.status_code, content=e.to_dict())
+
+def not_ready_response():
+    reason = "model_failed" if startup.error else "model_loading"
+    return JSONResponse(
+        status_code=503,
+        content={"error": "Model is not ready yet, retry later", "reason": reason, "is_forged": False, "confidence": 0.0},
+        headers={"Retry-After": str(RETRY_AFTER_S)},
+    )
+
+def overloaded_response(e):
+    return JSONResponse(
+        status_code=503,
+        content={"error": "Server overloaded, retry later", "reason": e.reason, "is_forged": False, "confidence": 0.0},
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+HeatmapFormat = Literal["none", "raw", "overlay"]
+# Overlay results keep the variant they were cached under before formats existed.
+CACHE_VARIANTS = {"overlay": "", "none": "label", "raw": "raw"}
+
+def resolve_heatmap_format(heatmap, heatmap_format):
+    # heatmap=false predates heatmap_format and still means no heatmap at all.
+    return heatmap_format if heatmap else "none"
+
+def resolve_tiling(tiled, max_tiles, early_exit):
+    # None means the regular single-view prediction.
+    if not tiled:
+        return None
+    return {"max_tiles": max_tiles or TILE_BUDGET, "early_exit": TILE_EARLY_EXIT if early_exit is None else early_exit}
+
+def cache_variant(heatmap_format, tiling):
+    if tiling is None:
+        return CACHE_VARIANTS[heatmap_format]
+    return tiled_cache_variant(heatmap_format, **tiling)
+
+@asynccontextmanager
+async def model_lease(version=None):
+    """Lease the active (or pinned) model version for the duration of a request."""
+    entry = registry.acquire(version, load=False)
+    if entry is None:
+        # Pinned to a version that is not resident yet: load and warm it off the event loop.
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(model_executor, registry.acquire, version)
+        try:
+            entry = await asyncio.shield(future)
+        except UnknownModelVersion as e:
+            raise UploadRejected("unknown_model_version", str(e), status_code=404)
+        except asyncio.CancelledError:
+            # The load carries on without us; hand its lease straight back.
+            future.add_done_callback(lambda done: done.exception() or registry.release(done.result()))
+            raise
+        except Exception as e:
+            raise UploadRejected("model_version_failed", f"Could not load model version '{version}': {e}", status_code=500)
+    try:
+        yield entry
+    finally:
+        registry.release(entry)
+
+def with_version(result, entry):
+    # Cached results are shared by versions with identical weights, so the name is added per response.
+    if isinstance(result, dict):
+        version_documents_total.inc(version=entry.version)
+        return {**result, "model_version": entry.version}
+    return result
+
+def detector_outcome(entry):
+    return "mock" if getattr(entry.detector, "backend", None) is None else "model"
+
+async def run_analysis(source, entry, heatmap_format="overlay", tiling=None, reuse_duplicates=DUPLICATE_REUSE):
+    # source is either raw bytes or a (spooled) file object.
+    loop = asyncio.get_running_loop()
+    detector = entry.detector
+    fingerprint = getattr(detector, "fingerprint", None)
+    with stage_seconds.time(stage="digest"):
+        digest = await loop.run_in_executor(decode_executor, source_digest, source)
+    key = ResultCache.make_key(digest, cache_variant(heatmap_format, tiling))
+    result = result_cache.get(key, fingerprint)
+    if result is not None:
+        documents_total.inc(outcome="cache")
         return result
+
+    explain = heatmap_format != "none"
+    with stage_seconds.time(stage="decode"):
+        image = await loop.run_in_executor(decode_executor, decode_image, source, tiling is None)
+    signature, matches = None, []
+    if duplicate_index is not None:
+        with stage_seconds.time(stage="phash"):
+            signature = await loop.run_in_executor(decode_executor, image_signature, image)
+            # The index takes a lock and may touch its file, so it is kept off the event loop too.
+            matches = await loop.run_in_executor(decode_executor, lambda: duplicate_index.search(signature, exclude=digest))
+        # A tiled scan is asked for because the single view may miss small edits, so it never reuses one.
+        match = duplicate_index.reusable(matches, fingerprint) if reuse_duplicates and tiling is None else None
+        if match is not None:
+            documents_total.inc(outcome="duplicate")
+            return {**reused_result(match), "near_duplicates": describe_matches(matches)}
+    # Includes the wait for the batch (or the tile executor) as well as the model stages.
+    with stage_seconds.time(stage="inference"):
+        if tiling is None:
+            result = await asyncio.wrap_future(entry.batcher.submit(image, explain=explain, heatmap_format=heatmap_format))
+        else:
+            result = await loop.run_in_executor(
+                tile_executor, lambda: detector.predict_tiled(image, explain=explain, heatmap_format=heatmap_format, **tiling)
+            )
+    documents_total.inc(outcome=detector_outcome(entry))
+    if signature is not None:
+        await loop.run_in_executor(decode_executor, duplicate_index.add, digest, signature, result, fingerprint, entry.version)
+        # Cached along with the result: the near-duplicates known when it was first scored.
+        result = {**result, "near_duplicates": describe_matches(matches)}
+    result_cache.put(key, fingerprint, result)
+    return result
+
+def inspect_upload(source):
+    try:
+        kind, page_count = inspect_document(source, MAX_IMAGE_PIXELS)
+    except UnsupportedDocument as e:
+        raise UploadRejected("unsupported_document", str(e), status_code=415)
+    except ImageTooLarge as e:
+        raise UploadRejected("image_too_large", str(e))
+    except Exception:
+        # Not an image PIL recognises; the regular path reports the decode error.
+        return False
+    if page_count > MAX_PAGES:
+        raise UploadRejected("too_many_pages", f"Document has {page_count} pages, more than the {MAX_PAGES} page limit")
+    return is_paged(kind, page_count)
+
+def next_page(pages):
+    try:
+        return next(pages, None)
+    except ImageTooLarge as e:
+        raise UploadRejected("image_too_large", str(e))
+    except UnsupportedDocument as e:
+        raise UploadRejected("unsupported_document", str(e), status_code=415)
+
+async def iter_page_results(source, entry, heatmap_format):
+    # Pages go through the micro-batcher like single uploads, at most
+    # PAGE_WINDOW at a time, and come back in completion order.
+    loop = asyncio.get_running_loop()
+    explain = heatmap_format != "none"
+    pages = iter_pages(source, max_pixels=MAX_IMAGE_PIXELS)
+
+    async def score(number, image):
+        try:
+            with stage_seconds.time(stage="inference"):
+                result = await asyncio.wrap_future(entry.batcher.submit(image, explain=explain, heatmap_format=heatmap_format))
+        except Exception as e:
+            # One failed page does not fail the document; the verdict lists it.
+            errors_total.inc(code="internal")
+            result = {"error": str(e), "is_forged": False, "confidence": 0.0}
+        return {"page": number, **result}
+
+    pending = set()
+    exhausted = False
+    try:
+        while pending or not exhausted:
+            while not exhausted and len(pending) < PAGE_WINDOW:
+                with stage_seconds.time(stage="decode"):
+                    item = await loop.run_in_executor(decode_executor, next_page, pages)
+                if item is None:
+                    exhausted = True
+                    break
+                pending.add(asyncio.ensure_future(score(*item)))
+            if not pending:
+                break
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+        # Closes the PDF or TIFF handle, off the event loop.
+        await loop.run_in_executor(decode_executor, pages.close)
+
+async def analyze_pages(source, entry, heatmap_format="overlay"):
+    """Yield each page's result as it completes, then ``{"document": verdict}``."""
+    loop = asyncio.get_running_loop()
+    fingerprint = getattr(entry.detector, "fingerprint", None)
+    with stage_seconds.time(stage="digest"):
+        digest = await loop.run_in_executor(decode_executor, source_digest, source)
+    key = ResultCache.make_key(digest, f"pages-{heatmap_format}")
+    cached = result_cache.get(key, fingerprint)
+    if cached is not None:
+        documents_total.inc(outcome="cache")
+        for page in cached["pages"]:
+            yield page
+        yield {"document": {k: v for k, v in cached.items() if k != "pages"}}
+        return
+
+    page_results = []
+    async for result in iter_page_results(source, entry, heatmap_format):
+        page_results.append(result)
+        yield result
+    page_results.sort(key=lambda result: result["page"])
+    verdict = document_verdict(page_results)
+    documents_total.inc(outcome=detector_outcome(entry))
+    result_cache.put(key, fingerprint, {**verdict, "pages": page_results})
+    yield {"document": verdict}
+
+async def collect_pages(source, entry, heatmap_format="overlay"):
+    page_results, verdict = [], None
+    async for item in analyze_pages(source, entry, heatmap_format):
+        if "document" in item:
+            verdict = item["document"]
+        else:
+            page_results.append(item)
+    return {**verdict, "pages": sorted(page_results, key=lambda result: result["page"])}
+
+async def run_document(source, entry, heatmap_format="overlay", tiling=None, reuse_duplicates=DUPLICATE_REUSE):
+    # PDFs and multi-page TIFFs are scored page by page (tiling applies to single images only).
+    loop = asyncio.get_running_loop()
+    if await loop.run_in_executor(decode_executor, inspect_upload, source):
+        return await collect_pages(source, entry, heatmap_format)
+    return await run_analysis(source, entry, heatmap_format=heatmap_format, tiling=tiling, reuse_duplicates=reuse_duplicates)
+
+def record_request(endpoint, response, started):
+    status = response.status_code if isinstance(response, Response) else 200
+    requests_total.inc(endpoint=endpoint, status=status)
+    request_seconds.observe(time.perf_counter() - started, endpoint=endpoint)
+    return response
+
+@app.post("/analyze")
+async def analyze_document(
+    file: UploadFile = File(...),
+    heatmap: bool = Query(True),
+    heatmap_format: HeatmapFormat = Query("overlay"),
+    tiled: bool = Query(False),
+    max_tiles: Optional[int] = Query(None, ge=1, le=TILE_BUDGET),
+    early_exit: Optional[float] = Query(None, ge=0.0, le=1.0),
+    model_version: Optional[str] = Query(None),
+    reuse_duplicates: bool = Query(DUPLICATE_REUSE),
+    accept: Optional[str] = Header(None),
+):
+    started = time.perf_counter()
+    tiling = resolve_tiling(tiled, max_tiles, early_exit)
+    result = await analyze_upload(file, resolve_heatmap_format(heatmap, heatmap_format), tiling, model_version, reuse_duplicates)
+    media_type = negotiate(accept)
+    if isinstance(result, dict) and "error" not in result and media_type != JSON:
+        # Binary bodies carry the heatmap as raw bytes instead of base64 inside JSON.
+        try:
+            content, content_type = encode_result(result, media_type)
+            result = Response(content=content, media_type=content_type)
+        except NotAcceptable as e:
+            result = JSONResponse(status_code=406, content={"error": str(e), "is_forged": False, "confidence": 0.0})
+    return record_request("/analyze", result, started)
+
+async def analyze_upload(file, heatmap_format, tiling=None, model_version=None, reuse_duplicates=DUPLICATE_REUSE):
+    if not startup.ready.is_set():
+        return not_ready_response()
+    try:
+        async with admission.slot():
+            try:
+                # Read straight from the spooled upload; the body is never copied into memory.
+                check_upload_size(file, MAX_UPLOAD_BYTES)
+                async with model_lease(model_version) as entry:
+                    result = await run_document(file.file, entry, heatmap_format=heatmap_format, tiling=tiling, reuse_duplicates=reuse_duplicates)
+                    return with_version(result, entry)
+            except UploadRejected as e:
+                errors_total.inc(code=e.code)
+                return rejected_response(e)
+            except Exception as e:
+                errors_total.inc(code="internal")
+                return {"error": str(e), "is_forged": False, "confidence": 0.0}
+    except Overloaded as e:
+        return overloaded_response(e)
+
+async def analyze_bytes(index, name, contents, entry, heatmap_format="overlay", tiling=None):
+    try:
+        if isinstance(contents, UploadRejected):
+            raise contents
+        result = with_version(await run_document(contents, entry, heatmap_format=heatmap_format, tiling=tiling), entry)
+    except UploadRejected as e:
+        errors_total.inc(code=e.code)
+        result = e.to_dict()
+    except Exception as e:
+        errors_total.inc(code="internal")
+        result = {"error": str(e), "is_forged": False, "confidence": 0.0}
+    return {"index": index, "filename": name, **result}
+
+async def iter_batch_results(documents, entry, heatmap_format="overlay", tiling=None, skip=frozenset()):
+    """Yield each document's result as it completes; indexes in ``skip`` are read but not scored."""
+    loop = asyncio.get_running_loop()
+    pending = set()
+    index = 0
+    exhausted = False
+    try:
+        while pending or not exhausted:
+            # Keep at most BATCH_STREAM_WINDOW documents in memory at any time.
+            while not exhausted and len(pending) < BATCH_STREAM_WINDOW:
+                item = await loop.run_in_executor(decode_executor, next, documents, None)
+                if item is None:
+                    exhausted = True
+                    break
+                name, contents = item
+                if index not in skip:
+                    pending.add(asyncio.ensure_future(analyze_bytes(index, name, contents, entry, heatmap_format=heatmap_format, tiling=tiling)))
+                index += 1
+
+            if not pending:
+                break
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    except Exception as e:
+        yield {"index": index, "error": str(e)}
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def stream_batch_results(documents, exit_stack, entry, heatmap_format="overlay", tiling=None):
+    try:
+        async for result in iter_batch_results(documents, entry, heatmap_format=heatmap_format, tiling=tiling):
+            yield json.dumps(result) + "\n"
+    finally:
+        await exit_stack.aclose()
+
+@app.post("/analyze/batch")
+async def analyze_batch(
+    files: List[UploadFile] = File(...),
+    heatmap: bool = Query(True),
+    heatmap_format: HeatmapFormat = Query("overlay"),
+    tiled: bool = Query(False),
+    max_tiles: Optional[int] = Query(None, ge=1, le=TILE_BUDGET),
+    early_exit: Optional[float] = Query(None, ge=0.0, le=1.0),
+    model_version: Optional[str] = Query(None),
+):
+    # Timed until the stream starts; per-document work shows up in the stage histograms.
+    started = time.perf_counter()
+    tiling = resolve_tiling(tiled, max_tiles, early_exit)
+    response = await start_batch(files, resolve_heatmap_format(heatmap, heatmap_format), tiling, model_version)
+    return record_request("/analyze/batch", response, started)
+
+async def start_streaming(exit_stack, model_version):
+    # One admission slot and one model lease cover the whole stream; both are
+    # released when it ends. Returns the entry, or an error response.
+    try:
+        await exit_stack.enter_async_context(admission.slot())
+    except Overloaded as e:
+        return overloaded_response(e)
+    try:
+        return await exit_stack.enter_async_context(model_lease(model_version))
+    except UploadRejected as e:
+        await exit_stack.aclose()
+        errors_total.inc(code=e.code)
+        return rejected_response(e)
+
+async def start_batch(files, heatmap_format, tiling=None, model_version=None):
+    if not startup.ready.is_set():
+        return not_ready_response()
+    exit_stack = AsyncExitStack()
+    entry = await start_streaming(exit_stack, model_version)
+    if isinstance(entry, Response):
+        return entry
+
+    documents = iter_documents([(upload.filename, upload.file) for upload in files], max_bytes=MAX_UPLOAD_BYTES)
+    return StreamingResponse(
+        stream_batch_results(documents, exit_stack, entry, heatmap_format=heatmap_format, tiling=tiling),
+        media_type="application/x-ndjson",
+    )
+
+@app.post("/analyze/pages")
+async def analyze_document_pages(
+    file: UploadFile = File(...),
+    heatmap: bool = Query(True),
+    heatmap_format: HeatmapFormat = Query("overlay"),
+    model_version: Optional[str] = Query(None),
+):
+    # Timed until the stream starts, like /analyze/batch.
+    started = time.perf_counter()
+    response = await start_pages(file, resolve_heatmap_format(heatmap, heatmap_format), model_version)
+    return record_request("/analyze/pages", response, started)
+
+async def start_pages(file, heatmap_format, model_version=None):
+    if not startup.ready.is_set():
+        return not_ready_response()
+    try:
+        check_upload_size(file, MAX_UPLOAD_BYTES)
+    except UploadRejected as e:
+        errors_total.inc(code=e.code)
+        return rejected_response(e)
+    exit_stack = AsyncExitStack()
+    entry = await start_streaming(exit_stack, model_version)
+    if isinstance(entry, Response):
+        return entry
+    return StreamingResponse(stream_page_results(file.file, exit_stack, entry, heatmap_format), media_type="application/x-ndjson")
+
+async def stream_page_results(source, exit_stack, entry, heatmap_format="overlay"):
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(decode_executor, inspect_upload, source)
+        async for item in analyze_pages(source, entry, heatmap_format):
+            if "document" in item:
+                item = {"document": with_version(item["document"], entry)}
+            else:
+                item = {**item, "model_version": entry.version}
+            yield json.dumps(item) + "\n"
+    except UploadRejected as e:
+        errors_total.inc(code=e.code)
+        yield json.dumps(e.to_dict()) + "\n"
     except Exception as e:
-        return {"error": str(e), "is_forged": False, "confidence": 0.0}
+        errors_total.inc(code="internal")
+        yield json.dumps({"error": str(e), "is_forged": False, "confidence": 0.0}) + "\n"
+    finally:
+        await exit_stack.aclose()
+
+async def job_worker(name):
+    loop = asyncio.get_running_loop()
+    db = lambda method, *args: loop.run_in_executor(job_executor, method, *args)
+    while not startup.ready.is_set():
+        await asyncio.sleep(JOB_POLL_S)
+    purged = 0.0
+    while True:
+        job = None
+        try:
+            for job_id in await db(job_queue.fail_expired):
+                await deliver_webhook(job_id)
+            job = await db(job_queue.claim, name)
+            if job is None:
+                if time.monotonic() - purged > 3600:
+                    purged = time.monotonic()
+                    await db(job_queue.purge)
+                await asyncio.sleep(JOB_POLL_S)
+                continue
+            if await run_job(job, name):
+                await deliver_webhook(job["id"])
+        except Exception as e:
+            # The worker outlives any one failure (a locked or unreachable queue, a webhook, a bug in one job).
+            print(f"Job worker {name} error: {e!r}")
+            if job is not None:
+                try:
+                    await db(job_queue.requeue, job["id"], name)
+                except Exception as requeue_error:
+                    # Its lease runs out and another worker picks it up.
+                    print(f"Job worker {name} could not requeue job {job['id']}: {requeue_error!r}")
+            await asyncio.sleep(JOB_POLL_S)
+
+async def keep_lease(job_id, worker):
+    # A large PDF or TIFF can take longer than the lease to score; results alone would not renew it in time.
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(job_queue.lease_s / 3)
+        try:
+            await loop.run_in_executor(job_executor, job_queue.renew, job_id, worker)
+        except JobLeaseLost:
+            return
+        except Exception as e:
+            print(f"Could not renew the lease on job {job_id}: {e!r}")
+
+async def run_job(job, worker):
+    """Score a claimed job's documents, storing each result; returns True once the job is finished."""
+    loop = asyncio.get_running_loop()
+    db = lambda method, *args: loop.run_in_executor(job_executor, method, *args)
+    params = job["params"]
+    files = []
+    heartbeat = asyncio.create_task(keep_lease(job["id"], worker))
+    try:
+        async with model_lease(params["model_version"]) as entry:
+            skip = await db(job_queue.completed_indexes, job["id"])
+            files = [(name, open(path, "rb")) for name, path in params["files"]]
+            documents = iter_documents(files, max_bytes=MAX_UPLOAD_BYTES)
+            results = iter_batch_results(documents, entry, heatmap_format=params["heatmap_format"], tiling=params["tiling"], skip=skip)
+            async for result in results:
+                await db(job_queue.add_result, job["id"], worker, result["index"], result)
+                job_documents_total.inc(outcome="error" if "error" in result else "scored")
+        status = await db(job_queue.finish, job["id"], worker)
+    except asyncio.CancelledError:
+        # Shutting down: hand the job back, keeping the results stored so far. The
+        # lifespan waits for the workers, so the write still runs on the job executor.
+        try:
+            await db(job_queue.requeue, job["id"], worker)
+        except Exception as e:
+            print(f"Could not requeue job {job['id']} ({e!r}); it is retried once its lease runs out")
+        raise
+    except JobLeaseLost as e:
+        print(f"{e}; leaving it to its new worker")
+        return False
+    except Exception as e:
+        # A version that does not exist will not appear on a retry.
+        retry = not (isinstance(e, UploadRejected) and e.status_code < 500)
+        status = await db(job_queue.fail, job["id"], worker, str(e), retry)
+        print(f"Job {job['id']} attempt {job['attempts']} failed ({e}), now {status}")
+    finally:
+        heartbeat.cancel()
+        for _, fileobj in files:
+            fileobj.close()
+    return status in ("done", "failed")
+
+def job_status(job):
+    return {
+        "id": job["id"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "documents_done": job.get("documents_done"),
+        "model_version": job["params"]["model_version"],
+        "error": job["error"],
+        "webhook_status": job["webhook_status"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+        "results_url": f"/jobs/{job['id']}/results",
+    }
+
+def post_webhook(url, payload):
+    data = json.dumps(payload).encode("utf-8")
+    for attempt in range(WEBHOOK_RETRIES):
+        try:
+            request = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"}, method="POST")
+            with urllib.request.urlopen(request, timeout=WEBHOOK_TIMEOUT_S) as response:
+                return f"delivered ({response.status})"
+        except Exception as e:
+            error = e
+            if attempt + 1 < WEBHOOK_RETRIES:
+                time.sleep(2 ** attempt)
+    return f"failed ({error})"
+
+async def deliver_webhook(job_id):
+    # The job's final status, without its results, which can be fetched from results_url.
+    loop = asyncio.get_running_loop()
+    job = await loop.run_in_executor(job_executor, job_queue.get, job_id)
+    if job is None or not job["webhook_url"]:
+        return
+    status = await loop.run_in_executor(job_executor, post_webhook, job["webhook_url"], job_status(job))
+    await loop.run_in_executor(job_executor, job_queue.set_webhook_status, job_id, status)
+
+@app.post("/jobs", status_code=202)
+async def submit_job(
+    files: List[UploadFile] = File(...),
+    # Backfills usually only need labels, so jobs skip the heatmap unless asked.
+    heatmap_format: HeatmapFormat = Query("none"),
+    tiled: bool = Query(False),
+    max_tiles: Optional[int] = Query(None, ge=1, le=TILE_BUDGET),
+    early_exit: Optional[float] = Query(None, ge=0.0, le=1.0),
+    model_version: Optional[str] = Query(None),
+    webhook_url: Optional[str] = Query(None),
+):
+    if webhook_url is not None and not webhook_url.startswith(("http://", "https://")):
+        return JSONResponse(status_code=422, content={"error": "webhook_url must be an http(s) URL", "code": "invalid_webhook_url"})
+    if model_version is not None and registry is not None and model_version not in registry.versions():
+        return JSONResponse(status_code=404, content={"error": f"Unknown model version '{model_version}'", "code": "unknown_model_version"})
+    params = {
+        "heatmap_format": heatmap_format,
+        "tiling": resolve_tiling(tiled, max_tiles, early_exit),
+        "model_version": model_version,
+    }
+    loop = asyncio.get_running_loop()
+    uploads = [(upload.filename, upload.file) for upload in files]
+    job_id = await loop.run_in_executor(job_executor, job_queue.submit, uploads, params, webhook_url)
+    return {"id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}", "results_url": f"/jobs/{job_id}/results"}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await asyncio.get_running_loop().run_in_executor(job_executor, job_queue.get, job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": f"Unknown job '{job_id}'", "code": "unknown_job"})
+    return job_status(job)
+
+@app.get("/jobs/{job_id}/results")
+async def get_job_results(job_id: str):
+    # Results stored so far, in document order; complete once the job is done.
+    if await asyncio.get_running_loop().run_in_executor(job_executor, job_queue.get, job_id) is None:
+        return JSONResponse(status_code=404, content={"error": f"Unknown job '{job_id}'", "code": "unknown_job"})
+    return StreamingResponse(stream_job_results(job_id), media_type="application/x-ndjson")
+
+async def stream_job_results(job_id, page_size=500):
+    loop = asyncio.get_running_loop()
+    after = -1
+    while True:
+        page = await loop.run_in_executor(job_executor, job_queue.results_page, job_id, after, page_size)
+        for result in page:
+            yield json.dumps(result) + "\n"
+        if len(page) < page_size:
+            return
+        after = page[-1]["index"]
+
+@app.post("/duplicates")
+async def find_duplicates(file: UploadFile = File(...)):
+    """Near-duplicates of an image among everything analysed so far, without running the model."""
+    if duplicate_index is None:
+        reason = "Duplicate index is disabled (FORGERY_DUPLICATES=0)" if not DUPLICATES_ENABLED else None
+        return JSONResponse(status_code=404, content={"error": reason, "code": "duplicates_disabled"}) if reason else not_ready_response()
+    loop = asyncio.get_running_loop()
+    try:
+        check_upload_size(file, MAX_UPLOAD_BYTES)
+        digest = await loop.run_in_executor(decode_executor, source_digest, file.file)
+        image = await loop.run_in_executor(decode_executor, decode_image, file.file)
+    except UploadRejected as e:
+        errors_total.inc(code=e.code)
+        return rejected_response(e)
+    except Exception as e:
+        return JSONResponse(status_code=400, content={"error": f"Could not decode image: {e}", "code": "invalid_image"})
+    phash, dhash = await loop.run_in_executor(decode_executor, image_signature, image)
+    started = time.perf_counter()
+    matches = await loop.run_in_executor(decode_executor, lambda: duplicate_index.search((phash, dhash), exclude=digest))
+    return {
+        "digest": digest,
+        "phash": f"{phash:016x}",
+        "dhash": f"{dhash:016x}",
+        "lookup_ms": round(1000 * (time.perf_counter() - started), 4),
+        "near_duplicates": describe_matches(matches),
+    }
+
+def admin_denied(token):
+    if ADMIN_TOKEN is None:
+        return JSONResponse(status_code=403, content={"error": "Admin endpoints are disabled; set FORGERY_ADMIN_TOKEN", "code": "admin_disabled"})
+    if token is None or not hmac.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        return JSONResponse(status_code=401, content={"error": "Missing or invalid X-Admin-Token", "code": "unauthorized"})
+    return None
+
+@app.get("/models")
+async def list_models():
+    if registry is None:
+        return not_ready_response()
+    return registry.stats()
+
+@app.post("/admin/models/{version}/activate")
+async def activate_model(version: str, x_admin_token: Optional[str] = Header(None)):
+    denied = admin_denied(x_admin_token)
+    if denied is not None:
+        return denied
+    if registry is None:
+        return not_ready_response()
+    # Loading and warmup happen before the swap; requests keep using the old
+    # version until then, and those already running finish on it.
+    loop = asyncio.get_running_loop()
+    try:
+        previous = await loop.run_in_executor(model_executor, switch_active, version)
+    except UnknownModelVersion as e:
+        return JSONResponse(status_code=404, content={"error": str(e), "code": "unknown_model_version"})
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": f"Could not load model version '{version}': {e}", "code": "model_version_failed"})
+    if shared_active is not None:
+        # The other pre-fork workers follow within ACTIVE_POLL_S.
+        shared_active.set(version)
+    return {"active": version, "previous": previous}
+
+@app.get("/healthz")
+async def healthz():
+    # Liveness only: the process is up and serving HTTP, loaded or not.
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    status = startup.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    # The job gauges query SQLite, so rendering stays off the event loop.
+    content = await asyncio.get_running_loop().run_in_executor(job_executor, metrics.render)
+    return Response(content=content, media_type=METRICS_CONTENT_TYPE)
+
+@app.get("/stats")
+async def stats():
+    jobs = await asyncio.get_running_loop().run_in_executor(job_executor, job_queue.stats) if job_queue else None
+    models = registry.stats() if registry else None
+    batching = models["resident"].get(models["active"], {}).get("batching") if models else None
+    return {"batching": batching, "admission": admission.stats(), "result_cache": result_cache.stats(),
+            "memory": memory_stats.stats(), "startup": startup.status(), "models": models,
+            "jobs": jobs,
+            "duplicates": duplicate_index.stats() if duplicate_index else None,
+            "worker": {"index": worker_index, "pid": os.getpid()}}
+
+def run_prefork(host, port, workers):
+    global shared_active
+    sock = bind_socket(host, port)
+    shared_active = SharedValue(ACTIVE_VERSION)
+    threads = threads_per_worker(workers)
+
+    def serve(index):
+        configure_worker(index, threads)
+        uvicorn.Server(uvicorn.Config(app, host=host, port=port)).run(sockets=[sock])
+
+    print(f"Starting Backend API on http://{host}:{port} with {workers} workers, {threads} torch threads each")
+    PreforkServer(serve, workers=workers, preload=preload_models).run()
 
 if __name__ == "__main__":
-    print("Starting Backend API on http://0.0.0.0:8000")
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    if WORKERS > 1:
+        run_prefork("0.0.0.0", 8000, WORKERS)
+    else:
+        print("Starting Backend API on http://0.0.0.0:8000")
+        uvicorn.run(app, host="0.0.0.0", port=8000)
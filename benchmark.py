@@ -0,0 +1,225 @@
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import numpy as np
+from PIL import Image
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(current_dir, 'frontend_streamlit'))
+
+from memory_usage import current_rss_bytes, peak_rss_bytes
+from preprocessing import load_image
+
+# name -> (format, width, height); roughly a web image, a phone photo, a
+# screenshot-like PNG and an uncompressed document scan.
+CASES = {
+    "jpeg_640x480": ("JPEG", 640, 480),
+    "jpeg_4032x3024": ("JPEG", 4032, 3024),
+    "png_1280x960": ("PNG", 1280, 960),
+    "tiff_5000x3500": ("TIFF", 5000, 3500),
+}
+
+# heatmap_format -> case suffix in the report.
+VARIANTS = {"overlay": "heatmap", "raw": "raw_cam", "none": "label"}
+
+
+def synthetic_image_bytes(fmt, width, height, seed):
+    # Smooth gradients plus mild noise compress like real photos; pure noise
+    # would make JPEG and PNG decode unrealistically slow.
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([x / width, y / height, (x + y) / (width + height)], axis=-1) * 200
+    small_noise = rng.normal(0, 12, size=(height // 8 + 1, width // 8 + 1, 3)).astype(np.float32)
+    noise = np.repeat(np.repeat(small_noise, 8, axis=0), 8, axis=1)[:height, :width]
+    pixels = np.clip(base + noise, 0, 255).astype(np.uint8)
+
+    buffer = io.BytesIO()
+    options = {"quality": 90} if fmt == "JPEG" else {}
+    Image.fromarray(pixels).save(buffer, format=fmt, **options)
+    return buffer.getvalue()
+
+
+class StageRecorder:
+    """stage_timer hook that accumulates the model's stage timings per iteration."""
+
+    def __init__(self):
+        self.current = defaultdict(float)
+
+    @contextmanager
+    def __call__(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.current[stage] += time.perf_counter() - start
+
+    def take(self):
+        timings, self.current = dict(self.current), defaultdict(float)
+        return timings
+
+
+def build_detector(weights, backend):
+    from model_loader import EagerBackend, ForgeryDetectionModel, create_network, default_device
+
+    detector = ForgeryDetectionModel(backend=backend)
+    if weights == "random":
+        # Same architecture and compute, no weights file needed.
+        device = default_device()
+        detector.model = create_network().to(device).eval()
+        detector.backend = EagerBackend(detector.model, device)
+    elif detector.backend is None:
+        return None
+    return detector
+
+
+def summarize(samples):
+    values = np.asarray(samples) * 1000.0
+    return {
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "mean_ms": float(values.mean()),
+    }
+
+
+def run_case(detector, recorder, data, heatmap_format, warmup, repeats):
+    samples = defaultdict(list)
+    for iteration in range(warmup + repeats):
+        start = time.perf_counter()
+        image = load_image(data)
+        decoded = time.perf_counter()
+        detector.predict(image, heatmap_format=heatmap_format)
+        end = time.perf_counter()
+
+        stages = recorder.take()
+        if iteration < warmup:
+            continue
+        samples["decode"].append(decoded - start)
+        samples["predict"].append(end - decoded)
+        samples["end_to_end"].append(end - start)
+        for stage, seconds in stages.items():
+            samples[stage].append(seconds)
+
+    total = sum(samples["end_to_end"])
+    return {
+        "stages": {stage: summarize(values) for stage, values in sorted(samples.items())},
+        "throughput_img_s": repeats / total if total else 0.0,
+    }
+
+
+def run_benchmarks(args):
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "backend": args.backend,
+            "repeats": args.repeats,
+            "warmup": args.warmup,
+            "seed": args.seed,
+        },
+        "results": {},
+    }
+    if args.threads:
+        import torch
+        torch.set_num_threads(args.threads)
+        report["environment"]["torch_threads"] = args.threads
+
+    inputs = {}
+    for name in args.cases:
+        fmt, width, height = CASES[name]
+        inputs[name] = synthetic_image_bytes(fmt, width, height, args.seed)
+
+    for weights in args.weights:
+        rss_before = current_rss_bytes()
+        detector = build_detector(weights, args.backend)
+        if detector is None:
+            print(f"Skipping {weights} weights: no {args.backend} artifact found", file=sys.stderr)
+            continue
+        recorder = StageRecorder()
+        detector.stage_timer = recorder
+
+        results = {"load_rss_bytes": current_rss_bytes() - rss_before, "cases": {}}
+        for name, data in inputs.items():
+            for heatmap_format, suffix in VARIANTS.items():
+                variant = f"{name}/{suffix}"
+                results["cases"][variant] = run_case(detector, recorder, data, heatmap_format, args.warmup, args.repeats)
+                results["cases"][variant]["input_bytes"] = len(data)
+                print(f"{weights} {variant}: {results['cases'][variant]['stages']['end_to_end']['p50_ms']:.1f} ms p50", file=sys.stderr)
+        report["results"][weights] = results
+
+    report["peak_rss_bytes"] = peak_rss_bytes()
+    return report
+
+
+def compare(report, baseline, threshold, metric):
+    """List every stage whose ``metric`` got slower than ``baseline`` by more than ``threshold``."""
+    regressions = []
+    for weights, results in report["results"].items():
+        baseline_cases = baseline.get("results", {}).get(weights, {}).get("cases", {})
+        for variant, case in results["cases"].items():
+            for stage, summary in case["stages"].items():
+                previous = baseline_cases.get(variant, {}).get("stages", {}).get(stage)
+                if not previous or not previous.get(metric):
+                    continue
+                ratio = summary[metric] / previous[metric]
+                if ratio > 1.0 + threshold:
+                    regressions.append({
+                        "weights": weights,
+                        "case": variant,
+                        "stage": stage,
+                        "baseline_ms": previous[metric],
+                        "current_ms": summary[metric],
+                        "ratio": ratio,
+                    })
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ForgeryDetectionModel.predict end to end and per stage.")
+    parser.add_argument("--cases", nargs="+", default=list(CASES), choices=list(CASES))
+    parser.add_argument("--weights", nargs="+", default=["file", "random"], choices=["file", "random"],
+                        help="file: the configured model artifact; random: freshly initialised eager weights")
+    parser.add_argument("--backend", default=None, help="Backend for the file weights (defaults to FORGERY_BACKEND)")
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--threads", type=int, default=0, help="torch.set_num_threads for reproducible numbers (0 = default)")
+    parser.add_argument("--output", help="Write the JSON report here (use it later as --baseline)")
+    parser.add_argument("--baseline", help="Previous report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Allowed relative slowdown before failing")
+    parser.add_argument("--metric", default="p50_ms", choices=["p50_ms", "p95_ms", "p99_ms", "mean_ms"])
+    args = parser.parse_args()
+
+    report = run_benchmarks(args)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold, args.metric)
+        report["comparison"] = {
+            "baseline": args.baseline,
+            "metric": args.metric,
+            "threshold": args.threshold,
+            "regressions": regressions,
+            "passed": not regressions,
+        }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+    if args.baseline and report["comparison"]["regressions"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
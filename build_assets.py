@@ -0,0 +1,121 @@
+import argparse
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import sys
+import urllib.request
+
+from PIL import Image
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+ASSETS_DIR = os.path.join(current_dir, "frontend_streamlit", "assets")
+# Served by Streamlit at app/static/ (server.enableStaticServing in .streamlit/config.toml).
+STATIC_DIR = os.path.join(current_dir, "frontend_streamlit", "static")
+MANIFEST_PATH = os.path.join(STATIC_DIR, "manifest.json")
+
+# name -> (source, longest side in px, WebP quality). The upload icon is shown
+# at 128 CSS px, so 256 px covers 2x displays; the hero is a blurred backdrop.
+IMAGES = {
+    "hero_banner": ("hero_banner.png", 1024, 70),
+    "fingerprint_icon": ("fingerprint_icon.png", 256, 85),
+}
+
+FONTS_CSS_URL = "https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700&family=Orbitron:wght@400;700&display=swap"
+LOTTIE_URL = "https://lottie.host/9e017688-660b-4277-b9c0-8260a9270df8/jS27rFjV9U.json"
+# Google Fonts only serves woff2 to browsers it recognises.
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36"
+
+
+def fetch(url):
+    request = urllib.request.Request(url, headers={"User-Agent": USER_AGENT})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return response.read()
+
+
+def write_hashed(name, extension, data, subdir=""):
+    # Content-hashed names let browsers and proxies cache assets indefinitely.
+    filename = f"{name}.{hashlib.sha256(data).hexdigest()[:10]}{extension}"
+    directory = os.path.join(STATIC_DIR, subdir)
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, filename), "wb") as f:
+        f.write(data)
+    return os.path.join(subdir, filename) if subdir else filename
+
+
+def build_image(name, source, max_side, quality):
+    source_path = os.path.join(ASSETS_DIR, source)
+    image = Image.open(source_path).convert("RGB")
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, format="WEBP", quality=quality, method=6)
+    path = write_hashed(name, ".webp", buffer.getvalue())
+    return path, os.path.getsize(source_path), len(buffer.getvalue())
+
+
+def build_fonts():
+    """Download the Latin woff2 files and rewrite the stylesheet to point at them."""
+    css = fetch(FONTS_CSS_URL).decode("utf-8")
+    # Keep only the latin subset; the UI has no other scripts.
+    blocks = re.findall(r"/\* latin \*/\s*(@font-face\s*{[^}]*})", css)
+    if not blocks:
+        raise RuntimeError("Unexpected Google Fonts stylesheet: no latin @font-face blocks")
+
+    rewritten, total = [], 0
+    for block in blocks:
+        url = re.search(r"url\((https://[^)]+)\)", block).group(1)
+        data = fetch(url)
+        total += len(data)
+        path = write_hashed(os.path.splitext(os.path.basename(url))[0], ".woff2", data, subdir="fonts")
+        # Relative to the stylesheet, which sits in the same fonts/ directory.
+        rewritten.append(block.replace(url, os.path.basename(path)))
+    stylesheet = "\n".join(rewritten).encode("utf-8")
+    return write_hashed("fonts", ".css", stylesheet, subdir="fonts"), total + len(stylesheet)
+
+
+def build_lottie():
+    data = fetch(LOTTIE_URL)
+    json.loads(data)
+    return write_hashed("scan", ".json", data, subdir="lottie"), len(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the optimised static assets served by the Streamlit UI.")
+    parser.add_argument("--offline", action="store_true", help="Only convert the bundled images; skip downloading fonts and the Lottie animation")
+    parser.add_argument("--clean", action="store_true", help="Remove previously built assets first")
+    args = parser.parse_args()
+
+    if args.clean and os.path.isdir(STATIC_DIR):
+        shutil.rmtree(STATIC_DIR)
+
+    manifest = {}
+    if os.path.exists(MANIFEST_PATH):
+        with open(MANIFEST_PATH) as f:
+            manifest = json.load(f)
+
+    report = {}
+    for name, (source, max_side, quality) in IMAGES.items():
+        path, before, after = build_image(name, source, max_side, quality)
+        manifest[name] = path
+        report[name] = {"source_bytes": before, "built_bytes": after, "path": path}
+
+    if not args.offline:
+        for name, build in (("fonts_css", build_fonts), ("lottie_scan", build_lottie)):
+            try:
+                manifest[name], size = build()
+                report[name] = {"built_bytes": size, "path": manifest[name]}
+            except Exception as e:
+                # Keep whatever an earlier online build produced.
+                print(f"Could not fetch {name}: {e}", file=sys.stderr)
+                report[name] = {"error": str(e), "path": manifest.get(name)}
+
+    os.makedirs(STATIC_DIR, exist_ok=True)
+    with open(MANIFEST_PATH, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
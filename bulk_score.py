@@ -0,0 +1,334 @@
+import argparse
+import base64
+import csv
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(current_dir, 'frontend_streamlit'))
+
+from documents import is_image_name
+from pages import document_verdict, inspect_document, is_paged, predict_pages
+from preprocessing import Preprocessor, load_image
+from result_cache import content_digest
+
+COLUMNS = ["path", "digest", "label", "is_forged", "confidence", "forged_probability", "pages", "forged_pages", "heatmap", "error"]
+
+
+def read_manifest(path):
+    """Paths from a text file (one per line) or a CSV with a ``path`` column, relative to the manifest."""
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, newline="") as f:
+        if path.endswith(".csv"):
+            entries = [row["path"] for row in csv.DictReader(f)]
+        else:
+            entries = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    return [entry if os.path.isabs(entry) else os.path.join(base, entry) for entry in entries]
+
+
+def collect_paths(inputs, manifest=None):
+    paths = []
+    for path in inputs:
+        if os.path.isdir(path):
+            # PDFs and multi-page TIFFs are scored as one document each.
+            paths.extend(sorted(
+                os.path.join(root, name) for root, _, files in os.walk(path)
+                for name in files if is_image_name(name) or name.lower().endswith(".pdf")
+            ))
+        else:
+            paths.append(path)
+    if manifest:
+        paths.extend(read_manifest(manifest))
+    return paths
+
+
+def decode_chunk(paths, size, max_pixels):
+    """Runs in a decode worker: read, hash, decode and resize each path to ``size`` uint8 pixels.
+
+    Returns one ``(digest, pixels, error)`` per path; ``pixels`` is None for
+    PDFs and multi-page TIFFs, which the main process scores page by page.
+    """
+    preprocessor = Preprocessor(size=size)
+    decoded = []
+    for path in paths:
+        digest = None
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            digest = content_digest(data)
+            if is_paged(*inspect_document(data, max_pixels)):
+                decoded.append((digest, None, None))
+                continue
+            decoded.append((digest, preprocessor.resize(load_image(data, size=size, max_pixels=max_pixels)), None))
+        except Exception as e:
+            # Decompression bombs, truncated files, unsupported formats...: one bad file is one error row.
+            decoded.append((digest, None, str(e) or type(e).__name__))
+    return decoded
+
+
+class ResultWriter:
+    """Appends result rows to a CSV, JSONL or Parquet output; ``commit`` makes them durable.
+
+    CSV and JSONL grow one file whose committed size is kept in the
+    checkpoint, so rows written after the last commit are cut off on resume.
+    Parquet output is a directory with one part file per commit, since a
+    Parquet file cannot be appended to.
+    """
+
+    def __init__(self, path, state=None):
+        self.path = path
+        self.format = "parquet" if path.endswith(".parquet") else "jsonl" if path.endswith(".jsonl") else "csv"
+        self.rows = []
+        self.state = dict(state or {"bytes": 0, "parts": 0})
+        if self.format == "parquet":
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                sys.exit("Parquet output needs pyarrow (pip install pyarrow)")
+            os.makedirs(path, exist_ok=True)
+            # Parts written after the last commit are incomplete.
+            for name in os.listdir(path):
+                if name.startswith("part-") and int(name[5:10]) >= self.state["parts"]:
+                    os.remove(os.path.join(path, name))
+        elif os.path.exists(path):
+            os.truncate(path, self.state["bytes"])
+
+    def add(self, row):
+        self.rows.append(row)
+
+    def commit(self):
+        if not self.rows:
+            return self.state
+        if self.format == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pylist(self.rows, schema=parquet_schema())
+            pq.write_table(table, os.path.join(self.path, f"part-{self.state['parts']:05d}.parquet"))
+            self.state["parts"] += 1
+        else:
+            with open(self.path, "a", newline="") as f:
+                if self.format == "jsonl":
+                    f.writelines(json.dumps(row) + "\n" for row in self.rows)
+                else:
+                    writer = csv.DictWriter(f, fieldnames=COLUMNS)
+                    if self.state["bytes"] == 0:
+                        writer.writeheader()
+                    writer.writerows({**row, "forged_pages": json.dumps(row["forged_pages"]) if row["forged_pages"] else ""} for row in self.rows)
+                f.flush()
+                os.fsync(f.fileno())
+                self.state["bytes"] = f.tell()
+        self.rows = []
+        return self.state
+
+
+def parquet_schema():
+    import pyarrow as pa
+    return pa.schema([
+        ("path", pa.string()), ("digest", pa.string()), ("label", pa.string()), ("is_forged", pa.bool_()),
+        ("confidence", pa.float64()), ("forged_probability", pa.float64()), ("pages", pa.int64()),
+        ("forged_pages", pa.list_(pa.int64())), ("heatmap", pa.string()), ("error", pa.string()),
+    ])
+
+
+class Checkpoint:
+    """Progress of a run in a small JSON file, replaced atomically after every commit."""
+
+    def __init__(self, path, paths, restart=False):
+        self.path = path
+        self.inputs = hashlib.sha256("\n".join(paths).encode("utf-8")).hexdigest()
+        self.done, self.writer_state = 0, None
+        if os.path.exists(path) and not restart:
+            with open(path) as f:
+                saved = json.load(f)
+            if saved["inputs"] != self.inputs:
+                sys.exit(f"{path} belongs to a different input list; pass --restart to start over")
+            self.done, self.writer_state = saved["done"], saved["writer"]
+
+    def save(self, done, writer_state):
+        self.done = done
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w") as f:
+            json.dump({"inputs": self.inputs, "done": done, "writer": writer_state}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+
+
+class Progress:
+    """Live images/sec on stderr: a rewritten line on a terminal, a log line every 10 s otherwise."""
+
+    def __init__(self, total, done=0):
+        self.total = total
+        self.start_done = done
+        self.started = time.perf_counter()
+        self.recent = deque([(self.started, done)])
+        self.interactive = sys.stderr.isatty()
+        self.last_print = 0.0
+
+    def update(self, done, final=False):
+        now = time.perf_counter()
+        self.recent.append((now, done))
+        while len(self.recent) > 2 and now - self.recent[0][0] > 10:
+            self.recent.popleft()
+        if not final and now - self.last_print < (0.5 if self.interactive else 10):
+            return
+        self.last_print = now
+        (then, done_then) = self.recent[0]
+        rate = (done - done_then) / (now - then) if now > then else 0.0
+        overall = (done - self.start_done) / (now - self.started) if now > self.started else 0.0
+        eta = (self.total - done) / rate if rate else float("inf")
+        line = f"{done}/{self.total} images  {rate:.1f} img/s now  {overall:.1f} img/s overall  ETA {eta:.0f}s"
+        print(("\r" + line) if self.interactive else line, end="\n" if final or not self.interactive else "", file=sys.stderr, flush=True)
+
+
+def result_row(path, digest, result, heatmap=None, error=None):
+    row = dict.fromkeys(COLUMNS)
+    row.update(path=path, digest=digest, heatmap=heatmap, error=error)
+    if result is not None:
+        row.update(
+            label=result.get("label"),
+            is_forged=result.get("is_forged"),
+            confidence=result.get("confidence"),
+            forged_probability=(result.get("details") or {}).get("forged_probability"),
+            error=result.get("error") or error,
+        )
+        if "pages" in result:
+            row.update(pages=result["page_count"], forged_pages=result.get("forged_pages"))
+    return row
+
+
+def write_heatmap(directory, index, path, result):
+    encoded = result.pop("heatmap_b64", None)
+    if not encoded:
+        return None
+    name = f"{index:08d}_{os.path.splitext(os.path.basename(path))[0]}.png"
+    with open(os.path.join(directory, name), "wb") as f:
+        f.write(base64.b64decode(encoded))
+    return name
+
+
+def score_documents(detector, data, max_pixels=None):
+    """Verdict for a PDF or multi-page TIFF, scored page by page as ``/analyze/pages`` does."""
+    pages = list(predict_pages(detector, data, max_pixels=max_pixels, explain=False, heatmap_format="none"))
+    return {**document_verdict(pages), "pages": pages}
+
+
+def score_chunks(detector, paths, start=0, workers=1, batch_size=32, prefetch=2, max_pixels=None, heatmap_format="none"):
+    """Score ``paths[start:]`` a batch at a time, yielding ``(offset, [(path, digest, result, error), ...])``.
+
+    Decoding runs in ``workers`` processes, at most ``prefetch`` batches ahead
+    of inference, which stays in this process. Chunks are yielded in order.
+    """
+    size = detector.preprocessor.size
+    # spawn: decode workers start clean instead of inheriting torch's state.
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    chunks = ((offset, paths[offset:offset + batch_size]) for offset in range(start, len(paths), batch_size))
+    pending = deque()
+    try:
+        while True:
+            while len(pending) < prefetch:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                offset, chunk_paths = chunk
+                pending.append((offset, chunk_paths, executor.submit(decode_chunk, chunk_paths, size, max_pixels)))
+            if not pending:
+                return
+
+            offset, chunk_paths, future = pending.popleft()
+            decoded = future.result()
+            images = [(i, pixels) for i, (_, pixels, _) in enumerate(decoded) if pixels is not None]
+            results = {}
+            if images:
+                resized = [pixels for _, pixels in images]
+                predictions = detector.predict_preprocessed(detector.preprocessor.normalize_batch(resized), resized, heatmap_format=heatmap_format)
+                results = {i: prediction for (i, _), prediction in zip(images, predictions)}
+
+            scored = []
+            for i, (path, (digest, pixels, error)) in enumerate(zip(chunk_paths, decoded)):
+                result = results.get(i)
+                if error is None and pixels is None:
+                    try:
+                        with open(path, "rb") as f:
+                            result = score_documents(detector, f.read(), max_pixels)
+                    except Exception as e:
+                        error = str(e)
+                scored.append((path, digest, result, error))
+            yield offset, scored
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def run(args):
+    from model_loader import ForgeryDetectionModel
+
+    paths = collect_paths(args.inputs, args.manifest)
+    if not paths:
+        sys.exit("No images found")
+    detector = ForgeryDetectionModel()
+    if detector.backend is None:
+        # Without weights the detector returns mock verdicts, which must never reach a results file.
+        sys.exit(f"No {detector.backend_name} weights in {detector.models_dir}; nothing to score")
+    checkpoint = Checkpoint(args.checkpoint or f"{args.output}.checkpoint.json", paths, restart=args.restart)
+    writer = ResultWriter(args.output, checkpoint.writer_state)
+    if checkpoint.done:
+        print(f"Resuming after {checkpoint.done} of {len(paths)} documents", file=sys.stderr)
+    if args.heatmaps:
+        os.makedirs(args.heatmaps, exist_ok=True)
+
+    progress = Progress(len(paths), checkpoint.done)
+    done = last_commit = checkpoint.done
+    chunks = score_chunks(detector, paths, checkpoint.done, args.workers, args.batch_size, args.prefetch, args.max_pixels,
+                          heatmap_format="overlay" if args.heatmaps else "none")
+    for offset, scored in chunks:
+        for i, (path, digest, result, error) in enumerate(scored):
+            heatmap = write_heatmap(args.heatmaps, offset + i, path, result) if args.heatmaps and result else None
+            writer.add(result_row(path, digest, result, heatmap, error))
+        done = offset + len(scored)
+        if done - last_commit >= args.checkpoint_every:
+            checkpoint.save(done, writer.commit())
+            last_commit = done
+        progress.update(done)
+    checkpoint.save(done, writer.commit())
+    progress.update(done, final=True)
+
+    seconds = time.perf_counter() - progress.started
+    scored = done - progress.start_done
+    print(json.dumps({
+        "documents": len(paths),
+        "scored": scored,
+        "resumed_after": progress.start_done,
+        "output": args.output,
+        "seconds": round(seconds, 3),
+        "documents_per_s": round(scored / seconds, 1) if seconds else None,
+    }, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a directory or manifest of images offline, with resumable output.")
+    parser.add_argument("inputs", nargs="*", help="Image files, PDFs and directories (searched recursively)")
+    parser.add_argument("--manifest", help="Text file with one path per line, or a CSV with a path column")
+    parser.add_argument("--output", required=True, help="Results file: .csv, .jsonl or .parquet (a directory of parts)")
+    parser.add_argument("--heatmaps", help="Directory for Grad-CAM overlay PNGs (skipped when unset)")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1), help="Decode worker processes")
+    parser.add_argument("--batch-size", type=int, default=32, help="Images per forward pass")
+    parser.add_argument("--prefetch", type=int, default=0, help="Batches decoded ahead of inference (default: 2 per worker)")
+    parser.add_argument("--max-pixels", type=int, default=50_000_000, help="Skip images larger than this (checked from the header)")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: <output>.checkpoint.json)")
+    parser.add_argument("--checkpoint-every", type=int, default=1000, help="Commit output and checkpoint every N documents")
+    parser.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint and start from the beginning")
+    args = parser.parse_args()
+    if not args.inputs and not args.manifest:
+        parser.error("pass input paths or --manifest")
+    args.prefetch = args.prefetch or 2 * args.workers
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
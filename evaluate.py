@@ -0,0 +1,152 @@
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(current_dir, 'frontend_streamlit'))
+
+from bulk_score import Progress, score_chunks
+from evaluation import LABEL_FOLDERS, calibration, classification_metrics, load_labeled_folder, pr_curve, roc_curve, thin_curve
+from model_loader import BACKEND_ARTIFACTS, DEFAULT_BACKEND, MODELS_DIR
+
+# The artifact the Streamlit metrics tabs read, next to the weights it describes.
+METRICS_FILENAME = "metrics.json"
+
+
+def as_list(values, digits=6):
+    # JSON has no infinity: the threshold above every score is written as null.
+    return [None if not np.isfinite(value) else round(float(value), digits) for value in values]
+
+
+def score_dataset(detector, paths, args):
+    """Forged probability per path (NaN where it could not be scored) and ``(index, path, error)`` per failure."""
+    probabilities = np.full(len(paths), np.nan)
+    failed = []
+    progress = Progress(len(paths))
+    for offset, scored in score_chunks(detector, paths, 0, args.workers, args.batch_size, 2 * args.workers, args.max_pixels):
+        for i, (path, _, result, error) in enumerate(scored):
+            error = error or (result or {}).get("error")
+            if error:
+                failed.append((offset + i, path, error))
+            else:
+                probabilities[offset + i] = result["details"]["forged_probability"]
+        progress.update(offset + len(scored))
+    progress.update(len(paths), final=True)
+    return probabilities, failed
+
+
+def build_report(labels, probabilities, args):
+    fpr, tpr, roc_thresholds, auc = roc_curve(labels, probabilities)
+    precision, recall, pr_thresholds, average_precision = pr_curve(labels, probabilities)
+    with np.errstate(invalid="ignore"):
+        f1 = np.nan_to_num(2 * precision * recall / (precision + recall))
+    best = int(np.argmax(f1))
+    best_f1 = {"f1": float(f1[best]), "threshold": float(pr_thresholds[best])}
+    reliability = calibration(labels, probabilities, args.bins)
+
+    fpr, tpr, roc_thresholds = thin_curve(args.curve_points, fpr, tpr, roc_thresholds)
+    precision, recall, pr_thresholds = thin_curve(args.curve_points, precision, recall, pr_thresholds)
+    return {
+        "threshold": args.threshold,
+        "metrics": classification_metrics(labels, probabilities >= args.threshold),
+        "roc": {"auc": auc, "fpr": as_list(fpr), "tpr": as_list(tpr), "thresholds": as_list(roc_thresholds)},
+        "pr": {
+            "average_precision": average_precision,
+            "best_f1": best_f1,
+            "precision": as_list(precision),
+            "recall": as_list(recall),
+            "thresholds": as_list(pr_thresholds),
+        },
+        "calibration": {
+            "ece": reliability["ece"],
+            "brier": reliability["brier"],
+            "bin_edges": as_list(reliability["bin_edges"]),
+            "counts": reliability["counts"].tolist(),
+            "mean_probability": as_list(reliability["mean_probability"]),
+            "forged_rate": as_list(reliability["positive_rate"]),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the model on a labeled dataset and write the metrics the UI shows.")
+    parser.add_argument("data_dir", help="Folder with authentic/ and forged/ sub-folders")
+    parser.add_argument("--models-dir", default=MODELS_DIR, help="Weights to evaluate, e.g. a models/versions/<name> folder")
+    parser.add_argument("--backend", default=DEFAULT_BACKEND, choices=sorted(BACKEND_ARTIFACTS))
+    parser.add_argument("--output", help=f"Metrics artifact (default: <models-dir>/{METRICS_FILENAME})")
+    parser.add_argument("--threshold", type=float, default=0.5, help="Forged probability at or above which an image counts as forged")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1), help="Decode worker processes")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--max-pixels", type=int, default=50_000_000)
+    parser.add_argument("--bins", type=int, default=10, help="Calibration bins")
+    parser.add_argument("--curve-points", type=int, default=200, help="Points kept per ROC/PR curve in the artifact")
+    args = parser.parse_args()
+    output = args.output or os.path.join(args.models_dir, METRICS_FILENAME)
+
+    from model_loader import ForgeryDetectionModel
+
+    paths, labels = load_labeled_folder(args.data_dir)
+    started = time.perf_counter()
+    detector = ForgeryDetectionModel(backend=args.backend, models_dir=args.models_dir)
+    if detector.backend is None:
+        sys.exit(f"No {args.backend} weights in {args.models_dir}; nothing to evaluate")
+    load_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    probabilities, failed = score_dataset(detector, paths, args)
+    seconds = time.perf_counter() - started
+    scored = ~np.isnan(probabilities)
+    class_names = {label: name for name, label in LABEL_FOLDERS.items()}
+    for _, path, error in failed:
+        print(f"Could not score {path}: {error}", file=sys.stderr)
+    if not scored.any():
+        sys.exit("No image could be scored")
+
+    report = {
+        "dataset": os.path.abspath(args.data_dir),
+        "files": len(paths),
+        "images": int(scored.sum()),
+        "class_counts": {name: int(np.count_nonzero(labels[scored] == label)) for name, label in LABEL_FOLDERS.items()},
+        # Files that could not be decoded or scored are left out of every metric below.
+        "failed": {
+            "count": len(failed),
+            "by_class": {name: int(np.count_nonzero(labels[~scored] == label)) for name, label in LABEL_FOLDERS.items()},
+            "files": [{"path": path, "label": class_names[int(labels[index])], "error": error} for index, path, error in failed],
+        },
+        "model": {"models_dir": os.path.abspath(args.models_dir), "backend": args.backend, "fingerprint": detector.fingerprint},
+        **build_report(labels[scored], probabilities[scored], args),
+        "timing": {
+            "workers": args.workers,
+            "batch_size": args.batch_size,
+            "load_seconds": round(load_seconds, 3),
+            "seconds": round(seconds, 3),
+            "images_per_s": round(len(paths) / seconds, 1),
+        },
+        "evaluated_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+    # Written whole and renamed, so the UI never reads a half-written file.
+    temporary = f"{output}.tmp"
+    with open(temporary, "w") as f:
+        json.dump(report, f, indent=2)
+    os.replace(temporary, output)
+
+    summary = {key: report[key] for key in ("images", "class_counts", "threshold", "metrics", "timing")}
+    summary.update(
+        roc_auc=report["roc"]["auc"],
+        average_precision=report["pr"]["average_precision"],
+        best_f1=report["pr"]["best_f1"],
+        ece=report["calibration"]["ece"],
+        brier=report["calibration"]["brier"],
+        failed=report["failed"]["count"],
+        output=output,
+    )
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import torch
+from PIL import Image
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(current_dir, 'frontend_streamlit'))
+
+from graph_export import GradCamExportWrapper
+from model_loader import (
+    MODEL_PATH,
+    ONNX_PATH,
+    TORCHSCRIPT_PATH,
+    ForgeryDetectionModel,
+    load_network,
+    softmax,
+)
+
+
+def export_torchscript(model, path):
+    wrapper = GradCamExportWrapper(model).eval()
+    example = torch.randn(1, 3, 224, 224)
+    with torch.no_grad():
+        traced = torch.jit.trace(wrapper, example)
+        traced = torch.jit.freeze(traced)
+    traced.save(path)
+    print(f"TorchScript model written to {path}")
+
+
+def export_onnx(model, path, opset):
+    wrapper = GradCamExportWrapper(model).eval()
+    example = torch.randn(1, 3, 224, 224)
+    torch.onnx.export(
+        wrapper,
+        (example,),
+        path,
+        input_names=["input"],
+        output_names=["logits", "cam"],
+        dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}, "cam": {0: "batch"}},
+        opset_version=opset,
+        dynamo=False,
+    )
+    print(f"ONNX model written to {path}")
+
+
+def synthetic_images(count, seed):
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        height, width = rng.integers(200, 900, size=2)
+        pixels = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+        images.append(Image.fromarray(pixels))
+    return images
+
+
+def check_parity(backends, tolerance, count=8, seed=0):
+    """Compare every backend's probabilities (and Grad-CAMs) against eager."""
+    images = synthetic_images(count, seed)
+    reference = ForgeryDetectionModel(backend="eager")
+    if reference.backend is None:
+        raise SystemExit("Parity check needs the eager weights at " + MODEL_PATH)
+
+    # Copied out of the preprocessor's reusable buffer, which later calls overwrite.
+    batch = reference.preprocessor.batch(images)[0].copy()
+    ref_logits, ref_cams = reference.backend.infer(batch)
+    ref_probs = softmax(ref_logits)
+
+    report = {"tolerance": tolerance, "images": count, "backends": {}}
+    ok = True
+    for name in backends:
+        if name == "eager":
+            continue
+        candidate = ForgeryDetectionModel(backend=name)
+        if candidate.backend is None:
+            report["backends"][name] = {"error": "artifact missing or failed to load"}
+            ok = False
+            continue
+
+        logits, cams = candidate.backend.infer(batch)
+        probs = softmax(logits)
+        prob_diff = float(np.abs(probs - ref_probs).max())
+
+        # CAMs are compared after per-image min-max normalisation, as rendered.
+        def normalise(c):
+            c = c - c.min(axis=(1, 2), keepdims=True)
+            return c / (1e-7 + c.max(axis=(1, 2), keepdims=True))
+        cam_diff = float(np.abs(normalise(cams) - normalise(ref_cams)).max())
+
+        passed = prob_diff <= tolerance
+        ok = ok and passed
+        report["backends"][name] = {
+            "max_probability_diff": prob_diff,
+            "max_cam_diff": cam_diff,
+            "labels_agree": bool((probs.argmax(1) == ref_probs.argmax(1)).all()),
+            "passed": passed,
+        }
+    report["passed"] = ok
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the forgery model to TorchScript/ONNX and check backend parity.")
+    parser.add_argument("--formats", nargs="+", default=["torchscript", "onnx"], choices=["torchscript", "onnx"])
+    parser.add_argument("--opset", type=int, default=17)
+    parser.add_argument("--skip-export", action="store_true", help="Only run the parity check on existing artifacts")
+    parser.add_argument("--tolerance", type=float, default=1e-4, help="Maximum allowed absolute probability difference")
+    args = parser.parse_args()
+
+    if not args.skip_export:
+        model = load_network(MODEL_PATH, torch.device("cpu"))
+        if "torchscript" in args.formats:
+            export_torchscript(model, TORCHSCRIPT_PATH)
+        if "onnx" in args.formats:
+            export_onnx(model, ONNX_PATH, args.opset)
+
+    report = check_parity(args.formats, args.tolerance)
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report["passed"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,12 @@
 import streamlit as st
-import requests
 from streamlit_lottie import st_lottie
 import time
 from PIL import Image
 import os
 import base64
 import io
+import json
+import numpy as np
 
 
 st.set_page_config(
@@ -16,11 +17,124 @@ st.set_page_config(
 )
 
 
+# local: run the model in this process; remote: send uploads to backend_api.py
+# so UI replicas never import torch or load the weights.
+INFERENCE_MODE = os.environ.get("FORGERY_INFERENCE_MODE", "local")
+
 @st.cache_resource
-def get_model():
-    
+def get_remote_detector():
+    from remote_client import RemoteDetector
+    return RemoteDetector(
+        os.environ.get("FORGERY_BACKEND_URL", "http://localhost:8000"),
+        connect_timeout=float(os.environ.get("FORGERY_REMOTE_CONNECT_TIMEOUT_S", "3")),
+        read_timeout=float(os.environ.get("FORGERY_REMOTE_READ_TIMEOUT_S", "60")),
+        retries=int(os.environ.get("FORGERY_REMOTE_RETRIES", "3")),
+    )
+
+def get_models_dir():
+    # FORGERY_MODEL_VERSION picks a registry version, as it does for the API.
+    from model_loader import MODELS_DIR
+    from model_registry import ACTIVE_VERSION, discover_versions
+    return discover_versions(MODELS_DIR).get(ACTIVE_VERSION, MODELS_DIR)
+
+@st.cache_resource(max_entries=1)
+def get_model(weights_stamp=None, models_dir=None):
+    # weights_stamp changes with the weights file, so a new file reloads the model
     from model_loader import ForgeryDetectionModel
-    return ForgeryDetectionModel()
+    return ForgeryDetectionModel(models_dir=models_dir)
+
+def get_weights_stamp(models_dir):
+    from model_loader import BACKEND_ARTIFACTS, DEFAULT_BACKEND
+    try:
+        stat = os.stat(os.path.join(models_dir, os.path.basename(BACKEND_ARTIFACTS[DEFAULT_BACKEND])))
+        return (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+@st.cache_data
+def load_metrics(path, stamp=None):
+    # Written by evaluate.py next to the weights it measured; stamp changes when it is rewritten.
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def get_metrics():
+    path = os.path.join(get_models_dir(), "metrics.json")
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return load_metrics(path, (stat.st_mtime_ns, stat.st_size))
+
+@st.cache_resource
+def get_result_cache():
+    from result_cache import ResultCache
+    return ResultCache(
+        max_entries=int(os.environ.get("FORGERY_CACHE_SIZE", "256")),
+        disk_dir=os.environ.get("FORGERY_CACHE_DIR") or None,
+    )
+
+# Derived artifacts per upload (preview, decoded pixels, heatmap) are memoized
+# by content hash so reruns and widget toggles do no image work.
+MEMO_ENTRIES = int(os.environ.get("FORGERY_UI_MEMO_ENTRIES", "64"))
+
+def get_upload_digest(uploaded_file):
+    # Hashed once per upload; reruns find it again through the uploader's file_id.
+    cached = st.session_state.get("upload_digest")
+    if cached and cached[0] == uploaded_file.file_id:
+        return cached[1]
+    from result_cache import content_digest
+    digest = content_digest(uploaded_file.getvalue())
+    st.session_state.upload_digest = (uploaded_file.file_id, digest)
+    return digest
+
+# Parameters starting with an underscore are not hashed, so only the digest keys these caches.
+@st.cache_data(max_entries=MEMO_ENTRIES)
+def get_preview_b64(digest, _data):
+    # CLOUD OPTIMIZATION: Resize image server-side (400px) + Base64 for custom HTML
+    # The first page stands in for PDFs and multi-page TIFFs.
+    from pages import iter_pages
+    pages = iter_pages(_data, size=200)
+    _, img_preview = next(pages)
+    pages.close()
+    img_preview.thumbnail((400, 400))
+    buffered = io.BytesIO()
+    if img_preview.mode != "RGB":
+        img_preview = img_preview.convert("RGB")
+    img_preview.save(buffered, format="JPEG", quality=70)
+    return base64.b64encode(buffered.getvalue()).decode()
+
+@st.cache_resource(max_entries=MEMO_ENTRIES)
+def get_model_pixels(digest, _data):
+    # Decoded and resized to the model input once, then shared read-only by
+    # prediction and heatmap colorizing across reruns and sessions.
+    from preprocessing import Preprocessor, load_image
+    pixels = Preprocessor().resize(load_image(_data))
+    pixels.flags.writeable = False
+    return pixels
+
+@st.cache_resource(max_entries=MEMO_ENTRIES)
+def get_display_pixels(digest, _data):
+    # Tiled heatmaps follow the document's own aspect ratio, at twice the 400px display width.
+    from preprocessing import load_image
+    image = load_image(_data)
+    image.thumbnail((800, 800))
+    pixels = np.asarray(image)
+    pixels.flags.writeable = False
+    return pixels
+
+@st.cache_data(max_entries=MEMO_ENTRIES)
+def get_heatmap_b64(digest, result, _data):
+    # Predictions carry the raw low-resolution CAM; colorize it over the upload here.
+    if result.get("heatmap_b64") or not result.get("cam_b64"):
+        return result.get("heatmap_b64")
+    from heatmaps import colorize_raw_cam, decode_raw_cam, png_b64
+    cam = decode_raw_cam(result["cam_b64"], result["cam_shape"])
+    if result.get("tiles"):
+        return png_b64(colorize_raw_cam(get_display_pixels(digest, _data), cam, normalize=False))
+    return png_b64(colorize_raw_cam(get_model_pixels(digest, _data), cam))
 
 @st.cache_data
 def get_base64_of_bin_file(bin_file):
@@ -31,27 +145,70 @@ def get_base64_of_bin_file(bin_file):
     except:
         return None
 
+current_dir = os.path.dirname(os.path.abspath(__file__))
+hero_image_path = os.path.join(current_dir, "assets", "hero_banner.png")
+upload_icon_path = os.path.join(current_dir, "assets", "fingerprint_icon.png")
+static_dir = os.path.join(current_dir, "static")
+# Streamlit serves static_dir here when server.enableStaticServing is on.
+STATIC_URL = "app/static/"
+# Fonts and the scan animation not bundled by build_assets.py are only fetched from
+# Google Fonts / lottie.host when this is 1; otherwise the UI uses system fonts and no animation.
+REMOTE_ASSETS = os.environ.get("FORGERY_UI_REMOTE_ASSETS", "0") == "1"
+REMOTE_FONTS_CSS_URL = "https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700&family=Orbitron:wght@400;700&display=swap"
+REMOTE_LOTTIE_URL = "https://lottie.host/9e017688-660b-4277-b9c0-8260a9270df8/jS27rFjV9U.json"
+
+@st.cache_data
+def load_asset_manifest():
+    # Written by build_assets.py: logical name -> content-hashed file under static/.
+    try:
+        with open(os.path.join(static_dir, "manifest.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+@st.cache_data
+def load_local_lottie(relative_path):
+    # Bundled at build time, so a built UI never fetches anything from the internet.
+    if not relative_path:
+        return None
+    try:
+        with open(os.path.join(static_dir, relative_path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
 @st.cache_data
 def load_lottieurl(url):
+    # Only with FORGERY_UI_REMOTE_ASSETS=1: blocks the first render for up to the timeout.
+    import requests
     try:
         r = requests.get(url, timeout=2)
         if r.status_code != 200:
             return None
         return r.json()
-    except:
+    except (requests.RequestException, ValueError):
         return None
 
-current_dir = os.path.dirname(os.path.abspath(__file__))
-hero_image_path = os.path.join(current_dir, "assets", "hero_banner.png")
-upload_icon_path = os.path.join(current_dir, "assets", "fingerprint_icon.png")
+asset_manifest = load_asset_manifest() if st.get_option("server.enableStaticServing") else {}
+
+def asset_url(name, fallback_path, mime):
+    # Built assets are fetched once by the browser and cached; without a build
+    # (or static serving) fall back to inlining the source image as before.
+    if name in asset_manifest:
+        return STATIC_URL + asset_manifest[name]
+    b64 = get_base64_of_bin_file(fallback_path)
+    return f"data:{mime};base64,{b64}" if b64 else ""
 
-hero_bg_b64 = get_base64_of_bin_file(hero_image_path)
-upload_icon_b64 = get_base64_of_bin_file(upload_icon_path)
+hero_bg_url = asset_url("hero_banner", hero_image_path, "image/png")
+upload_icon_url = asset_url("fingerprint_icon", upload_icon_path, "image/png")
+if "fonts_css" in asset_manifest:
+    fonts_import = f"@import url('{STATIC_URL}{asset_manifest['fonts_css']}');"
+else:
+    fonts_import = f"@import url('{REMOTE_FONTS_CSS_URL}');" if REMOTE_ASSETS else ""
 
 page_bg_css = f"""
 <style>
-    @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700&display=swap');
-    @import url('https://fonts.googleapis.com/css2?family=Orbitron:wght@400;700&display=swap');
+    {fonts_import}
 
     html, body, [class*="css"] {{
         font-family: 'Inter', sans-serif;
@@ -63,7 +220,7 @@ page_bg_css = f"""
     }}
 
     .stApp {{
-        background-image: linear-gradient(rgba(2, 6, 23, 0.8), rgba(2, 6, 23, 0.9)), url("data:image/png;base64,{hero_bg_b64}");
+        background-image: linear-gradient(rgba(2, 6, 23, 0.8), rgba(2, 6, 23, 0.9)), url("{hero_bg_url}");
         background-attachment: fixed;
         background-size: cover;
         background-position: center top;
@@ -113,7 +270,7 @@ page_bg_css = f"""
     
     [data-testid="stFileUploader"] section {{
         background-color: black !important;
-        background-image: url("data:image/png;base64,{upload_icon_b64}") !important;
+        background-image: url("{upload_icon_url}") !important;
         background-size: 80% !important;
         background-repeat: no-repeat !important;
         background-position: center center !important;
@@ -425,7 +582,10 @@ page_bg_css = f"""
 """
 st.markdown(page_bg_css, unsafe_allow_html=True)
 
-lottie_scan = load_lottieurl("https://lottie.host/9e017688-660b-4277-b9c0-8260a9270df8/jS27rFjV9U.json")
+if "lottie_scan" in asset_manifest:
+    lottie_scan = load_local_lottie(asset_manifest["lottie_scan"])
+else:
+    lottie_scan = load_lottieurl(REMOTE_LOTTIE_URL) if REMOTE_ASSETS else None
 
 if 'uploader_key' not in st.session_state:
     st.session_state.uploader_key = 0
@@ -440,7 +600,7 @@ def reset_uploader():
 
 st.markdown('<div class="hero-title">ForgeryDetect AI</div>', unsafe_allow_html=True)
 
-uploaded_file = st.file_uploader("", type=['jpg', 'png', 'jpeg', 'tiff'], key=f"main_uploader_{st.session_state.uploader_key}")
+uploaded_file = st.file_uploader("", type=['jpg', 'png', 'jpeg', 'tiff', 'pdf'], key=f"main_uploader_{st.session_state.uploader_key}")
 
 if uploaded_file is not None:
     st.markdown("""
@@ -497,17 +657,9 @@ if uploaded_file is not None:
         
         image_placeholder = st.empty()
         
-        # CLOUD OPTIMIZATION: Resize image server-side (400px) + Base64 for custom HTML
+        upload_digest = get_upload_digest(uploaded_file)
         try:
-            img_preview = Image.open(uploaded_file)
-            img_preview.thumbnail((400, 400))
-            
-            # Convert to Base64 for HTML embedding
-            buffered = io.BytesIO()
-            if img_preview.mode in ("RGBA", "P"):
-                img_preview = img_preview.convert("RGB")
-            img_preview.save(buffered, format="JPEG", quality=70)
-            b64_img = base64.b64encode(buffered.getvalue()).decode()
+            b64_img = get_preview_b64(upload_digest, uploaded_file.getvalue())
             
             # Store in session state for access in other columns
             st.session_state['preview_b64'] = b64_img
@@ -541,6 +693,8 @@ if uploaded_file is not None:
             st.markdown('<h4 style="color: #38bdf8; font-family: Orbitron, sans-serif; text-align: center;">Ready for Analysis</h4>', unsafe_allow_html=True)
             st.markdown('<div style="font-family: Orbitron, sans-serif; font-size: 0.9rem; color: #a855f7; text-align: center;">Model: <b>EfficientNet-B0</b> | Security: <b>Encrypted</b></div>', unsafe_allow_html=True)
             
+            # Opt-in: scores overlapping full-resolution tiles, slower but sees small edits.
+            tiled = st.toggle("High-resolution scan (tiled)", key="tiled_scan")
             action_placeholder = st.empty()
             run_clicked = action_placeholder.button("RUN FORGERY ANALYSIS", use_container_width=True)
             
@@ -556,16 +710,45 @@ if uploaded_file is not None:
                         st_lottie(lottie_scan, height=120, key="scanning")
                     
                     try:
+                        if INFERENCE_MODE == "remote":
+                            # The backend decodes, batches and caches; only the raw CAM comes back.
+                            result = get_remote_detector().analyze(uploaded_file.getvalue(), uploaded_file.name, heatmap_format="raw", tiled=tiled)
+                            st.session_state.scan_result = result
+                            st.rerun()
+
                         # 1. Load Model
-                        detector = get_model()
+                        models_dir = get_models_dir()
+                        detector = get_model(get_weights_stamp(models_dir), models_dir)
                         
-                        # 2. Prepare Image
-                        image = Image.open(uploaded_file).convert('RGB')
+                        # 2. Reuse a previous result for identical bytes and weights
+                        from result_cache import ResultCache
+                        result_cache = get_result_cache()
+                        from pages import document_verdict, inspect_document, is_paged, predict_pages
+                        from tiling import tiled_cache_variant
+                        paged = is_paged(*inspect_document(uploaded_file.getvalue()))
+                        variant = "pages-raw" if paged else tiled_cache_variant("raw") if tiled else "raw"
+                        cache_key = ResultCache.make_key(upload_digest, variant)
+                        result = result_cache.get(cache_key, detector.fingerprint)
                         
-                        # 3. Predict
-                        result = detector.predict(image)
+                        if result is None and paged:
+                            # PDFs and multi-page TIFFs: decoded and scored a few pages at a time.
+                            page_results = list(predict_pages(detector, uploaded_file.getvalue(), heatmap_format="raw"))
+                            result = {**document_verdict(page_results), "pages": page_results}
+                            result_cache.put(cache_key, detector.fingerprint, result)
+                        elif result is None and tiled:
+                            # Tiling needs every pixel, so no reduced-size draft decode here.
+                            from preprocessing import load_image
+                            result = detector.predict_tiled(load_image(uploaded_file.getvalue(), draft=False), heatmap_format="raw")
+                            result_cache.put(cache_key, detector.fingerprint, result)
+                        elif result is None:
+                            # 3. Prepare Image (already resized to the model input, so predict's resize is a copy)
+                            image = Image.fromarray(get_model_pixels(upload_digest, uploaded_file.getvalue()))
+                            
+                            # 4. Predict
+                            result = detector.predict(image, heatmap_format="raw")
+                            result_cache.put(cache_key, detector.fingerprint, result)
                         
-                        # 4. Update State
+                        # 5. Update State
                         st.session_state.scan_result = result
                         st.rerun()
                             
@@ -606,12 +789,22 @@ if uploaded_file is not None:
             <span style="font-size: 1.5rem; font-weight: bold;">{conf_str}</span>
             </div>
             """, unsafe_allow_html=True)
+
+            for page in result.get("pages", []):
+                page_color = "#ef4444" if page.get("is_forged") else "#22c55e"
+                page_label = page.get("label") or "Error"
+                st.markdown(f'<div style="text-align: center; font-size: 0.8rem; color: {page_color};">Page {page["page"]}: {page_label} ({page.get("confidence", 0.0) * 100:.1f}%)</div>', unsafe_allow_html=True)
+
+            tiles = result.get("tiles")
+            if tiles:
+                stopped = " (stopped early)" if tiles.get("early_exit") else ""
+                st.markdown(f'<div style="text-align: center; font-size: 0.8rem; color: #94a3b8;">Tiled scan: {tiles["analyzed"]} of {tiles["planned"]} tiles analysed{stopped}</div>', unsafe_allow_html=True)
     
     st.markdown('</div>', unsafe_allow_html=True)
 
     if st.session_state.scan_result is not None:
         result = st.session_state.scan_result
-        heatmap_b64 = result.get("heatmap_b64")
+        heatmap_b64 = get_heatmap_b64(get_upload_digest(uploaded_file), result, uploaded_file.getvalue())
         
         if heatmap_b64:
             st.markdown("<br><br>", unsafe_allow_html=True)
@@ -701,14 +894,28 @@ if uploaded_file is None:
     </div>
     """
     
+    report = get_metrics()
+
+    def metric_value(name):
+        return f"{100 * report['metrics'][name]:.1f}%" if report else "N/A"
+
     with t1:
-        st.markdown(css_card.format(color="#38bdf8", value="91.1%", desc="Model confidence on the validation dataset"), unsafe_allow_html=True)
+        st.markdown(css_card.format(color="#38bdf8", value=metric_value("accuracy"), desc="Model confidence on the validation dataset"), unsafe_allow_html=True)
         
     with t2:
-        st.markdown(css_card.format(color="#a855f7", value="94.1%", desc="Accuracy of forgery detection alerts"), unsafe_allow_html=True)
+        st.markdown(css_card.format(color="#a855f7", value=metric_value("precision"), desc="Accuracy of forgery detection alerts"), unsafe_allow_html=True)
         
     with t3:
-        st.markdown(css_card.format(color="#10b981", value="94.9%", desc="Ability to find all actual forgeries"), unsafe_allow_html=True)
+        st.markdown(css_card.format(color="#10b981", value=metric_value("recall"), desc="Ability to find all actual forgeries"), unsafe_allow_html=True)
         
     with t4:
-        st.markdown(css_card.format(color="#f59e0b", value="94.5%", desc="Balanced performance metric"), unsafe_allow_html=True)
+        st.markdown(css_card.format(color="#f59e0b", value=metric_value("f1"), desc="Balanced performance metric"), unsafe_allow_html=True)
+
+    if report:
+        details = [f"{report['images']} labeled images", f"threshold {report['threshold']:.2f}"]
+        if report["roc"]["auc"] is not None:
+            details += [f"ROC AUC {report['roc']['auc']:.3f}", f"calibration error {report['calibration']['ece']:.3f}"]
+        details.append(f"evaluated {report['evaluated_at'][:10]}")
+        st.caption(" · ".join(details))
+    else:
+        st.caption("No metrics for these weights yet: run `python evaluate.py <labeled folder>` to compute them.")
@@ -0,0 +1,117 @@
+import logging
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class MicroBatcher:
+    """Collects concurrent predict calls into one batched forward pass.
+
+    A single worker thread waits for the first pending request, then keeps
+    gathering more until either ``max_batch_size`` is reached or
+    ``max_wait_ms`` has elapsed, and runs ``detector.predict_batch`` once.
+    """
+
+    def __init__(self, detector, max_batch_size=8, max_wait_ms=5.0):
+        self.detector = detector
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self.batch_histogram = Counter()
+        self.total_batches = 0
+        self.total_requests = 0
+
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, image, explain=True, heatmap_format="overlay"):
+        future = Future()
+        # Requests are only batched with others that want the same heatmap output.
+        self._queue.put((image, heatmap_format if explain else "none", future))
+        return future
+
+    def predict(self, image, explain=True, heatmap_format="overlay"):
+        return self.submit(image, explain=explain, heatmap_format=heatmap_format).result()
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def close(self):
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def stats(self):
+        with self._lock:
+            histogram = dict(sorted(self.batch_histogram.items()))
+            batches = self.total_batches
+            requests = self.total_requests
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "batches": batches,
+            "requests": requests,
+            "mean_batch_size": requests / batches if batches else 0.0,
+            "batch_size_histogram": {str(size): count for size, count in histogram.items()},
+        }
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                # Finish the batch in hand, then let the loop see the sentinel again.
+                self._queue.put(_STOP)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = self._collect(item)
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        # Callers may have given up (cancelled) while queued; skip their work.
+        batch = [item for item in batch if item[2].set_running_or_notify_cancel()]
+
+        # Label-only requests never pay for the Grad-CAM backward of their
+        # neighbours, and raw-CAM requests never pay for overlay rendering.
+        groups = {}
+        for image, heatmap_format, future in batch:
+            groups.setdefault(heatmap_format, []).append((image, future))
+        for heatmap_format, group in groups.items():
+            self._run_group(group, heatmap_format)
+
+    def _run_group(self, group, heatmap_format):
+        with self._lock:
+            self.batch_histogram[len(group)] += 1
+            self.total_batches += 1
+            self.total_requests += len(group)
+
+        try:
+            images = [image for image, _ in group]
+            results = self.detector.predict_batch(images, explain=heatmap_format != "none", heatmap_format=heatmap_format)
+        except Exception as e:
+            logger.error(f"Batched inference failed: {e}")
+            for _, future in group:
+                future.set_exception(e)
+            return
+
+        for (_, future), result in zip(group, results):
+            future.set_result(result)
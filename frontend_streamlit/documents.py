@@ -0,0 +1,80 @@
+import os
+import tarfile
+import zipfile
+
+from uploads import file_too_large
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp", ".webp"}
+
+
+def is_image_name(name):
+    return os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+
+
+def _read_limited(member, declared_size, max_bytes):
+    if max_bytes and declared_size > max_bytes:
+        return file_too_large(declared_size, max_bytes)
+    # Never trust the declared size alone: a crafted archive can understate it.
+    data = member.read(max_bytes + 1) if max_bytes else member.read()
+    if max_bytes and len(data) > max_bytes:
+        return file_too_large(len(data), max_bytes)
+    return data
+
+
+def _iter_zip(fileobj, max_bytes):
+    with zipfile.ZipFile(fileobj) as archive:
+        for info in archive.infolist():
+            if info.is_dir() or not is_image_name(info.filename):
+                continue
+            # Members are read one at a time so only one document is held in memory.
+            with archive.open(info) as member:
+                yield info.filename, _read_limited(member, info.file_size, max_bytes)
+
+
+def _iter_tar(fileobj, max_bytes):
+    # Stream mode ("r|*") never seeks back, so the archive is consumed sequentially.
+    with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+        for info in archive:
+            if not info.isfile() or not is_image_name(info.name):
+                continue
+            member = archive.extractfile(info)
+            if member is None:
+                continue
+            yield info.name, _read_limited(member, info.size, max_bytes)
+
+
+def archive_kind(name, fileobj):
+    lowered = (name or "").lower()
+    if lowered.endswith(".zip"):
+        return "zip"
+    if lowered.endswith((".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")):
+        return "tar"
+
+    position = fileobj.tell()
+    try:
+        if zipfile.is_zipfile(fileobj):
+            return "zip"
+    finally:
+        fileobj.seek(position)
+    return None
+
+
+def iter_documents(uploads, max_bytes=None):
+    """Yield ``(name, raw_bytes)`` for every image in a list of uploads.
+
+    ``uploads`` is a sequence of ``(filename, fileobj)`` pairs. A zip or tar
+    archive is expanded lazily, member by member; anything else is treated
+    as a single image. Documents larger than ``max_bytes`` are not read and
+    are yielded with an ``UploadRejected`` in place of their bytes.
+    """
+    for filename, fileobj in uploads:
+        kind = archive_kind(filename, fileobj)
+        if kind == "zip":
+            yield from _iter_zip(fileobj, max_bytes)
+        elif kind == "tar":
+            yield from _iter_tar(fileobj, max_bytes)
+        else:
+            fileobj.seek(0, 2)
+            size = fileobj.tell()
+            fileobj.seek(0)
+            yield filename, _read_limited(fileobj, size, max_bytes)
@@ -0,0 +1,225 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from itertools import combinations
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Index every analysed image by its perceptual hashes (0 disables the stage).
+ENABLED = os.environ.get("FORGERY_DUPLICATES", "1") != "0"
+# Optional JSONL file the index is appended to and reloaded from at startup.
+INDEX_PATH = os.environ.get("FORGERY_DUPLICATE_INDEX") or None
+# pHash bits (of 64) within which an earlier document is reported as a near-duplicate.
+MAX_DISTANCE = int(os.environ.get("FORGERY_DUPLICATE_DISTANCE", "8"))
+# Reuse an earlier verdict instead of running the model when both hashes are this close.
+REUSE = os.environ.get("FORGERY_DUPLICATE_REUSE", "0") != "0"
+REUSE_DISTANCE = int(os.environ.get("FORGERY_DUPLICATE_REUSE_DISTANCE", "2"))
+MAX_MATCHES = 5
+
+HASH_SIZE = 8
+DCT_SIZE = 32
+
+
+def _dct_matrix(n):
+    # Orthonormal DCT-II basis: coefficients = D @ block @ D.T
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix.astype(np.float32)
+
+
+_DCT = _dct_matrix(DCT_SIZE)
+
+
+def _to_int(bits):
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+
+def phash(gray):
+    """64-bit DCT hash of a greyscale image: which low frequencies are above their median."""
+    pixels = np.asarray(gray.resize((DCT_SIZE, DCT_SIZE), Image.BOX), dtype=np.float32)
+    low = (_DCT @ pixels @ _DCT.T)[:HASH_SIZE, :HASH_SIZE]
+    return _to_int(low > np.median(low))
+
+
+def dhash(gray):
+    """64-bit gradient hash: whether each pixel of a 9x8 thumbnail is brighter than its left neighbour."""
+    pixels = np.asarray(gray.resize((HASH_SIZE + 1, HASH_SIZE), Image.BOX), dtype=np.int16)
+    return _to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+def image_signature(image):
+    """``(phash, dhash)`` of a decoded image; robust to re-encoding, rescaling and small edits."""
+    gray = image.convert("L")
+    # Box-reduce large scans first; both hashes only look at a 32px thumbnail.
+    gray = gray.reduce(max(1, min(gray.size) // (4 * DCT_SIZE)))
+    return phash(gray), dhash(gray)
+
+
+class DuplicateIndex:
+    """Earlier documents, searchable by pHash Hamming distance.
+
+    Multi-index hashing: the 64-bit pHash is split into ``chunks`` 16-bit
+    parts, each with its own exact-match table. Two hashes within ``r`` bits
+    differ by at most ``r // chunks`` bits in at least one part, so a search
+    only probes the few table keys that close to each part of the query and
+    compares full hashes for those candidates, instead of scanning everything.
+    """
+
+    def __init__(self, path=INDEX_PATH, chunks=4):
+        self.path = path
+        self.chunks = chunks
+        self.chunk_bits = 64 // chunks
+        # pHash and dHash per position, in arrays grown by doubling so candidates are compared in one go.
+        self._hashes = np.zeros((1024, 2), dtype=np.uint64)
+        self._records = []
+        self._by_digest = {}
+        self._tables = [defaultdict(list) for _ in range(chunks)]
+        self._mask_cache = {}
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.lookup_seconds = 0.0
+        self.reused = 0
+        if path and os.path.exists(path):
+            self._load(path)
+
+    def __len__(self):
+        return len(self._records)
+
+    def _load(self, path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash mid-write.
+                    continue
+                signature = (int(entry.pop("phash"), 16), int(entry.pop("dhash"), 16))
+                self._insert(signature, entry)
+        logger.info(f"Loaded {len(self)} documents into the duplicate index from {path}")
+
+    def _parts(self, value):
+        mask = (1 << self.chunk_bits) - 1
+        return [(value >> (i * self.chunk_bits)) & mask for i in range(self.chunks)]
+
+    def _insert(self, signature, record):
+        # Called with the lock held (or before the index is shared).
+        position = self._by_digest.get(record["digest"])
+        if position is not None and tuple(int(value) for value in self._hashes[position]) == signature:
+            self._records[position] = record
+            return
+        position = len(self._records)
+        if position == len(self._hashes):
+            self._hashes = np.concatenate([self._hashes, np.zeros_like(self._hashes)])
+        self._hashes[position] = signature
+        self._records.append(record)
+        self._by_digest[record["digest"]] = position
+        for table, part in zip(self._tables, self._parts(signature[0])):
+            table[part].append(position)
+
+    def add(self, digest, signature, result, fingerprint=None, model_version=None):
+        """Remember a scored document and its verdict."""
+        record = {
+            "digest": digest,
+            "label": result.get("label"),
+            "is_forged": result.get("is_forged"),
+            "confidence": result.get("confidence"),
+            "forged_probability": (result.get("details") or {}).get("forged_probability"),
+            "fingerprint": fingerprint,
+            "model_version": model_version,
+            "seen_at": time.time(),
+        }
+        with self._lock:
+            self._insert(signature, record)
+            if self.path:
+                with open(self.path, "a") as f:
+                    f.write(json.dumps({"phash": f"{signature[0]:016x}", "dhash": f"{signature[1]:016x}", **record}) + "\n")
+
+    def _masks(self, radius):
+        # Every XOR mask of up to ``radius`` bits within one part, computed once per radius.
+        masks = self._mask_cache.get(radius)
+        if masks is None:
+            masks = [sum(1 << bit for bit in bits) for flips in range(radius + 1)
+                     for bits in combinations(range(self.chunk_bits), flips)]
+            self._mask_cache[radius] = masks
+        return masks
+
+    def search(self, signature, radius=MAX_DISTANCE, limit=MAX_MATCHES, exclude=None):
+        """Nearest earlier documents within ``radius`` pHash bits, closest first.
+
+        Each match is the stored record plus ``distance`` (pHash) and
+        ``dhash_distance``; ``exclude`` skips a digest (the query itself).
+        """
+        started = time.perf_counter()
+        query_phash, query_dhash = signature
+        matches = []
+        with self._lock:
+            candidates = []
+            for table, part in zip(self._tables, self._parts(query_phash)):
+                for mask in self._masks(radius // self.chunks):
+                    candidates.extend(table.get(part ^ mask, ()))
+            positions = np.unique(np.array(candidates, dtype=np.int64))
+            hashes = self._hashes[positions]
+            distances = np.bitwise_count(hashes[:, 0] ^ np.uint64(query_phash))
+            dhash_distances = np.bitwise_count(hashes[:, 1] ^ np.uint64(query_dhash))
+            for position, distance, dhash_distance in zip(positions[distances <= radius], distances[distances <= radius],
+                                                          dhash_distances[distances <= radius]):
+                record = self._records[position]
+                if record["digest"] != exclude:
+                    matches.append({**record, "distance": int(distance), "dhash_distance": int(dhash_distance)})
+            self.lookups += 1
+            self.lookup_seconds += time.perf_counter() - started
+        matches.sort(key=lambda match: (match["distance"], match["dhash_distance"]))
+        # A digest indexed twice (e.g. once draft-decoded, once at full size) is listed once.
+        seen = set()
+        unique = [match for match in matches if not (match["digest"] in seen or seen.add(match["digest"]))]
+        return unique[:limit]
+
+    def reusable(self, matches, fingerprint, distance=REUSE_DISTANCE):
+        """The closest match scored by the same weights with both hashes within ``distance``, or None."""
+        for match in matches:
+            if (fingerprint is not None and match["fingerprint"] == fingerprint
+                    and match["distance"] <= distance and match["dhash_distance"] <= distance):
+                with self._lock:
+                    self.reused += 1
+                return match
+        return None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "documents": len(self._records),
+                "lookups": self.lookups,
+                "mean_lookup_ms": round(1000 * self.lookup_seconds / self.lookups, 4) if self.lookups else 0.0,
+                "reused": self.reused,
+            }
+
+
+def reused_result(match):
+    """A prediction result built from an earlier near-identical document's verdict (no heatmap)."""
+    forged_prob = match["forged_probability"]
+    if forged_prob is None:
+        forged_prob = match["confidence"] if match["is_forged"] else 1.0 - match["confidence"]
+    return {
+        "is_forged": match["is_forged"],
+        "confidence": match["confidence"],
+        "label": match["label"],
+        "details": {
+            "forged_probability": forged_prob,
+            "authentic_probability": 1.0 - forged_prob
+        },
+        "reused_from": {"digest": match["digest"], "distance": match["distance"], "dhash_distance": match["dhash_distance"]},
+    }
+
+
+def describe_matches(matches):
+    # What API responses show of each near-duplicate.
+    keys = ("digest", "distance", "dhash_distance", "label", "confidence", "model_version", "seen_at")
+    return [{key: match[key] for key in keys} for match in matches]
@@ -0,0 +1,111 @@
+import json
+import os
+
+import numpy as np
+
+DIGEST_BYTES = 32
+
+
+class EmbeddingMismatch(ValueError):
+    pass
+
+
+class EmbeddingStore:
+    """Append-only store of per-document embeddings, keyed by content digest.
+
+    A directory holding three files: ``embeddings.bin`` (rows of ``dim``
+    values of ``dtype``), ``digests.bin`` (the matching raw 32-byte SHA-256
+    digests) and ``meta.json``. ``matrix()`` memory-maps the rows, so millions
+    of them can be scored without loading the file. ``fingerprint``
+    identifies the network that produced the embeddings; appending ones from
+    a different network raises ``EmbeddingMismatch``.
+    """
+
+    def __init__(self, directory, dim=None, dtype="float16", fingerprint=None):
+        self.directory = directory
+        self.meta_path = os.path.join(directory, "meta.json")
+        self.rows_path = os.path.join(directory, "embeddings.bin")
+        self.digests_path = os.path.join(directory, "digests.bin")
+
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+            if fingerprint is not None and meta["fingerprint"] not in (None, fingerprint):
+                raise EmbeddingMismatch(
+                    f"{directory} holds embeddings of backbone {meta['fingerprint'][:16]}, not {fingerprint[:16]}"
+                )
+            if dim is not None and dim != meta["dim"]:
+                raise EmbeddingMismatch(f"{directory} holds {meta['dim']}-dimensional embeddings, not {dim}")
+            self.dim, self.dtype, self.fingerprint = meta["dim"], np.dtype(meta["dtype"]), meta["fingerprint"] or fingerprint
+        else:
+            if dim is None:
+                raise FileNotFoundError(f"No embedding store at {directory}")
+            self.dim, self.dtype, self.fingerprint = dim, np.dtype(dtype), fingerprint
+            os.makedirs(directory, exist_ok=True)
+            self._write_meta()
+        self._index = None
+
+    def _write_meta(self):
+        with open(self.meta_path, "w") as f:
+            json.dump({"dim": self.dim, "dtype": self.dtype.name, "fingerprint": self.fingerprint}, f, indent=2)
+
+    def __len__(self):
+        # A crash between the two appends leaves one file a row ahead; the shorter one wins.
+        rows = os.path.getsize(self.rows_path) // (self.dim * self.dtype.itemsize) if os.path.exists(self.rows_path) else 0
+        digests = os.path.getsize(self.digests_path) // DIGEST_BYTES if os.path.exists(self.digests_path) else 0
+        return min(rows, digests)
+
+    def _digest_index(self):
+        if self._index is None:
+            self._index = {digest: row for row, digest in enumerate(self.digests())}
+        return self._index
+
+    def __contains__(self, digest):
+        return digest in self._digest_index()
+
+    def digests(self):
+        """Hex digests in row order."""
+        count = len(self)
+        if not count:
+            return []
+        raw = np.fromfile(self.digests_path, dtype=np.uint8, count=count * DIGEST_BYTES).reshape(count, DIGEST_BYTES)
+        return [row.tobytes().hex() for row in raw]
+
+    def add(self, digests, embeddings):
+        """Append embeddings for digests not stored yet; returns how many were added."""
+        index = self._digest_index()
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        keep, seen = [], set()
+        for i, digest in enumerate(digests):
+            # Duplicates within one call are stored once.
+            if digest not in index and digest not in seen:
+                keep.append(i)
+                seen.add(digest)
+        if not keep:
+            return 0
+        if embeddings.shape[1] != self.dim:
+            raise EmbeddingMismatch(f"Expected {self.dim}-dimensional embeddings, got {embeddings.shape[1]}")
+
+        start = len(self)
+        # Truncate a half-written tail so rows and digests stay aligned.
+        for path, size in ((self.rows_path, start * self.dim * self.dtype.itemsize), (self.digests_path, start * DIGEST_BYTES)):
+            if os.path.exists(path) and os.path.getsize(path) != size:
+                os.truncate(path, size)
+        with open(self.rows_path, "ab") as f:
+            f.write(embeddings[keep].astype(self.dtype).tobytes())
+        with open(self.digests_path, "ab") as f:
+            f.write(b"".join(bytes.fromhex(digests[i]) for i in keep))
+        for offset, i in enumerate(keep):
+            index[digests[i]] = start + offset
+        return len(keep)
+
+    def matrix(self):
+        """All embeddings as a read-only ``(len(self), dim)`` memory map."""
+        count = len(self)
+        if not count:
+            return np.zeros((0, self.dim), dtype=self.dtype)
+        return np.memmap(self.rows_path, dtype=self.dtype, mode="r", shape=(count, self.dim))
+
+    def get(self, digest):
+        row = self._digest_index().get(digest)
+        return None if row is None else np.asarray(self.matrix()[row], dtype=np.float32)
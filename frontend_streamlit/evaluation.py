@@ -0,0 +1,119 @@
+import os
+
+import numpy as np
+
+from documents import is_image_name
+
+# Sub-folder names of a labeled dataset; forged is the positive class.
+LABEL_FOLDERS = {"authentic": 0, "forged": 1}
+
+
+def list_images(directory):
+    paths = []
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if is_image_name(name):
+                paths.append(os.path.join(root, name))
+    return sorted(paths)
+
+
+def load_labeled_folder(directory):
+    """Return ``(paths, labels)`` for a folder with ``authentic/`` and ``forged/`` sub-folders."""
+    paths, labels = [], []
+    for folder, label in LABEL_FOLDERS.items():
+        folder_path = os.path.join(directory, folder)
+        if not os.path.isdir(folder_path):
+            continue
+        for path in list_images(folder_path):
+            paths.append(path)
+            labels.append(label)
+    if not paths:
+        raise ValueError(f"No images found under {directory}/authentic or {directory}/forged")
+    return paths, np.array(labels, dtype=np.int64)
+
+
+def classification_metrics(y_true, y_pred):
+    y_true = np.asarray(y_true, dtype=bool)
+    y_pred = np.asarray(y_pred, dtype=bool)
+
+    tp = int(np.count_nonzero(y_true & y_pred))
+    tn = int(np.count_nonzero(~y_true & ~y_pred))
+    fp = int(np.count_nonzero(~y_true & y_pred))
+    fn = int(np.count_nonzero(y_true & ~y_pred))
+
+    total = tp + tn + fp + fn
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {
+        "accuracy": (tp + tn) / total if total else 0.0,
+        "precision": precision,
+        "recall": recall,
+        "f1": f1,
+        "confusion_matrix": {"tp": tp, "tn": tn, "fp": fp, "fn": fn},
+    }
+
+
+def _ranked_counts(y_true, scores):
+    # Highest score first; one row per distinct score, with the positives and negatives scored at or above it.
+    order = np.argsort(-scores, kind="stable")
+    scores, y_true = scores[order], y_true[order]
+    ends = np.r_[np.flatnonzero(np.diff(scores)), len(scores) - 1]
+    tps = np.cumsum(y_true)[ends]
+    fps = ends + 1 - tps
+    return scores[ends], tps, fps
+
+
+def roc_curve(y_true, scores):
+    """``(fpr, tpr, thresholds, auc)``; the first point is (0, 0) at an infinite threshold."""
+    y_true = np.asarray(y_true, dtype=bool)
+    thresholds, tps, fps = _ranked_counts(y_true, np.asarray(scores, dtype=np.float64))
+    positives, negatives = tps[-1], fps[-1]
+    tpr = np.r_[0.0, tps / positives] if positives else np.zeros(len(tps) + 1)
+    fpr = np.r_[0.0, fps / negatives] if negatives else np.zeros(len(fps) + 1)
+    auc = float(np.trapezoid(tpr, fpr)) if positives and negatives else None
+    return fpr, tpr, np.r_[np.inf, thresholds], auc
+
+
+def pr_curve(y_true, scores):
+    """``(precision, recall, thresholds, average_precision)``, by decreasing threshold."""
+    y_true = np.asarray(y_true, dtype=bool)
+    thresholds, tps, fps = _ranked_counts(y_true, np.asarray(scores, dtype=np.float64))
+    precision = tps / (tps + fps)
+    recall = tps / tps[-1] if tps[-1] else np.zeros(len(tps))
+    average_precision = float(np.sum(np.diff(np.r_[0.0, recall]) * precision)) if tps[-1] else None
+    return precision, recall, thresholds, average_precision
+
+
+def calibration(y_true, probabilities, bins=10):
+    """Reliability of ``probabilities`` for the positive class, in ``bins`` equal-width bins.
+
+    Returns the per-bin counts, mean predicted probabilities and observed
+    positive rates, the expected calibration error (count-weighted mean gap
+    between the two) and the Brier score.
+    """
+    y_true = np.asarray(y_true, dtype=np.float64)
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    index = np.clip((probabilities * bins).astype(np.int64), 0, bins - 1)
+    counts = np.bincount(index, minlength=bins)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_probability = np.bincount(index, weights=probabilities, minlength=bins) / counts
+        positive_rate = np.bincount(index, weights=y_true, minlength=bins) / counts
+    filled = counts > 0
+    return {
+        "bin_edges": np.linspace(0.0, 1.0, bins + 1),
+        "counts": counts,
+        "mean_probability": mean_probability,
+        "positive_rate": positive_rate,
+        "ece": float(np.sum(counts[filled] * np.abs(mean_probability[filled] - positive_rate[filled])) / len(y_true)),
+        "brier": float(np.mean((probabilities - y_true) ** 2)),
+    }
+
+
+def thin_curve(max_points, *columns):
+    """At most ``max_points`` evenly spaced rows of equally long curve arrays, keeping both ends."""
+    length = len(columns[0])
+    if length <= max_points:
+        return columns
+    keep = np.unique(np.linspace(0, length - 1, max_points).round().astype(np.int64))
+    return tuple(column[keep] for column in columns)
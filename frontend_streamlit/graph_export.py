@@ -0,0 +1,49 @@
+import torch
+import torch.nn as nn
+
+
+def feature_extractor(model):
+    # Everything up to and including conv_head, i.e. the part Grad-CAM looks at.
+    return nn.Sequential(model.conv_stem, model.bn1, model.blocks, model.conv_head)
+
+
+class GradCamExportWrapper(nn.Module):
+    """Returns ``(logits, cam)`` so exported graphs carry their own Grad-CAM.
+
+    Graph runtimes have no autograd, so the gradient of the predicted logit
+    with respect to the conv_head activations is written out in closed form
+    (eval-mode bn2 is affine, followed by SiLU, average pooling and a linear
+    classifier). The result matches ``EagerBackend`` before normalisation.
+    ``backbone`` may replace the float feature extractor, e.g. with an INT8
+    one; the head always stays in float.
+    """
+
+    def __init__(self, model, backbone=None):
+        super().__init__()
+        if not isinstance(model.bn2.act, nn.SiLU):
+            raise ValueError(f"Unsupported bn2 activation for export: {model.bn2.act}")
+        self.model = model
+        self.backbone = backbone if backbone is not None else feature_extractor(model)
+
+        # Dynamically quantized Linear layers expose weight() instead of .weight.
+        weight = model.classifier.weight
+        if callable(weight):
+            weight = weight().dequantize()
+        self.register_buffer("classifier_weight", weight.detach().clone())
+
+    def forward(self, x):
+        model = self.model
+        bn = model.bn2
+        activations = self.backbone(x)
+
+        scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+        y = (activations - bn.running_mean[None, :, None, None]) * scale[None, :, None, None] + bn.bias[None, :, None, None]
+        gate = torch.sigmoid(y)
+        logits = model.classifier((y * gate).mean(dim=(2, 3)))
+
+        # d logit[c] / d activations = W[c] * scale * silu'(y) / (H * W)
+        silu_grad = gate * (1 + y * (1 - gate))
+        class_weights = self.classifier_weight[logits.argmax(dim=1)]
+        weights = class_weights * scale[None, :] * silu_grad.mean(dim=(2, 3)) / (y.shape[2] * y.shape[3])
+        cam = torch.relu((weights[:, :, None, None] * activations).sum(dim=1))
+        return logits, cam
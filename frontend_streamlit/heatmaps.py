@@ -0,0 +1,68 @@
+import base64
+import io
+
+import numpy as np
+from PIL import Image
+
+# none: no heatmap; raw: the min-max normalised CAM at its native (7x7)
+# resolution as uint8 bytes; overlay: the server-rendered JET overlay PNG.
+HEATMAP_FORMATS = ("none", "raw", "overlay")
+
+
+def normalize_cams(cams, size=None):
+    # Per-map min-max scaling to [0, 1], optionally upsampled; same maths as
+    # pytorch_grad_cam's scale_cam_image without importing the package.
+    import cv2
+
+    result = []
+    for cam in cams:
+        cam = cam - np.min(cam)
+        cam = cam / (1e-7 + np.max(cam))
+        if size is not None:
+            cam = cv2.resize(np.float32(cam), size)
+        result.append(cam)
+    return np.float32(result)
+
+
+def overlay_cam(pixels, cam, image_weight=0.5):
+    """Blend a [0, 1] CAM over a uint8 RGB image with the JET colormap."""
+    import cv2
+
+    heatmap = cv2.applyColorMap(np.uint8(255 * cam), cv2.COLORMAP_JET)
+    heatmap = cv2.cvtColor(heatmap, cv2.COLOR_BGR2RGB).astype(np.float32) / 255
+    blended = (1 - image_weight) * heatmap + image_weight * (pixels.astype(np.float32) / 255)
+    blended = blended / np.max(blended)
+    return np.uint8(255 * blended)
+
+
+def png_b64(pixels):
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+
+def quantize_cams(cams):
+    return np.rint(normalize_cams(cams) * 255).astype(np.uint8)
+
+
+def encode_raw_cam(cam):
+    """JSON form of one quantized CAM: row-major uint8 bytes in base64 plus its shape."""
+    return {"cam_b64": base64.b64encode(cam.tobytes()).decode("ascii"), "cam_shape": list(cam.shape)}
+
+
+def decode_raw_cam(cam_b64, cam_shape):
+    return np.frombuffer(base64.b64decode(cam_b64), dtype=np.uint8).reshape(cam_shape)
+
+
+def colorize_raw_cam(pixels, cam, normalize=True):
+    # Same steps as the server overlay (upsample, renormalise, JET blend),
+    # starting from the quantized raw map instead of the float CAM. Stitched
+    # tiled maps hold absolute probabilities and are only upsampled.
+    height, width = pixels.shape[:2]
+    cam = cam.astype(np.float32) / 255
+    if normalize:
+        upsampled = normalize_cams(cam[None], (width, height))[0]
+    else:
+        import cv2
+        upsampled = cv2.resize(cam, (width, height), interpolation=cv2.INTER_LINEAR)
+    return overlay_cam(pixels, upsampled)
@@ -0,0 +1,278 @@
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Runs of a job before it is marked failed; retries wait 2, 4, 8... seconds.
+MAX_ATTEMPTS = int(os.environ.get("FORGERY_JOB_MAX_ATTEMPTS", "3"))
+# A running job whose worker has not checked in for this long is handed to another worker.
+LEASE_S = float(os.environ.get("FORGERY_JOB_LEASE_S", "120"))
+# Finished jobs and their results are deleted after this long.
+RETENTION_S = float(os.environ.get("FORGERY_JOB_RETENTION_S", str(7 * 24 * 3600)))
+# Window over which /stats reports documents per second.
+THROUGHPUT_WINDOW_S = 60.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    params TEXT NOT NULL,
+    webhook_url TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    not_before REAL NOT NULL DEFAULT 0,
+    error TEXT,
+    webhook_status TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, created_at);
+CREATE TABLE IF NOT EXISTS results (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    result TEXT NOT NULL,
+    finished_at REAL NOT NULL,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE INDEX IF NOT EXISTS results_by_time ON results (finished_at);
+"""
+
+
+class JobLeaseLost(RuntimeError):
+    pass
+
+
+class JobQueue:
+    """Durable job queue in one SQLite file, shared by every worker process.
+
+    Uploads are spooled to ``spool_dir/<job id>/`` at submission and removed
+    once the job finishes. A worker ``claim``s a job, which leases it for
+    ``lease_s`` seconds, renewed by every stored result and by ``renew``
+    while a long document is scored. Jobs whose
+    lease runs out (the worker died) are claimed again, and results already
+    stored are kept, so a retried job only scores the documents it is missing.
+    """
+
+    def __init__(self, path, spool_dir=None, max_attempts=MAX_ATTEMPTS, lease_s=LEASE_S, retention_s=RETENTION_S):
+        self.path = path
+        self.spool_dir = spool_dir or os.path.join(os.path.dirname(os.path.abspath(path)), "uploads")
+        self.max_attempts = max(1, int(max_attempts))
+        self.lease_s = lease_s
+        self.retention_s = retention_s
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._db().executescript(SCHEMA)
+
+    def _db(self):
+        # sqlite3 connections must stay on the thread that opened them.
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    @contextmanager
+    def _transaction(self):
+        db = self._db()
+        # IMMEDIATE takes the write lock up front, so two workers never claim the same job.
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def submit(self, uploads, params, webhook_url=None):
+        """Spool ``(filename, fileobj)`` uploads and queue them as one job; returns its id."""
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.spool_dir, job_id)
+        os.makedirs(job_dir)
+        files = []
+        try:
+            for number, (filename, fileobj) in enumerate(uploads):
+                path = os.path.join(job_dir, str(number))
+                fileobj.seek(0)
+                with open(path, "wb") as f:
+                    shutil.copyfileobj(fileobj, f, 1 << 20)
+                files.append((filename, path))
+            with self._transaction() as db:
+                db.execute(
+                    "INSERT INTO jobs (id, status, params, webhook_url, created_at) VALUES (?, 'queued', ?, ?, ?)",
+                    (job_id, json.dumps({**params, "files": files}), webhook_url, time.time()),
+                )
+        except BaseException:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            raise
+        return job_id
+
+    def claim(self, worker):
+        """Lease the oldest runnable job to ``worker``; returns it or None."""
+        now = time.time()
+        with self._transaction() as db:
+            row = db.execute(
+                "SELECT * FROM jobs WHERE (status = 'queued' AND not_before <= ?)"
+                " OR (status = 'running' AND lease_until < ? AND attempts < ?) ORDER BY created_at LIMIT 1",
+                (now, now, self.max_attempts),
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, worker = ?, lease_until = ?,"
+                " started_at = COALESCE(started_at, ?) WHERE id = ?",
+                (worker, now + self.lease_s, now, row["id"]),
+            )
+        job = self._to_dict(row)
+        job["attempts"] += 1
+        if row["status"] == "running":
+            logger.warning(f"Job {row['id']} lost its worker {row['worker']}, retrying (attempt {job['attempts']})")
+        return job
+
+    def _check_lease(self, db, job_id, worker):
+        renewed = db.execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'running'",
+            (time.time() + self.lease_s, job_id, worker),
+        )
+        if renewed.rowcount == 0:
+            raise JobLeaseLost(f"Job {job_id} is no longer leased to {worker}")
+
+    def renew(self, job_id, worker):
+        """Extend ``worker``'s lease on a job it is still running; raises ``JobLeaseLost`` otherwise."""
+        with self._transaction() as db:
+            self._check_lease(db, job_id, worker)
+
+    def add_result(self, job_id, worker, index, result):
+        with self._transaction() as db:
+            self._check_lease(db, job_id, worker)
+            db.execute(
+                "INSERT OR REPLACE INTO results (job_id, idx, result, finished_at) VALUES (?, ?, ?, ?)",
+                (job_id, index, json.dumps(result), time.time()),
+            )
+
+    def completed_indexes(self, job_id):
+        return {row[0] for row in self._db().execute("SELECT idx FROM results WHERE job_id = ?", (job_id,))}
+
+    def finish(self, job_id, worker):
+        with self._transaction() as db:
+            self._check_lease(db, job_id, worker)
+            db.execute("UPDATE jobs SET status = 'done', lease_until = NULL, finished_at = ? WHERE id = ?", (time.time(), job_id))
+        self._remove_spool(job_id)
+        return "done"
+
+    def fail(self, job_id, worker, error, retry=True):
+        """Record a failed run: requeued with backoff while attempts remain, else failed. Returns the new status."""
+        now = time.time()
+        with self._transaction() as db:
+            self._check_lease(db, job_id, worker)
+            attempts = db.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+            if retry and attempts < self.max_attempts:
+                status, not_before, finished_at = "queued", now + 2 ** attempts, None
+            else:
+                status, not_before, finished_at = "failed", 0, now
+            db.execute(
+                "UPDATE jobs SET status = ?, error = ?, lease_until = NULL, not_before = ?, finished_at = ? WHERE id = ?",
+                (status, error, not_before, finished_at, job_id),
+            )
+        if status == "failed":
+            self._remove_spool(job_id)
+        return status
+
+    def requeue(self, job_id, worker):
+        # Shutdown, not failure: the attempt does not count.
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE jobs SET status = 'queued', attempts = attempts - 1, worker = NULL, lease_until = NULL"
+                " WHERE id = ? AND worker = ? AND status = 'running'",
+                (job_id, worker),
+            )
+
+    def fail_expired(self):
+        """Fail jobs whose worker was lost on their last attempt; returns their ids."""
+        now = time.time()
+        with self._transaction() as db:
+            ids = [row[0] for row in db.execute(
+                "SELECT id FROM jobs WHERE status = 'running' AND lease_until < ? AND attempts >= ?", (now, self.max_attempts)
+            )]
+            for job_id in ids:
+                db.execute(
+                    "UPDATE jobs SET status = 'failed', error = ?, lease_until = NULL, finished_at = ? WHERE id = ?",
+                    (f"Worker lost on each of {self.max_attempts} attempts", now, job_id),
+                )
+        for job_id in ids:
+            self._remove_spool(job_id)
+        return ids
+
+    def set_webhook_status(self, job_id, status):
+        self._db().execute("UPDATE jobs SET webhook_status = ? WHERE id = ?", (status, job_id))
+
+    def get(self, job_id):
+        row = self._db().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = self._to_dict(row)
+        job["documents_done"] = self._db().execute("SELECT COUNT(*) FROM results WHERE job_id = ?", (job_id,)).fetchone()[0]
+        return job
+
+    def results_page(self, job_id, after=-1, limit=500):
+        """Stored results with index above ``after``, in document order."""
+        rows = self._db().execute(
+            "SELECT result FROM results WHERE job_id = ? AND idx > ? ORDER BY idx LIMIT ?", (job_id, after, limit)
+        )
+        return [json.loads(result) for (result,) in rows]
+
+    def purge(self):
+        """Delete finished jobs older than the retention period; returns how many."""
+        cutoff = time.time() - self.retention_s
+        with self._transaction() as db:
+            ids = [row[0] for row in db.execute(
+                "SELECT id FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?", (cutoff,)
+            )]
+            for job_id in ids:
+                db.execute("DELETE FROM results WHERE job_id = ?", (job_id,))
+                db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        return len(ids)
+
+    def counts(self):
+        counts = dict.fromkeys(("queued", "running", "done", "failed"), 0)
+        for status, count in self._db().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"):
+            counts[status] = count
+        return counts
+
+    def stats(self):
+        now = time.time()
+        db = self._db()
+        oldest = db.execute("SELECT MIN(created_at) FROM jobs WHERE status = 'queued'").fetchone()[0]
+        recent = db.execute("SELECT COUNT(*) FROM results WHERE finished_at >= ?", (now - THROUGHPUT_WINDOW_S,)).fetchone()[0]
+        return {
+            **self.counts(),
+            "oldest_queued_s": round(now - oldest, 3) if oldest is not None else None,
+            "documents_per_s": round(recent / THROUGHPUT_WINDOW_S, 3),
+        }
+
+    def _remove_spool(self, job_id):
+        shutil.rmtree(os.path.join(self.spool_dir, job_id), ignore_errors=True)
+
+    @staticmethod
+    def _to_dict(row):
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        return job
+
+    def close(self):
+        db = getattr(self._local, "db", None)
+        if db is not None:
+            db.close()
+            self._local.db = None
@@ -0,0 +1,52 @@
+import os
+import resource
+import sys
+import threading
+
+
+def current_rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class RequestMemoryStats:
+    """Tracks how much process RSS grew while each request held its decoded image.
+
+    RSS is process-wide, so with concurrent requests the deltas overlap; they
+    are still the most direct signal of which inputs push memory up.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total_delta = 0
+        self.max_delta = 0
+        self.last_delta = 0
+
+    def observe(self, delta):
+        delta = max(0, int(delta))
+        with self._lock:
+            self.count += 1
+            self.total_delta += delta
+            self.max_delta = max(self.max_delta, delta)
+            self.last_delta = delta
+
+    def stats(self):
+        with self._lock:
+            return {
+                "rss_bytes": current_rss_bytes(),
+                "peak_rss_bytes": peak_rss_bytes(),
+                "requests": self.count,
+                "request_rss_delta_last_bytes": self.last_delta,
+                "request_rss_delta_max_bytes": self.max_delta,
+                "request_rss_delta_mean_bytes": self.total_delta / self.count if self.count else 0.0,
+            }
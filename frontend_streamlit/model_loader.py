@@ -1,125 +1,455 @@
-import torch
-import torch.nn as nn
-from torchvision import models, transforms
 from PIL import Image
 import os
 import logging
-import timm
 import numpy as np
-import cv2
-import base64
-import io
-from pytorch_grad_cam import GradCAM
-from pytorch_grad_cam.utils.model_targets import ClassifierOutputTarget
-from pytorch_grad_cam.utils.image import show_cam_on_image
+import hashlib
+from contextlib import nullcontext
+from itertools import islice
 
-MODEL_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "models", "efficientnet_fantasyid.pth")
+from heatmaps import HEATMAP_FORMATS, encode_raw_cam, normalize_cams, overlay_cam, png_b64, quantize_cams
+from preprocessing import DRAFT_OVERSAMPLE, JPEG_DRAFT, Preprocessor
+from tiling import (TILE_BATCH_SIZE, TILE_BUDGET, TILE_EARLY_EXIT, TILE_OVERLAP, TILE_OVERLAY_MAX_SIDE, TILE_SCALES,
+                    HeatmapStitcher, iter_tiles, plan_levels)
+
+# torch, timm and cv2 are imported where they are first needed: together they
+# take several seconds to import, and the ONNX backend and mock mode never
+# touch torch at all.
+
+MODELS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "models")
+MODEL_PATH = os.path.join(MODELS_DIR, "efficientnet_fantasyid.pth")
+TORCHSCRIPT_PATH = os.path.join(MODELS_DIR, "efficientnet_fantasyid.torchscript.pt")
+ONNX_PATH = os.path.join(MODELS_DIR, "efficientnet_fantasyid.onnx")
+QUANTIZED_PATH = os.path.join(MODELS_DIR, "efficientnet_fantasyid.int8.pt")
+
+# Inference backend used when none is passed explicitly: eager, torchscript, onnx or quantized.
+DEFAULT_BACKEND = os.environ.get("FORGERY_BACKEND", "eager")
+# Intra-op threads per process, set by set_num_threads; 0 keeps each runtime's default.
+NUM_THREADS = 0
 
 logger = logging.getLogger(__name__)
 
+def set_num_threads(threads):
+    """Cap the threads one forward pass may use, so several processes do not oversubscribe the cores."""
+    global NUM_THREADS
+    NUM_THREADS = threads
+    if DEFAULT_BACKEND != "onnx":
+        import torch
+        torch.set_num_threads(threads)
+
+def default_device():
+    import torch
+    return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+def create_network():
+    import timm
+    return timm.create_model('efficientnet_b0', pretrained=False, num_classes=2)
+
+def load_network(path, device):
+    import torch
+    if device.type != "cpu":
+        model = create_network()
+        model.load_state_dict(torch.load(path, map_location=device))
+        model.to(device)
+        model.eval()
+        return model
+
+    # On CPU the parameters stay memory-mapped from the weights file instead of
+    # being copied: processes and model versions loading the same file share
+    # its page-cache pages. The network is built on the meta device so no
+    # throwaway random weights are allocated first.
+    state_dict = torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+    with torch.device("meta"):
+        model = create_network()
+    model.load_state_dict(state_dict, assign=True)
+    model.eval()
+    return model
+
+class EagerBackend:
+    name = "eager"
+
+    def __init__(self, model, device):
+        self.model = model
+        self.device = device
+
+    def infer(self, batch, explain=True):
+        # Runs the backbone once without autograd, capturing the conv_head
+        # activations. When a heatmap is wanted, only the small head after
+        # conv_head (bn2, pooling, classifier) is re-entered with gradients, so
+        # Grad-CAM costs one head backward instead of a second full pass.
+        import torch
+        model = self.model
+        batch_tensor = torch.from_numpy(batch).to(self.device)
+        with torch.no_grad():
+            x = model.conv_stem(batch_tensor)
+            x = model.bn1(x)
+            x = model.blocks(x)
+            activations = model.conv_head(x)
+
+            if not explain:
+                return model.forward_head(model.bn2(activations)).cpu().numpy(), None
+
+        activations = activations.detach().requires_grad_(True)
+        with torch.enable_grad():
+            logits = model.forward_head(model.bn2(activations))
+            # Same target as GradCAM(targets=None): the predicted class logit.
+            score = logits.gather(1, logits.argmax(dim=1, keepdim=True)).sum()
+            grads, = torch.autograd.grad(score, activations)
+
+        weights = grads.mean(dim=(2, 3), keepdim=True)
+        cams = torch.relu((weights * activations.detach()).sum(dim=1))
+        return logits.detach().cpu().numpy(), cams.cpu().numpy()
+
+    def embed(self, batch):
+        # Pooled bn2 output: the 1280 features the classifier is applied to.
+        import torch
+        with torch.no_grad():
+            features = self.model.forward_features(torch.from_numpy(batch).to(self.device))
+            return self.model.forward_head(features, pre_logits=True).cpu().numpy()
+
+class TorchScriptBackend:
+    name = "torchscript"
+
+    def __init__(self, path, device):
+        import torch
+        self.device = device
+        self.module = torch.jit.load(path, map_location=device)
+        self.module.eval()
+
+    def infer(self, batch, explain=True):
+        import torch
+        with torch.no_grad():
+            logits, cams = self.module(torch.from_numpy(batch).to(self.device))
+        return logits.cpu().numpy(), cams.cpu().numpy() if explain else None
+
+class OnnxBackend:
+    name = "onnx"
+
+    def __init__(self, path):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise RuntimeError("The ONNX backend needs onnxruntime (pip install onnxruntime)")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if NUM_THREADS:
+            options.intra_op_num_threads = NUM_THREADS
+        self.session = ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+
+    def infer(self, batch, explain=True):
+        logits, cams = self.session.run(None, {"input": batch})
+        return logits, cams if explain else None
+
+def softmax(logits):
+    logits = np.asarray(logits, dtype=np.float64)
+    exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exp / exp.sum(axis=1, keepdims=True)
+
+BACKEND_ARTIFACTS = {
+    "eager": MODEL_PATH,
+    "torchscript": TORCHSCRIPT_PATH,
+    "onnx": ONNX_PATH,
+    "quantized": QUANTIZED_PATH,
+}
+
 class ForgeryDetectionModel:
-    def __init__(self):
+    def __init__(self, backend=None, models_dir=None):
+        self.backend_name = backend or DEFAULT_BACKEND
+        # Directory holding this model version's artifacts (see model_registry).
+        self.models_dir = models_dir or MODELS_DIR
+        self.backend = None
         self.model = None
-        self.cam = None
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        self.transform = transforms.Compose([
-            transforms.Resize((224, 224)),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-        ])
+        self.model_path = None
+        self.fingerprint = None
+        # Resize -> ToTensor -> Normalize into a reusable NCHW float32 buffer.
+        self.preprocessor = Preprocessor()
+        # Optional stage_timer(stage) -> context manager, called around each
+        # pipeline stage of a batch (the API points it at its latency metrics).
+        self.stage_timer = None
         self.load_model()
 
     def load_model(self):
-        if not os.path.exists(MODEL_PATH):
-            logger.warning(f"Model file not found at {MODEL_PATH}. Running in MOCK mode.")
+        if self.backend_name not in BACKEND_ARTIFACTS:
+            raise ValueError(f"Unknown backend '{self.backend_name}', expected one of {sorted(BACKEND_ARTIFACTS)}")
+
+        path = os.path.join(self.models_dir, os.path.basename(BACKEND_ARTIFACTS[self.backend_name]))
+        if not os.path.exists(path):
+            logger.warning(f"Model file not found at {path}. Running in MOCK mode.")
+            self.backend = None
             self.model = None
             return
 
         try:
-            self.model = timm.create_model('efficientnet_b0', pretrained=False, num_classes=2)
-            
-            state_dict = torch.load(MODEL_PATH, map_location=self.device)
-            self.model.load_state_dict(state_dict)
-            self.model.to(self.device)
-            self.model.eval()
-            
-            target_layers = [self.model.conv_head]
-            self.cam = GradCAM(model=self.model, target_layers=target_layers)
+            if self.backend_name == "eager":
+                device = default_device()
+                self.model = load_network(path, device)
+                self.backend = EagerBackend(self.model, device)
+            elif self.backend_name == "torchscript":
+                self.backend = TorchScriptBackend(path, default_device())
+            elif self.backend_name == "quantized":
+                # The INT8 artifact is a TorchScript module with quantized CPU kernels.
+                import torch
+                self.backend = TorchScriptBackend(path, torch.device("cpu"))
+            else:
+                self.backend = OnnxBackend(path)
+
+            self.model_path = path
+            self.fingerprint = self.compute_fingerprint()
             
-            logger.info("Model and GradCAM loaded successfully!")
+            logger.info(f"Model loaded successfully with the {self.backend_name} backend!")
             
         except Exception as e:
             logger.error(f"Failed to load model: {e}")
+            self.backend = None
             self.model = None
+            self.fingerprint = None
 
-    def generate_heatmap_b64(self, image_tensor, original_image):
-        try:
-            grayscale_cam = self.cam(input_tensor=image_tensor, targets=None)
-            grayscale_cam = grayscale_cam[0, :]
-            
-            img_resized = original_image.resize((224, 224))
-            rgb_img = np.array(img_resized, dtype=np.float32) / 255.0
-            
-            visualization = show_cam_on_image(rgb_img, grayscale_cam, use_rgb=True)
-            visualization_pil = Image.fromarray(visualization)
-            
-            buffer = io.BytesIO()
-            visualization_pil.save(buffer, format="PNG")
-            img_str = base64.b64encode(buffer.getvalue()).decode("utf-8")
-            
-            return img_str
-        except Exception as e:
-            logger.error(f"GradCAM generation failed: {e}")
-            return None
+    def compute_fingerprint(self):
+        # Identifies the loaded weights plus preprocessing, so cached results
+        # never outlive a change to either.
+        digest = hashlib.sha256()
+        with open(self.model_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        digest.update(f"{self.preprocessor!r} draft={JPEG_DRAFT and DRAFT_OVERSAMPLE}".encode("utf-8"))
+        return digest.hexdigest()
 
-    def predict(self, image: Image.Image):
-        if self.model is None:
-            import random
-            is_forged = random.choice([True, False])
-            confidence = random.uniform(0.70, 0.99)
-            
+    def backbone_fingerprint(self):
+        """Identifies everything before the classifier, so stored embeddings survive head retraining."""
+        if not hasattr(self.backend, "embed"):
+            raise RuntimeError(f"The {self.backend_name} backend does not expose embeddings; use the eager backend")
+        digest = hashlib.sha256()
+        for name, tensor in sorted(self.model.state_dict().items()):
+            if not name.startswith("classifier."):
+                digest.update(name.encode("utf-8"))
+                digest.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+        digest.update(f"{self.preprocessor!r} draft={JPEG_DRAFT and DRAFT_OVERSAMPLE}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def head_weights(self):
+        """The classifier as numpy ``(weight, bias)``, of shapes (2, 1280) and (2,)."""
+        classifier = self.model.classifier
+        return classifier.weight.detach().cpu().numpy(), classifier.bias.detach().cpu().numpy()
+
+    def embed_batch(self, images):
+        """Pooled penultimate-layer features of ``images``, float32 of shape (N, 1280)."""
+        if not hasattr(self.backend, "embed"):
+            raise RuntimeError(f"The {self.backend_name} backend does not expose embeddings; use the eager backend")
+        with self.timed("preprocess"):
+            batch, _ = self.preprocessor.batch(images)
+        with self.timed("forward"):
+            return self.backend.embed(batch)
+
+    def timed(self, stage):
+        return self.stage_timer(stage) if self.stage_timer is not None else nullcontext()
+
+    def render_heatmaps_b64(self, cams, resized_images):
+        # Normalise and upsample exactly like pytorch_grad_cam does for a single target layer.
+        size = self.preprocessor.size
+        with self.timed("heatmap_normalize"):
+            grayscale_cams = normalize_cams(normalize_cams(cams, (size, size)))
+
+        heatmaps = []
+        for grayscale_cam, pixels in zip(grayscale_cams, resized_images):
             try:
+                with self.timed("heatmap_overlay"):
+                    overlay = overlay_cam(pixels, grayscale_cam)
+                with self.timed("heatmap_encode"):
+                    heatmaps.append(png_b64(overlay))
+            except Exception as e:
+                logger.error(f"GradCAM rendering failed: {e}")
+                heatmaps.append(None)
+        return heatmaps
+
+    def render_raw_cams(self, cams):
+        with self.timed("heatmap_encode"):
+            return [encode_raw_cam(cam) for cam in quantize_cams(cams)]
+
+    def mock_predict(self, image: Image.Image, explain=True, heatmap_format="overlay"):
+        import random
+        is_forged = random.choice([True, False])
+        confidence = random.uniform(0.70, 0.99)
+
+        heatmap_b64 = None
+        raw_cam = {}
+        if explain and heatmap_format == "raw":
+            raw_cam = encode_raw_cam(np.asarray(image.convert("L").resize((7, 7))))
+        elif explain and heatmap_format == "overlay":
+            try:
+                import cv2
                 img_np = np.array(image.resize((224, 224)))
                 heatmap = cv2.applyColorMap(img_np, cv2.COLORMAP_JET)
                 overlay = cv2.addWeighted(img_np, 0.6, heatmap, 0.4, 0)
-                pil_overlay = Image.fromarray(overlay)
-                buffer = io.BytesIO()
-                pil_overlay.save(buffer, format="PNG")
-                heatmap_b64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
+                heatmap_b64 = png_b64(overlay)
             except:
                 heatmap_b64 = None
 
-            return {
+        return {
+            "is_forged": is_forged,
+            "confidence": confidence,
+            "label": "Forged" if is_forged else "Authentic",
+            "message": "Model not found. Showing MOCK result.",
+            "heatmap_b64": heatmap_b64,
+            **raw_cam,
+        }
+
+    def infer(self, batch, explain):
+        try:
+            # With explain=True the backends produce the Grad-CAM in the same pass.
+            with self.timed("forward_gradcam" if explain else "forward"):
+                return self.backend.infer(batch, explain=explain)
+        except Exception as e:
+            if not explain:
+                raise
+            logger.error(f"GradCAM generation failed: {e}")
+            with self.timed("forward"):
+                return self.backend.infer(batch, explain=False)
+
+    def predict_batch(self, images, explain=True, heatmap_format="overlay"):
+        # One forward pass for the whole batch; each caller still gets its own result dict.
+        # explain=False (or heatmap_format="none") skips the Grad-CAM backward and
+        # returns no heatmap; "raw" returns the quantized CAM instead of an overlay PNG.
+        if heatmap_format not in HEATMAP_FORMATS:
+            raise ValueError(f"Unknown heatmap format '{heatmap_format}', expected one of {HEATMAP_FORMATS}")
+        explain = explain and heatmap_format != "none"
+        if self.backend is None:
+            return [self.mock_predict(image, explain=explain, heatmap_format=heatmap_format) for image in images]
+
+        # The 224x224 uint8 images are kept for the heatmap overlay, so the
+        # originals are only resized once.
+        with self.timed("preprocess"):
+            batch, resized = self.preprocessor.batch(images)
+        return self.predict_preprocessed(batch, resized, explain=explain, heatmap_format=heatmap_format)
+
+    def predict_preprocessed(self, batch, resized, explain=True, heatmap_format="overlay"):
+        """``predict_batch`` for images already resized (``resized``, uint8) and normalised (``batch``)."""
+        explain = explain and heatmap_format != "none"
+        if self.backend is None:
+            return [self.mock_predict(Image.fromarray(pixels), explain=explain, heatmap_format=heatmap_format) for pixels in resized]
+
+        logits, cams = self.infer(batch, explain)
+        probabilities = softmax(logits).tolist()
+
+        heatmaps = [None] * len(resized)
+        raw_cams = [{}] * len(resized)
+        if cams is not None and heatmap_format == "raw":
+            raw_cams = self.render_raw_cams(cams)
+        elif cams is not None:
+            heatmaps = self.render_heatmaps_b64(cams, resized)
+
+        results = []
+        for (authentic_prob, forged_prob), heatmap_b64, raw_cam in zip(probabilities, heatmaps, raw_cams):
+            is_forged = forged_prob > authentic_prob
+            confidence = forged_prob if is_forged else authentic_prob
+            results.append({
                 "is_forged": is_forged,
                 "confidence": confidence,
                 "label": "Forged" if is_forged else "Authentic",
-                "message": "Model not found. Showing MOCK result.",
-                "heatmap_b64": heatmap_b64
-            }
+                "details": {
+                    "forged_probability": forged_prob,
+                    "authentic_probability": authentic_prob
+                },
+                "heatmap_b64": heatmap_b64,
+                **raw_cam,
+            })
+        return results
 
-        image_tensor = self.transform(image).unsqueeze(0).to(self.device)
-        
-        with torch.no_grad():
-            outputs = self.model(image_tensor)
-            probabilities = torch.nn.functional.softmax(outputs, dim=1)
-            
-            forged_prob = probabilities[0][1].item()
-            authentic_prob = probabilities[0][0].item()
-            
-            is_forged = forged_prob > authentic_prob
-            confidence = forged_prob if is_forged else authentic_prob
-            
-        heatmap_b64 = self.generate_heatmap_b64(image_tensor, image)
+    def predict(self, image: Image.Image, explain=True, heatmap_format="overlay"):
+        return self.predict_batch([image], explain=explain, heatmap_format=heatmap_format)[0]
+
+    def predict_tiled(self, image: Image.Image, explain=True, heatmap_format="overlay", scales=TILE_SCALES,
+                      overlap=TILE_OVERLAP, max_tiles=TILE_BUDGET, batch_size=TILE_BATCH_SIZE, early_exit=TILE_EARLY_EXIT):
+        """Score overlapping 224px tiles of the full-resolution image instead of one squashed view.
+
+        Tiles are cut at each of ``scales`` (coarse first, at most ``max_tiles``
+        in total) and run ``batch_size`` at a time. The document's forged
+        probability is that of its most suspicious tile; with ``early_exit`` set,
+        no further batches run once a tile reaches it. The heatmap is stitched
+        from all analysed tiles: forged tiles contribute their Grad-CAM scaled by
+        their forged probability, the others a flat forged probability, so
+        unlike ``predict`` it is not renormalised per document.
+        """
+        if heatmap_format not in HEATMAP_FORMATS:
+            raise ValueError(f"Unknown heatmap format '{heatmap_format}', expected one of {HEATMAP_FORMATS}")
+        explain = explain and heatmap_format != "none"
+        if self.backend is None:
+            return self.mock_predict(image, explain=explain, heatmap_format=heatmap_format)
 
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        size = self.preprocessor.size
+        levels = plan_levels(image.width, image.height, scales, size, overlap, max_tiles)
+        tiles = iter_tiles(image, levels, size, self.preprocessor.reducing_gap)
+        stitcher = HeatmapStitcher(image.width, image.height) if explain else None
+
+        scored, exited = [], False
+        while not exited:
+            with self.timed("tile_crop"):
+                chunk = list(islice(tiles, batch_size))
+            if not chunk:
+                break
+            with self.timed("preprocess"):
+                batch = self.preprocessor.normalize_batch([pixels for _, _, pixels in chunk])
+            logits, cams = self.infer(batch, explain)
+            probabilities = softmax(logits)
+
+            if cams is not None:
+                with self.timed("heatmap_stitch"):
+                    for (_, box, _), (authentic_prob, forged_prob), cam in zip(chunk, probabilities, normalize_cams(cams)):
+                        stitcher.add(box, forged_prob * cam if forged_prob > authentic_prob else np.full_like(cam, forged_prob))
+            for (level, box, _), forged_prob in zip(chunk, probabilities[:, 1]):
+                scored.append((float(forged_prob), level, box))
+            exited = bool(early_exit and probabilities[:, 1].max() >= early_exit)
+
+        forged_prob = max(score for score, _, _ in scored)
+        authentic_prob = 1.0 - forged_prob
+        is_forged = forged_prob > authentic_prob
+
+        heatmap_b64 = None
+        raw_cam = {}
+        if stitcher is not None:
+            stitched = stitcher.result()
+            if heatmap_format == "raw":
+                with self.timed("heatmap_encode"):
+                    raw_cam = encode_raw_cam(np.rint(stitched * 255).astype(np.uint8))
+            else:
+                heatmap_b64 = self.render_stitched_overlay(image, stitched)
+
+        top = sorted(scored, key=lambda item: item[0], reverse=True)[:5]
         return {
             "is_forged": is_forged,
-            "confidence": confidence,
+            "confidence": forged_prob if is_forged else authentic_prob,
             "label": "Forged" if is_forged else "Authentic",
             "details": {
                 "forged_probability": forged_prob,
                 "authentic_probability": authentic_prob
             },
-            "heatmap_b64": heatmap_b64
+            "heatmap_b64": heatmap_b64,
+            **raw_cam,
+            "tiles": {
+                "analyzed": len(scored),
+                "planned": sum(len(level.xs) * len(level.ys) for level in levels),
+                "early_exit": exited,
+                "scales": [level.scale and round(level.scale, 3) for level in levels],
+                "top": [
+                    {"box": [round(value) for value in box], "scale": level.scale and round(level.scale, 3), "forged_probability": score}
+                    for score, level, box in top
+                ],
+            },
         }
 
-detector = ForgeryDetectionModel()
+    def render_stitched_overlay(self, image, stitched):
+        width, height = image.size
+        if TILE_OVERLAY_MAX_SIDE and max(width, height) > TILE_OVERLAY_MAX_SIDE:
+            image = image.copy()
+            image.thumbnail((TILE_OVERLAY_MAX_SIDE, TILE_OVERLAY_MAX_SIDE), Image.BILINEAR)
+            width, height = image.size
+        try:
+            import cv2
+            with self.timed("heatmap_overlay"):
+                overlay = overlay_cam(np.asarray(image), cv2.resize(stitched, (width, height), interpolation=cv2.INTER_LINEAR))
+            with self.timed("heatmap_encode"):
+                return png_b64(overlay)
+        except Exception as e:
+            logger.error(f"Stitched heatmap rendering failed: {e}")
+            return None
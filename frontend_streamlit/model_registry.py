@@ -0,0 +1,194 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VERSION = "default"
+# Version served when a request does not pin one, until an admin activates another.
+ACTIVE_VERSION = os.environ.get("FORGERY_MODEL_VERSION", DEFAULT_VERSION)
+# Versions kept loaded at once; the least recently used inactive one is unloaded first.
+MAX_RESIDENT = int(os.environ.get("FORGERY_MAX_RESIDENT_MODELS", "2"))
+REGISTRY_DIR = os.environ.get("FORGERY_REGISTRY_DIR") or None
+
+
+class UnknownModelVersion(LookupError):
+    pass
+
+
+def discover_versions(models_dir, registry_dir=REGISTRY_DIR):
+    """Map version names to artifact directories.
+
+    ``models_dir`` itself is the ``default`` version; every sub-directory of
+    ``registry_dir`` (``models_dir/versions`` unless set) is a version named
+    after it, holding the same artifact file names. The directory is scanned
+    on every call, so copying in a new version needs no restart.
+    """
+    versions = {DEFAULT_VERSION: models_dir}
+    registry_dir = registry_dir or os.path.join(models_dir, "versions")
+    if os.path.isdir(registry_dir):
+        for name in sorted(os.listdir(registry_dir)):
+            path = os.path.join(registry_dir, name)
+            if os.path.isdir(path) and not name.startswith("."):
+                versions[name] = path
+    return versions
+
+
+class ModelEntry:
+    """One resident version: its detector, its own micro-batcher and the requests using it."""
+
+    def __init__(self, version, detector, batcher, on_close=None):
+        self.version = version
+        self.detector = detector
+        self.batcher = batcher
+        self.on_close = on_close
+        self.loaded_at = time.time()
+        self.leases = 0
+        self.retired = False
+
+    def close(self):
+        # Queued work finishes first: the batcher's stop sentinel queues behind it.
+        self.batcher.close()
+        if self.on_close is not None:
+            self.on_close()
+
+    def stats(self):
+        return {
+            "backend": getattr(self.detector, "backend_name", "mock"),
+            "fingerprint": getattr(self.detector, "fingerprint", None),
+            "loaded_at": self.loaded_at,
+            "in_flight": self.leases,
+            "batching": self.batcher.stats(),
+        }
+
+
+class ModelRegistry:
+    """Several named model versions resident at once, one of them active.
+
+    Requests ``acquire`` an entry (the active version unless they pin one)
+    and ``release`` it when done. ``activate`` loads and warms the new version
+    before swapping the active name under the lock, so requests already
+    holding the old entry finish on it undisturbed. An evicted version is
+    closed only once its last lease is released.
+    """
+
+    def __init__(self, load_entry, list_versions, active=ACTIVE_VERSION, max_resident=MAX_RESIDENT):
+        # load_entry(version, path) -> ModelEntry; list_versions() -> {version: path}
+        self._load_entry = load_entry
+        self._list_versions = list_versions
+        self.active_version = active
+        self.max_resident = max(1, int(max_resident))
+        self.activations = 0
+
+        self._lock = threading.Lock()
+        self._resident = OrderedDict()
+        self._load_locks = {}
+
+    def versions(self):
+        return self._list_versions()
+
+    def resident(self):
+        with self._lock:
+            return list(self._resident.values())
+
+    def _lease(self, version):
+        # Called with the lock held.
+        entry = self._resident.get(version)
+        if entry is not None:
+            self._resident.move_to_end(version)
+            entry.leases += 1
+        return entry
+
+    def acquire(self, version=None, load=True):
+        """Return a leased entry for ``version`` (default: the active one).
+
+        With ``load=False`` this never blocks on loading and returns None for
+        a version that is not resident yet.
+        """
+        with self._lock:
+            version = version or self.active_version
+            entry = self._lease(version)
+        if entry is not None or not load:
+            return entry
+
+        paths = self._list_versions()
+        if version not in paths:
+            raise UnknownModelVersion(f"Unknown model version '{version}', expected one of {sorted(paths)}")
+        with self._lock:
+            load_lock = self._load_locks.setdefault(version, threading.Lock())
+        # One load per version at a time; concurrent requests for it wait here.
+        with load_lock:
+            with self._lock:
+                entry = self._lease(version)
+            if entry is not None:
+                return entry
+
+            logger.info(f"Loading model version '{version}' from {paths[version]}")
+            entry = self._load_entry(version, paths[version])
+            with self._lock:
+                self._resident[version] = entry
+                entry.leases += 1
+                evicted = self._evict(keep=version)
+        for retired in evicted:
+            retired.close()
+        return entry
+
+    def release(self, entry):
+        with self._lock:
+            entry.leases -= 1
+            closable = [entry] if entry.retired and entry.leases == 0 else []
+            # A pinned load may have been kept over the limit while in use.
+            closable += self._evict()
+        for retired in closable:
+            retired.close()
+
+    def _evict(self, keep=None):
+        # Called with the lock held; returns the entries that can be closed now.
+        closable = []
+        while len(self._resident) > self.max_resident:
+            victim = next((version for version in self._resident if version not in (self.active_version, keep)), None)
+            if victim is None:
+                break
+            entry = self._resident.pop(victim)
+            entry.retired = True
+            logger.info(f"Unloading model version '{victim}'")
+            if entry.leases == 0:
+                closable.append(entry)
+        return closable
+
+    def activate(self, version):
+        """Load ``version`` if needed, then make it the active one. Returns the previous version."""
+        entry = self.acquire(version)
+        try:
+            with self._lock:
+                previous, self.active_version = self.active_version, version
+                self.activations += 1
+                # The previous version may now be over the resident limit.
+                evicted = self._evict()
+        finally:
+            self.release(entry)
+        for retired in evicted:
+            retired.close()
+        logger.info(f"Active model version switched from '{previous}' to '{version}'")
+        return previous
+
+    def close(self):
+        with self._lock:
+            entries = list(self._resident.values())
+            self._resident.clear()
+        for entry in entries:
+            entry.close()
+
+    def stats(self):
+        with self._lock:
+            resident = {version: entry.stats() for version, entry in self._resident.items()}
+            active = self.active_version
+        return {
+            "active": active,
+            "max_resident": self.max_resident,
+            "activations": self.activations,
+            "available": sorted(self._list_versions()),
+            "resident": resident,
+        }
@@ -0,0 +1,168 @@
+import gc
+import logging
+import mmap
+import multiprocessing
+import os
+import signal
+import socket
+import struct
+import time
+
+logger = logging.getLogger(__name__)
+
+# Worker processes forked from one parent; 1 keeps the plain single-process server.
+WORKERS = int(os.environ.get("FORGERY_WORKERS", "1"))
+# Intra-op threads per worker; 0 splits the machine's cores evenly between workers.
+TORCH_THREADS = int(os.environ.get("FORGERY_TORCH_THREADS", "0"))
+# A worker that dies sooner than this after starting is restarted with a growing delay.
+MIN_UPTIME_S = float(os.environ.get("FORGERY_WORKER_MIN_UPTIME_S", "10"))
+MAX_RESTART_DELAY_S = 30.0
+# How long workers get to finish in-flight requests on shutdown before being killed.
+GRACEFUL_TIMEOUT_S = float(os.environ.get("FORGERY_GRACEFUL_TIMEOUT_S", "30"))
+
+
+def threads_per_worker(workers, threads=TORCH_THREADS, cpu_count=None):
+    if threads > 0:
+        return threads
+    if cpu_count is None:
+        # Cores this process may run on, which is what a container limit sets.
+        cpu_count = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    return max(1, cpu_count // max(1, workers))
+
+
+def bind_socket(host, port, backlog=2048):
+    # Bound once in the parent; every worker accepts from the same socket.
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class SharedValue:
+    """A short string every worker can read and any worker can replace.
+
+    Lives in an anonymous shared mapping created before the fork, next to a
+    generation counter so readers can cheaply tell whether it changed.
+    """
+
+    SIZE = 256
+    _HEADER = struct.Struct("QH")
+
+    def __init__(self, value=""):
+        self._map = mmap.mmap(-1, self.SIZE)
+        self._lock = multiprocessing.Lock()
+        self.set(value)
+
+    def set(self, value):
+        data = value.encode("utf-8")
+        if len(data) > self.SIZE - self._HEADER.size:
+            raise ValueError(f"Shared value of {len(data)} bytes is too long")
+        with self._lock:
+            generation = self._HEADER.unpack_from(self._map)[0] + 1
+            self._HEADER.pack_into(self._map, 0, generation, len(data))
+            self._map[self._HEADER.size:self._HEADER.size + len(data)] = data
+
+    def get(self):
+        """Return ``(generation, value)``."""
+        with self._lock:
+            generation, length = self._HEADER.unpack_from(self._map)
+            data = self._map[self._HEADER.size:self._HEADER.size + length]
+        return generation, data.decode("utf-8")
+
+
+class PreforkServer:
+    """Loads once in the parent, then forks workers that share its memory.
+
+    ``preload()`` runs in the parent before any worker exists, so whatever it
+    loads (torch, the model weights) is inherited copy-on-write; the garbage
+    collector is frozen first so its bookkeeping does not write to, and
+    thereby copy, those pages. ``serve(index)`` runs in each worker and should
+    block until the worker is asked to stop (SIGTERM). The parent only
+    supervises: a worker that exits unexpectedly is replaced, with a growing
+    delay while it keeps dying right after starting.
+    """
+
+    def __init__(self, serve, workers=WORKERS, preload=None, min_uptime=MIN_UPTIME_S, graceful_timeout=GRACEFUL_TIMEOUT_S):
+        self.serve = serve
+        self.workers = max(1, int(workers))
+        self.preload = preload
+        self.min_uptime = min_uptime
+        self.graceful_timeout = graceful_timeout
+        self.restarts = 0
+        self._children = {}
+        self._delays = {}
+        self._stopping = False
+
+    def _spawn(self, index):
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                self.serve(index)
+            except BaseException:
+                logger.exception(f"Worker {index} failed")
+                status = 1
+            finally:
+                # Never fall back into the parent's supervision loop.
+                os._exit(status)
+        self._children[pid] = (index, time.monotonic())
+        logger.info(f"Started worker {index} (pid {pid})")
+
+    def _stop(self, signum, frame):
+        self._stopping = True
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def _reap(self, pid, status):
+        index, started = self._children.pop(pid)
+        code = os.waitstatus_to_exitcode(status)
+        if self._stopping:
+            return
+        uptime = time.monotonic() - started
+        if uptime < self.min_uptime:
+            delay = min(MAX_RESTART_DELAY_S, max(1.0, 2 * self._delays.get(index, 0.5)))
+        else:
+            delay = 0.0
+        self._delays[index] = delay
+        logger.warning(f"Worker {index} (pid {pid}) exited with {code} after {uptime:.1f}s, restarting in {delay:.1f}s")
+        if delay:
+            time.sleep(delay)
+        if not self._stopping:
+            self.restarts += 1
+            self._spawn(index)
+
+    def run(self):
+        if self.preload is not None:
+            self.preload()
+        gc.collect()
+        gc.freeze()
+
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        for index in range(self.workers):
+            self._spawn(index)
+
+        while self._children and not self._stopping:
+            pid, status = os.wait()
+            if pid in self._children:
+                self._reap(pid, status)
+
+        deadline = time.monotonic() + self.graceful_timeout
+        while self._children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid:
+                self._children.pop(pid, None)
+            elif time.monotonic() > deadline:
+                for pid in self._children:
+                    os.kill(pid, signal.SIGKILL)
+                    logger.warning(f"Killed worker pid {pid} after the {self.graceful_timeout:.0f}s graceful timeout")
+                deadline = float("inf")
+            else:
+                time.sleep(0.1)
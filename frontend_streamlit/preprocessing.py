@@ -0,0 +1,126 @@
+import io
+import os
+import re
+import threading
+
+import numpy as np
+from PIL import Image
+
+INPUT_SIZE = 224
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+# JPEG draft decoding keeps at least this multiple of the input size so the
+# final bilinear resize still has real pixels to average over.
+DRAFT_OVERSAMPLE = 2
+JPEG_DRAFT = os.environ.get("FORGERY_JPEG_DRAFT", "1") != "0"
+# Optional PIL reducing_gap for the final resize: large non-JPEG scans are
+# first box-reduced in integer steps, trading a few grey levels for speed.
+REDUCING_GAP = float(os.environ.get("FORGERY_REDUCING_GAP", "0")) or None
+
+
+class ImageTooLarge(ValueError):
+    def __init__(self, width, height, max_pixels, pixels=None):
+        # Without a size, PIL refused the header itself and only reported a pixel count.
+        size = f"{width}x{height}" if width is not None else pixels or "too many"
+        super().__init__(f"Image of {size} pixels exceeds the {max_pixels} pixel limit")
+        self.width = width
+        self.height = height
+        self.max_pixels = max_pixels
+
+
+def open_image(source, max_pixels=None):
+    """``Image.open`` that reports PIL's own decompression bomb refusal as ``ImageTooLarge``.
+
+    PIL refuses images over twice ``Image.MAX_IMAGE_PIXELS`` before the caller
+    sees the header, with a message quoting its own limit; the error raised
+    here quotes ``max_pixels`` instead, so every oversized image reads the same.
+    """
+    try:
+        return Image.open(source)
+    except Image.DecompressionBombError as e:
+        # PIL only keeps the pixel count, in the message: "Image size (N pixels) exceeds ...".
+        match = re.search(r"\((\d+) pixels\)", str(e))
+        raise ImageTooLarge(None, None, max_pixels or 2 * Image.MAX_IMAGE_PIXELS, pixels=match and int(match[1])) from e
+
+
+def load_image(source, size=INPUT_SIZE, draft=JPEG_DRAFT, max_pixels=None):
+    """Decode ``source`` (bytes, path or file object) to an RGB image.
+
+    With ``draft`` enabled, JPEGs are decoded directly at a reduced scale
+    (libjpeg DCT scaling) that is still at least ``DRAFT_OVERSAMPLE * size``
+    on both sides, which skips most of the work for large phone photos.
+    ``max_pixels`` is checked against the header before any pixel data is
+    decoded and raises ``ImageTooLarge``.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    image = open_image(source, max_pixels)
+    width, height = image.size
+    if max_pixels and width * height > max_pixels:
+        raise ImageTooLarge(width, height, max_pixels)
+    if draft and image.format == "JPEG":
+        target = size * DRAFT_OVERSAMPLE
+        image.draft("RGB", (target, target))
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    # Decode now, on the caller's thread, rather than lazily wherever the image is first used.
+    image.load()
+    return image
+
+
+class Preprocessor:
+    """Resize + ToTensor + Normalize, written straight into a reusable buffer.
+
+    Produces the same values as the torchvision chain
+    ``Resize((224, 224)) -> ToTensor() -> Normalize(mean, std)`` (up to float32
+    rounding) but folds the scaling and normalisation into one multiply-add
+    per pixel. Buffers are per thread and reused between calls, so a batch
+    returned by ``batch`` is only valid until the next call on that thread.
+    """
+
+    def __init__(self, size=INPUT_SIZE, mean=IMAGENET_MEAN, std=IMAGENET_STD, reducing_gap=REDUCING_GAP):
+        self.size = size
+        self.reducing_gap = reducing_gap
+        std = np.asarray(std, dtype=np.float32)
+        self.scale = (1.0 / (255.0 * std)).reshape(3, 1, 1).astype(np.float32)
+        self.offset = (-np.asarray(mean, dtype=np.float32) / std).reshape(3, 1, 1).astype(np.float32)
+        self._local = threading.local()
+
+    def __repr__(self):
+        return f"Preprocessor(size={self.size}, reducing_gap={self.reducing_gap}, scale={self.scale.ravel().tolist()}, offset={self.offset.ravel().tolist()})"
+
+    def _buffer(self, count):
+        buffer = getattr(self._local, "buffer", None)
+        if buffer is None or buffer.shape[0] < count:
+            buffer = np.empty((count, 3, self.size, self.size), dtype=np.float32)
+            self._local.buffer = buffer
+        return buffer[:count]
+
+    def resize(self, image):
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        # Same resampling torchvision's Resize uses for PIL images.
+        return np.asarray(image.resize((self.size, self.size), Image.BILINEAR, reducing_gap=self.reducing_gap))
+
+    def normalize_into(self, pixels, out):
+        np.multiply(pixels.transpose(2, 0, 1), self.scale, out=out)
+        out += self.offset
+        return out
+
+    def normalize_batch(self, pixels):
+        """Like ``batch`` for uint8 arrays already at the input size: no resize, same reused buffer."""
+        out = self._buffer(len(pixels))
+        for i, tile in enumerate(pixels):
+            self.normalize_into(tile, out[i])
+        return out
+
+    def batch(self, images):
+        """Return ``(batch, resized)``: a float32 NCHW array and the 224x224 uint8 images."""
+        out = self._buffer(len(images))
+        resized = []
+        for i, image in enumerate(images):
+            pixels = self.resize(image)
+            self.normalize_into(pixels, out[i])
+            resized.append(pixels)
+        return out, resized
@@ -0,0 +1,99 @@
+import json
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+
+class RemoteInferenceError(RuntimeError):
+    pass
+
+
+class RemoteDetector:
+    """Client for ``backend_api.py`` over one pooled keep-alive session.
+
+    Connection failures and 502/503/504 answers (including the backend's own
+    ``model_loading`` and overload rejections) are retried with exponential
+    backoff, honouring ``Retry-After``. Read timeouts are not retried: the
+    backend may still be working on the request, and resending it would only
+    add load.
+    """
+
+    def __init__(self, base_url, connect_timeout=3.0, read_timeout=60.0, retries=3, backoff=0.5, pool_size=10):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        # Results are cached by the backend, keyed on its own weights fingerprint.
+        self.fingerprint = None
+
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,
+            status=retries,
+            backoff_factor=backoff,
+            status_forcelist=(502, 503, 504),
+            # /analyze is idempotent, so POSTs are safe to resend.
+            allowed_methods=frozenset({"GET", "POST"}),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _post(self, path, **kwargs):
+        try:
+            response = self.session.post(self.base_url + path, timeout=self.timeout, **kwargs)
+        except requests.RequestException as e:
+            raise RemoteInferenceError(f"Backend at {self.base_url} is unreachable: {e}")
+        if response.status_code >= 400:
+            try:
+                message = response.json().get("error") or response.text
+            except ValueError:
+                message = response.text
+            raise RemoteInferenceError(f"Backend answered {response.status_code}: {message}")
+        return response
+
+    def analyze(self, data, filename="upload", heatmap_format="raw", tiled=False):
+        params = {"heatmap_format": heatmap_format, "tiled": str(tiled).lower()}
+        response = self._post("/analyze", params=params, files={"file": (filename, data)})
+        result = response.json()
+        if "error" in result:
+            raise RemoteInferenceError(result["error"])
+        return result
+
+    def analyze_batch(self, uploads, heatmap_format="raw"):
+        """Yield per-document results from ``/analyze/batch`` as the backend streams them.
+
+        ``uploads`` is a sequence of ``(filename, bytes)``; results arrive in
+        completion order and carry the ``index`` of their document.
+        """
+        files = [("files", (filename, data)) for filename, data in uploads]
+        response = self._post("/analyze/batch", params={"heatmap_format": heatmap_format}, files=files, stream=True)
+        with response:
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+
+    def analyze_pages(self, data, filename="upload", heatmap_format="raw"):
+        """Yield page results of a PDF or multi-page TIFF as they complete, then ``{"document": verdict}``."""
+        response = self._post("/analyze/pages", params={"heatmap_format": heatmap_format}, files={"file": (filename, data)}, stream=True)
+        with response:
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+
+    def ready(self):
+        # Plain request outside the session: its retries would wait out a 503.
+        try:
+            return requests.get(self.base_url + "/readyz", timeout=self.timeout).status_code == 200
+        except requests.RequestException as e:
+            logger.warning(f"Readiness check against {self.base_url} failed: {e}")
+            return False
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,77 @@
+import base64
+import json
+import uuid
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+MULTIPART = "multipart/mixed"
+
+_MSGPACK_TYPES = {MSGPACK, "application/x-msgpack", "application/vnd.msgpack"}
+
+
+class NotAcceptable(Exception):
+    pass
+
+
+def negotiate(accept):
+    """Pick JSON, msgpack or multipart from an Accept header; JSON unless asked otherwise."""
+    for part in (accept or "").split(","):
+        media_type = part.split(";", 1)[0].strip().lower()
+        if media_type in _MSGPACK_TYPES:
+            return MSGPACK
+        if media_type == MULTIPART:
+            return MULTIPART
+    return JSON
+
+
+def split_binary(result):
+    """Return ``(metadata, payload, payload_type)`` with the heatmap pulled out as raw bytes."""
+    metadata = dict(result)
+    heatmap_b64 = metadata.pop("heatmap_b64", None)
+    cam_b64 = metadata.pop("cam_b64", None)
+    if cam_b64 is not None:
+        return metadata, base64.b64decode(cam_b64), "application/octet-stream"
+    if heatmap_b64 is not None:
+        return metadata, base64.b64decode(heatmap_b64), "image/png"
+    return metadata, None, None
+
+
+def encode_msgpack(result):
+    # msgpack is optional; without it clients can still ask for multipart.
+    try:
+        import msgpack
+    except ImportError:
+        raise NotAcceptable("msgpack responses need the msgpack package (pip install msgpack)")
+
+    metadata, payload, payload_type = split_binary(result)
+    if payload is not None:
+        metadata["cam" if payload_type == "application/octet-stream" else "heatmap_png"] = payload
+    return msgpack.packb(metadata, use_bin_type=True), MSGPACK
+
+
+def encode_multipart(result):
+    """A JSON part with the result, followed by one binary part with the heatmap if there is one."""
+    metadata, payload, payload_type = split_binary(result)
+    boundary = uuid.uuid4().hex
+    body = [
+        f"--{boundary}\r\nContent-Type: {JSON}\r\nContent-Disposition: inline; name=\"result\"\r\n\r\n".encode("ascii"),
+        json.dumps(metadata).encode("utf-8"),
+        b"\r\n",
+    ]
+    if payload is not None:
+        name = "cam" if payload_type == "application/octet-stream" else "heatmap"
+        body.append(
+            f"--{boundary}\r\nContent-Type: {payload_type}\r\nContent-Disposition: inline; name=\"{name}\"\r\n"
+            f"Content-Length: {len(payload)}\r\n\r\n".encode("ascii")
+        )
+        body.extend([payload, b"\r\n"])
+    body.append(f"--{boundary}--\r\n".encode("ascii"))
+    return b"".join(body), f"{MULTIPART}; boundary={boundary}"
+
+
+def encode_result(result, media_type):
+    if media_type == MSGPACK:
+        return encode_msgpack(result)
+    if media_type == MULTIPART:
+        return encode_multipart(result)
+    return json.dumps(result).encode("utf-8"), JSON
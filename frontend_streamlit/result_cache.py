@@ -0,0 +1,110 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def content_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class ResultCache:
+    """Prediction results keyed by upload content and model fingerprint.
+
+    The memory tier is a bounded LRU shared by every fingerprint, so several
+    resident model versions keep their own warm entries and results of
+    retired weights simply age out. The optional disk tier stores one JSON
+    file per entry under ``disk_dir/<fingerprint>/`` so it survives restarts.
+    """
+
+    def __init__(self, max_entries=1024, disk_dir=None):
+        self.max_entries = max(0, int(max_entries))
+        self.disk_dir = disk_dir
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(digest, variant=""):
+        return f"{digest}-{variant}" if variant else digest
+
+    def _disk_path(self, key, fingerprint):
+        return os.path.join(self.disk_dir, fingerprint[:32], f"{key}.json")
+
+    def get(self, key, fingerprint):
+        if fingerprint is None:
+            return None
+
+        with self._lock:
+            result = self._entries.get((fingerprint, key))
+            if result is not None:
+                self._entries.move_to_end((fingerprint, key))
+                self.hits += 1
+                return result
+
+        if self.disk_dir:
+            try:
+                with open(self._disk_path(key, fingerprint), "r") as f:
+                    result = json.load(f)
+            except (OSError, ValueError):
+                result = None
+            if result is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                    self._remember((fingerprint, key), result)
+                return result
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, fingerprint, result):
+        if fingerprint is None or "error" in result:
+            return
+
+        with self._lock:
+            self._remember((fingerprint, key), result)
+
+        if self.disk_dir:
+            path = self._disk_path(key, fingerprint)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+                with os.fdopen(fd, "w") as f:
+                    json.dump(result, f)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logger.warning(f"Could not write result cache entry: {e}")
+
+    def _remember(self, key, result):
+        if self.max_entries == 0:
+            return
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "disk_dir": self.disk_dir,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
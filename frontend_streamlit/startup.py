@@ -0,0 +1,63 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class Startup:
+    """Background model loading with per-stage timings and a readiness flag.
+
+    ``started`` is a ``time.perf_counter()`` value taken as early as possible
+    in the process, so ``status()`` also shows how long the server's own
+    imports took before loading began.
+    """
+
+    def __init__(self, started=None):
+        self.started = started if started is not None else time.perf_counter()
+        self.timings = {}
+        self.ready = threading.Event()
+        self.error = None
+        self._ready_at = None
+        self._thread = None
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = time.perf_counter() - start
+            logger.info(f"Startup stage {name} took {self.timings[name]:.3f}s")
+
+    def run_in_background(self, target):
+        # target(startup) does the loading; readiness is only signalled if it returns.
+        self.timings["server_imports"] = time.perf_counter() - self.started
+
+        def run():
+            try:
+                target(self)
+            except Exception as e:
+                logger.exception("Model startup failed")
+                self.error = str(e)
+                return
+            self._ready_at = time.perf_counter()
+            self.ready.set()
+            logger.info(f"Ready after {self._ready_at - self.started:.3f}s")
+
+        self._thread = threading.Thread(target=run, name="startup", daemon=True)
+        self._thread.start()
+
+    def wait(self, timeout=None):
+        return self.ready.wait(timeout)
+
+    def status(self):
+        ready = self.ready.is_set()
+        end = self._ready_at if ready else time.perf_counter()
+        return {
+            "ready": ready,
+            "error": self.error,
+            "elapsed_s": round(end - self.started, 4),
+            "stages_s": {name: round(seconds, 4) for name, seconds in self.timings.items()},
+        }
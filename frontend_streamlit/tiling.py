@@ -0,0 +1,115 @@
+import os
+from collections import namedtuple
+
+import numpy as np
+from PIL import Image
+
+# Scale 1.0 tiles the image at its native resolution; 0.5 first halves it, so
+# each 224px tile covers 448 original pixels. Scales run coarse to fine.
+TILE_SCALES = tuple(float(scale) for scale in os.environ.get("FORGERY_TILE_SCALES", "0.5,1.0").split(","))
+TILE_OVERLAP = float(os.environ.get("FORGERY_TILE_OVERLAP", "0.25"))
+# Upper bound on tiles per document; scales that would exceed it are coarsened together.
+TILE_BUDGET = int(os.environ.get("FORGERY_TILE_BUDGET", "64"))
+TILE_BATCH_SIZE = int(os.environ.get("FORGERY_TILE_BATCH_SIZE", "16"))
+# Stop once any tile reaches this forged probability (0 disables early exit).
+TILE_EARLY_EXIT = float(os.environ.get("FORGERY_TILE_EARLY_EXIT", "0.95"))
+# Longest side of the stitched overlay PNG (0 keeps the full resolution).
+TILE_OVERLAY_MAX_SIDE = int(os.environ.get("FORGERY_TILE_OVERLAY_MAX_SIDE", "2048"))
+# Original pixels per cell of the stitched map; a 224px tile's 7x7 CAM has
+# 32px cells at scale 1, so this keeps all of its detail.
+STITCH_CELL = 8
+
+# requested/scale: asked for and actually used; width/height: the resized
+# image that is cut into tiles at xs x ys offsets.
+TileLevel = namedtuple("TileLevel", ["requested", "scale", "width", "height", "xs", "ys"])
+
+
+def tiled_cache_variant(heatmap_format, max_tiles=TILE_BUDGET, early_exit=TILE_EARLY_EXIT):
+    """Result-cache variant of a tiled prediction, covering every setting that changes it."""
+    scales = "_".join(str(scale) for scale in TILE_SCALES)
+    return f"tiled-{scales}-{TILE_OVERLAP}-{max_tiles}-{early_exit}-{TILE_OVERLAY_MAX_SIDE}-{heatmap_format}"
+
+
+def axis_offsets(length, tile, overlap):
+    """Tile offsets along one axis, evenly spread so the last tile ends at the edge."""
+    if length <= tile:
+        return [0]
+    stride = max(1, int(tile * (1 - overlap)))
+    count = -(-(length - tile) // stride) + 1
+    return [round(i * (length - tile) / (count - 1)) for i in range(count)]
+
+
+def plan_levels(width, height, scales=TILE_SCALES, tile=224, overlap=TILE_OVERLAP, max_tiles=TILE_BUDGET):
+    """Choose the tile grid per scale, coarse to fine, within ``max_tiles`` in total.
+
+    When the requested scales need more tiles than that, all of them are
+    shrunk by the same factor until they fit, so the pyramid keeps its shape
+    and every level still covers the whole image. Levels that end up the same
+    size are merged; if even single-tile short sides do not fit, the plan is
+    the whole image squashed into one tile.
+    """
+    # Never shrink below one tile on the short side; small images are upsampled.
+    min_scale = tile / min(width, height)
+    factor = 1.0
+    while True:
+        levels, seen = [], set()
+        for requested in sorted(set(scales)):
+            scale = max(requested * factor, min_scale)
+            level_width, level_height = max(tile, round(width * scale)), max(tile, round(height * scale))
+            if (level_width, level_height) in seen:
+                continue
+            seen.add((level_width, level_height))
+            xs, ys = axis_offsets(level_width, tile, overlap), axis_offsets(level_height, tile, overlap)
+            levels.append(TileLevel(requested, scale, level_width, level_height, xs, ys))
+        if sum(len(level.xs) * len(level.ys) for level in levels) <= max_tiles:
+            return levels
+        if all(level.scale <= min_scale for level in levels):
+            return [TileLevel(None, None, tile, tile, [0], [0])]
+        factor *= 0.9
+
+
+def iter_tiles(image, levels, tile=224, reducing_gap=None):
+    """Yield ``(level, box, pixels)`` per tile, ``box`` in original image coordinates.
+
+    Each level is resized once, lazily, so stopping early skips the finer ones.
+    """
+    width, height = image.size
+    for level in levels:
+        if (level.width, level.height) == (width, height):
+            pixels = np.asarray(image)
+        else:
+            pixels = np.asarray(image.resize((level.width, level.height), Image.BILINEAR, reducing_gap=reducing_gap))
+        x_ratio, y_ratio = width / level.width, height / level.height
+        for y in level.ys:
+            for x in level.xs:
+                box = (x * x_ratio, y * y_ratio, (x + tile) * x_ratio, (y + tile) * y_ratio)
+                yield level, box, pixels[y:y + tile, x:x + tile]
+
+
+class HeatmapStitcher:
+    """Blends per-tile maps into one document map on a grid of ``cell`` px cells.
+
+    Every tile is weighted by a Hann window, so overlapping tiles fade into
+    each other instead of leaving seams along tile borders.
+    """
+
+    def __init__(self, width, height, cell=STITCH_CELL):
+        self.cell = cell
+        self.shape = (-(-height // cell), -(-width // cell))
+        self.total = np.zeros(self.shape, dtype=np.float32)
+        self.weight = np.zeros(self.shape, dtype=np.float32)
+
+    def add(self, box, tile_map):
+        import cv2
+
+        left, top, right, bottom = (round(value / self.cell) for value in box)
+        right, bottom = min(max(right, left + 1), self.shape[1]), min(max(bottom, top + 1), self.shape[0])
+        resized = cv2.resize(np.float32(tile_map), (right - left, bottom - top), interpolation=cv2.INTER_LINEAR)
+        # hanning(n + 2)[1:-1] drops the zero end points, so border cells keep some weight.
+        window = np.outer(np.hanning(bottom - top + 2)[1:-1], np.hanning(right - left + 2)[1:-1]).astype(np.float32)
+        self.total[top:bottom, left:right] += window * resized.reshape(window.shape)
+        self.weight[top:bottom, left:right] += window
+
+    def result(self):
+        """The stitched map in [0, 1]; cells no analysed tile reached are 0."""
+        return np.divide(self.total, self.weight, out=np.zeros_like(self.total), where=self.weight > 0)
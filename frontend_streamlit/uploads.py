@@ -0,0 +1,116 @@
+import hashlib
+import json
+
+CHUNK_SIZE = 1 << 20
+# Room for multipart boundaries and part headers on top of the file itself.
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class UploadRejected(Exception):
+    def __init__(self, code, message, status_code=413):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.status_code = status_code
+
+    def to_dict(self):
+        return {"error": self.message, "code": self.code, "is_forged": False, "confidence": 0.0}
+
+
+def file_too_large(size, limit):
+    return UploadRejected("file_too_large", f"Upload of {size} bytes exceeds the {limit} byte limit")
+
+
+def check_upload_size(upload, limit):
+    # Starlette has already spooled the part (to disk once it passes 1 MB) and knows its size.
+    size = upload.size
+    if size is None:
+        position = upload.file.tell()
+        upload.file.seek(0, 2)
+        size = upload.file.tell()
+        upload.file.seek(position)
+    if limit and size > limit:
+        raise file_too_large(size, limit)
+    return size
+
+
+def file_digest(fileobj):
+    """SHA-256 of a file object, read in chunks and rewound afterwards."""
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b""):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+class BodySizeLimitMiddleware:
+    """Rejects request bodies above a per-path byte limit with 413.
+
+    ``Content-Length`` is checked before anything is read; chunked bodies are
+    counted as they stream in and cut off as soon as they cross the limit,
+    so an oversized upload is never fully received or spooled.
+    """
+
+    def __init__(self, app, limits):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope.get("path")) if scope["type"] == "http" else None
+        if not limit:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            await self._reject(send, int(content_length), limit)
+            return
+
+        received = 0
+        too_large = False
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received, too_large
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    too_large = True
+                    raise _BodyTooLarge()
+            return message
+
+        async def guarded_send(message):
+            nonlocal response_started
+            if too_large:
+                # The framework turns the aborted body into its own error
+                # response; answer with the 413 instead.
+                if message["type"] == "http.response.start" and not response_started:
+                    response_started = True
+                    await self._reject(send, received, limit)
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except _BodyTooLarge:
+            if not response_started:
+                await self._reject(send, received, limit)
+
+    @staticmethod
+    async def _reject(send, size, limit):
+        body = json.dumps(file_too_large(size, limit).to_dict()).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
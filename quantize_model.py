@@ -0,0 +1,217 @@
+import argparse
+import copy
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(current_dir, 'frontend_streamlit'))
+
+from evaluation import classification_metrics, list_images, load_labeled_folder
+from memory_usage import current_rss_bytes
+from preprocessing import load_image
+from graph_export import GradCamExportWrapper, feature_extractor
+from model_loader import (
+    MODEL_PATH,
+    QUANTIZED_PATH,
+    ForgeryDetectionModel,
+    load_network,
+    softmax,
+)
+
+REPORT_PATH = os.path.join(os.path.dirname(QUANTIZED_PATH), "quantization_report.json")
+
+
+def iter_batches(paths, preprocessor, batch_size):
+    # Same decode and preprocessing as the serving path.
+    for start in range(0, len(paths), batch_size):
+        images = [load_image(path) for path in paths[start:start + batch_size]]
+        batch, _ = preprocessor.batch(images)
+        yield batch
+
+
+def quantize_static(model, calibration_paths, preprocessor, batch_size, engine):
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    backbone = copy.deepcopy(feature_extractor(model)).eval()
+    example = torch.randn(1, 3, 224, 224)
+    prepared = prepare_fx(backbone, get_default_qconfig_mapping(engine), (example,))
+
+    # Observers record activation ranges over the calibration images.
+    with torch.no_grad():
+        for batch in iter_batches(calibration_paths, preprocessor, batch_size):
+            prepared(torch.from_numpy(batch))
+    return GradCamExportWrapper(model, backbone=convert_fx(prepared).eval())
+
+
+def quantize_dynamic(model):
+    # Dynamic INT8 only covers Linear layers, which in EfficientNet-B0 is just
+    # the classifier; the convolutional backbone stays in float.
+    quantized = torch.ao.quantization.quantize_dynamic(copy.deepcopy(model), {nn.Linear}, dtype=torch.qint8)
+    return GradCamExportWrapper(quantized)
+
+
+def save_artifact(wrapper, path):
+    example = torch.randn(1, 3, 224, 224)
+    with torch.no_grad():
+        traced = torch.jit.freeze(torch.jit.trace(wrapper.eval(), example))
+    traced.save(path)
+
+
+def measure_latency(backend, batch, repeats):
+    backend.infer(batch)
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        backend.infer(batch)
+        timings.append(time.perf_counter() - start)
+    timings = np.array(timings) * 1000.0
+    return {
+        "batch_size": int(batch.shape[0]),
+        "p50_ms": float(np.percentile(timings, 50)),
+        "p95_ms": float(np.percentile(timings, 95)),
+        "per_image_ms": float(np.median(timings) / batch.shape[0]),
+    }
+
+
+def forged_probabilities(backend, paths, preprocessor, batch_size):
+    probabilities = []
+    for batch in iter_batches(paths, preprocessor, batch_size):
+        logits, _ = backend.infer(batch, explain=False)
+        probabilities.append(softmax(logits)[:, 1])
+    return np.concatenate(probabilities)
+
+
+def load_backend(name, models_dir=None):
+    rss_before = current_rss_bytes()
+    detector = ForgeryDetectionModel(backend=name, models_dir=models_dir)
+    if detector.backend is None:
+        raise SystemExit(f"Could not load the {name} model from {detector.model_path or name}")
+    return detector, current_rss_bytes() - rss_before
+
+
+def quality_checks(report, args):
+    """Compare the INT8 model against the float one on the limits given; returns ``{check: {...}}``."""
+    checks = {}
+    agreement = report.get("agreement")
+    if agreement:
+        checks["label_agreement"] = {"value": agreement["label_agreement"], "min": args.min_agreement}
+    metrics = report.get("metrics")
+    if metrics:
+        for name, limit in (("accuracy", args.max_accuracy_drop), ("f1", args.max_f1_drop)):
+            checks[f"{name}_drop"] = {"value": metrics["float"][name] - metrics["int8"][name], "max": limit}
+    for check in checks.values():
+        check["passed"] = check["value"] >= check["min"] if "min" in check else check["value"] <= check["max"]
+    return checks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build an INT8 EfficientNet-B0 and compare it against the float model.")
+    parser.add_argument("--mode", choices=["static", "dynamic"], default="static")
+    parser.add_argument("--calibration-dir", help="Folder of sample images used to calibrate static quantization")
+    parser.add_argument("--max-calibration", type=int, default=256)
+    parser.add_argument("--eval-dir", help="Labeled folder with authentic/ and forged/ sub-folders")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--repeats", type=int, default=10, help="Timed batches per model for the latency comparison")
+    parser.add_argument("--engine", default="x86", help="Quantized kernel backend (x86, fbgemm, qnnpack, ...)")
+    parser.add_argument("--report", default=REPORT_PATH)
+    parser.add_argument("--max-accuracy-drop", type=float, default=0.01, help="Largest accepted accuracy loss against float (needs --eval-dir)")
+    parser.add_argument("--max-f1-drop", type=float, default=0.01, help="Largest accepted F1 loss against float (needs --eval-dir)")
+    parser.add_argument("--min-agreement", type=float, default=0.98, help="Smallest accepted share of images labeled as the float model does")
+    parser.add_argument("--skip-checks", action="store_true", help="Install the INT8 model even when it could not be checked or failed a check")
+    args = parser.parse_args()
+
+    if args.engine not in torch.backends.quantized.supported_engines:
+        raise SystemExit(f"Quantized engine {args.engine} is not supported here: {torch.backends.quantized.supported_engines}")
+    torch.backends.quantized.engine = args.engine
+
+    model = load_network(MODEL_PATH, torch.device("cpu"))
+    float_detector, float_rss = load_backend("eager")
+    preprocessor = float_detector.preprocessor
+
+    calibration_paths = list_images(args.calibration_dir)[:args.max_calibration] if args.calibration_dir else []
+    if args.mode == "static":
+        if not calibration_paths:
+            raise SystemExit("Static quantization needs --calibration-dir with sample images")
+        wrapper = quantize_static(model, calibration_paths, preprocessor, args.batch_size, args.engine)
+    else:
+        wrapper = quantize_dynamic(model)
+    # Built and checked next to the served artifact, which is only replaced once the checks pass.
+    candidate_dir = tempfile.mkdtemp(prefix=".quantize-", dir=os.path.dirname(QUANTIZED_PATH))
+    candidate_path = os.path.join(candidate_dir, os.path.basename(QUANTIZED_PATH))
+    try:
+        save_artifact(wrapper, candidate_path)
+        quantized_detector, quantized_rss = load_backend("quantized", candidate_dir)
+        report = compare(args, calibration_paths, float_detector, float_rss, quantized_detector, quantized_rss, candidate_path)
+
+        report["checks"] = quality_checks(report, args)
+        if not report["checks"]:
+            report["passed"] = args.skip_checks
+            reason = "no images to check it on; pass --eval-dir or --calibration-dir (or --skip-checks)"
+        else:
+            report["passed"] = args.skip_checks or all(check["passed"] for check in report["checks"].values())
+            reason = "failed " + ", ".join(name for name, check in report["checks"].items() if not check["passed"])
+        if report["passed"]:
+            os.replace(candidate_path, QUANTIZED_PATH)
+            print(f"Quantized ({args.mode}) model written to {QUANTIZED_PATH}")
+        else:
+            print(f"Quantized ({args.mode}) model not installed: {reason}; {QUANTIZED_PATH} is unchanged", file=sys.stderr)
+        report["installed"] = report["passed"]
+    finally:
+        shutil.rmtree(candidate_dir, ignore_errors=True)
+
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report["passed"] else 1)
+
+
+def compare(args, calibration_paths, float_detector, float_rss, quantized_detector, quantized_rss, candidate_path):
+    preprocessor = float_detector.preprocessor
+    report = {
+        "mode": args.mode,
+        "engine": args.engine,
+        "calibration_images": len(calibration_paths),
+        "artifact_bytes": {"float": os.path.getsize(MODEL_PATH), "int8": os.path.getsize(candidate_path)},
+        "load_rss_bytes": {"float": float_rss, "int8": quantized_rss},
+    }
+
+    batch = np.random.default_rng(0).standard_normal((args.batch_size, 3, 224, 224), dtype=np.float32)
+    report["latency"] = {
+        "float": measure_latency(float_detector.backend, batch, args.repeats),
+        "int8": measure_latency(quantized_detector.backend, batch, args.repeats),
+    }
+    report["latency"]["speedup"] = report["latency"]["float"]["p50_ms"] / report["latency"]["int8"]["p50_ms"]
+
+    if args.eval_dir:
+        paths, labels = load_labeled_folder(args.eval_dir)
+    else:
+        # Without labels, only agreement with the float model can be measured.
+        paths, labels = calibration_paths, None
+    if paths:
+        float_probs = forged_probabilities(float_detector.backend, paths, preprocessor, args.batch_size)
+        int8_probs = forged_probabilities(quantized_detector.backend, paths, preprocessor, args.batch_size)
+        float_pred, int8_pred = float_probs > 0.5, int8_probs > 0.5
+        report["agreement"] = {
+            "images": len(paths),
+            "label_agreement": float(np.mean(float_pred == int8_pred)),
+            "max_probability_diff": float(np.abs(float_probs - int8_probs).max()),
+        }
+        if labels is not None:
+            report["metrics"] = {
+                "float": classification_metrics(labels, float_pred),
+                "int8": classification_metrics(labels, int8_pred),
+            }
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(current_dir, 'frontend_streamlit'))
+
+from documents import archive_kind, iter_documents
+from embedding_store import EmbeddingStore
+from evaluation import list_images
+from model_loader import MODEL_PATH, softmax
+from preprocessing import load_image
+from result_cache import content_digest
+
+DEFAULT_STORE = os.path.join(current_dir, "embeddings")
+# Rows scored per matrix multiply; bounds memory, not speed.
+CHUNK_ROWS = 65536
+
+
+def iter_inputs(inputs):
+    """Yield ``(name, raw_bytes)`` for image files, folders of them and zip/tar archives."""
+    for path in inputs:
+        paths = list_images(path) if os.path.isdir(path) else [path]
+        for file_path in paths:
+            with open(file_path, "rb") as f:
+                if archive_kind(file_path, f):
+                    yield from iter_documents([(file_path, f)])
+                else:
+                    yield file_path, f.read()
+
+
+def embed(args):
+    from model_loader import ForgeryDetectionModel
+
+    model = ForgeryDetectionModel(backend="eager")
+    if model.backend is None:
+        sys.exit(f"No weights at {MODEL_PATH}; cannot compute embeddings")
+    store = EmbeddingStore(args.store, dim=model.model.num_features, fingerprint=model.backbone_fingerprint())
+    known = len(store)
+
+    started = time.perf_counter()
+    added = skipped = failed = 0
+    digests, images = [], []
+
+    def flush():
+        nonlocal added
+        if images:
+            added += store.add(digests, model.embed_batch(images))
+            digests.clear()
+            images.clear()
+
+    for name, data in iter_inputs(args.inputs):
+        digest = content_digest(data)
+        if digest in store or digest in digests:
+            skipped += 1
+            continue
+        try:
+            # Same decode as the API, so stored embeddings match what it scores.
+            images.append(load_image(data))
+        except Exception as e:
+            print(f"Skipping {name}: {e}", file=sys.stderr)
+            failed += 1
+            continue
+        digests.append(digest)
+        if len(images) >= args.batch_size:
+            flush()
+    flush()
+
+    seconds = time.perf_counter() - started
+    print(json.dumps({
+        "store": args.store,
+        "documents": len(store),
+        "added": added,
+        "already_stored": skipped,
+        "failed": failed,
+        "previously": known,
+        "seconds": round(seconds, 3),
+        "documents_per_s": round(added / seconds, 1) if seconds else None,
+    }, indent=2))
+
+
+def load_head(path):
+    """``(weight, bias)`` from an ``.npz`` (weight, bias) or a torch state dict (``classifier.*`` or bare keys)."""
+    if path.endswith(".npz"):
+        with np.load(path) as arrays:
+            return arrays["weight"].astype(np.float32), arrays["bias"].astype(np.float32)
+    import torch
+    # mmap: only the classifier tensors are read from a full checkpoint.
+    state_dict = torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+    prefix = "classifier." if "classifier.weight" in state_dict else ""
+    return state_dict[prefix + "weight"].float().numpy(), state_dict[prefix + "bias"].float().numpy()
+
+
+def score(args):
+    store = EmbeddingStore(args.store)
+    weight, bias = load_head(args.head)
+    if weight.shape[1] != store.dim:
+        sys.exit(f"Head expects {weight.shape[1]} features, the store holds {store.dim}")
+
+    started = time.perf_counter()
+    matrix = store.matrix()
+    forged_probabilities = np.empty(len(matrix), dtype=np.float32)
+    weight_t = np.ascontiguousarray(weight.T)
+    for start in range(0, len(matrix), CHUNK_ROWS):
+        logits = np.asarray(matrix[start:start + CHUNK_ROWS], dtype=np.float32) @ weight_t + bias
+        forged_probabilities[start:start + CHUNK_ROWS] = softmax(logits / args.temperature)[:, 1]
+    forged = forged_probabilities >= args.threshold
+    seconds = time.perf_counter() - started
+
+    if args.output:
+        digests = store.digests()
+        with open(args.output, "w") as f:
+            if args.output.endswith(".jsonl"):
+                f.writelines(
+                    json.dumps({"digest": d, "forged_probability": float(p), "is_forged": bool(y)}) + "\n"
+                    for d, p, y in zip(digests, forged_probabilities, forged)
+                )
+            else:
+                f.write("digest,forged_probability,is_forged\n")
+                f.writelines(f"{d},{p:.6f},{int(y)}\n" for d, p, y in zip(digests, forged_probabilities, forged))
+
+    print(json.dumps({
+        "documents": len(matrix),
+        "forged": int(forged.sum()),
+        "authentic": int(len(matrix) - forged.sum()),
+        "head": args.head,
+        "threshold": args.threshold,
+        "temperature": args.temperature,
+        "score_seconds": round(seconds, 3),
+        "documents_per_s": round(len(matrix) / seconds) if seconds else None,
+        "output": args.output,
+    }, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Store backbone embeddings once, then re-score them with any classifier head.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    embed_parser = commands.add_parser("embed", help="Run the backbone over images, folders or zip/tar archives and store the embeddings")
+    embed_parser.add_argument("inputs", nargs="+")
+    embed_parser.add_argument("--store", default=DEFAULT_STORE, help="Embedding store directory")
+    embed_parser.add_argument("--batch-size", type=int, default=32)
+    embed_parser.set_defaults(run=embed)
+
+    score_parser = commands.add_parser("score", help="Apply a classifier head to every stored embedding")
+    score_parser.add_argument("--store", default=DEFAULT_STORE, help="Embedding store directory")
+    score_parser.add_argument("--head", default=MODEL_PATH, help="Head weights: a .npz with weight/bias or a torch state dict (default: the deployed model)")
+    score_parser.add_argument("--threshold", type=float, default=0.5, help="Forged probability at or above which a document is forged")
+    score_parser.add_argument("--temperature", type=float, default=1.0, help="Divide logits by this before the softmax (calibration)")
+    score_parser.add_argument("--output", help="Write per-document scores to a .csv or .jsonl file")
+    score_parser.set_defaults(run=score)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+import os
+import struct
+import sys
+import zlib
+
+import pytest
+
+# The root scripts put frontend_streamlit/ on the path themselves; the tests import them from the repo root.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def png_header(width, height):
+    """A PNG that declares ``width`` x ``height`` pixels but holds no image data."""
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)) + chunk(b"IEND", b"")
+
+
+@pytest.fixture
+def bomb_png(tmp_path):
+    # 20000x20000 is over twice PIL's MAX_IMAGE_PIXELS, so Image.open itself raises DecompressionBombError.
+    path = tmp_path / "bomb.png"
+    path.write_bytes(png_header(20000, 20000))
+    return str(path)
@@ -0,0 +1,62 @@
+import io
+from argparse import Namespace
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from bulk_score import decode_chunk, run, score_documents
+from preprocessing import ImageTooLarge, Preprocessor
+
+
+def test_decode_chunk_turns_oversized_images_into_error_rows(tmp_path, bomb_png):
+    good = tmp_path / "good.png"
+    Image.new("RGB", (100, 80), "white").save(good)
+    large = tmp_path / "large.png"
+    Image.new("L", (300, 200)).save(large)
+    garbage = tmp_path / "garbage.jpg"
+    garbage.write_bytes(b"not an image")
+
+    decoded = decode_chunk([bomb_png, str(good), str(large), str(garbage)], 224, max_pixels=20000)
+
+    assert len(decoded) == 4
+    bomb, ok, too_large, unreadable = decoded
+    # PIL refuses the bomb before the header check; it is still reported against max_pixels.
+    assert bomb[0] is not None and bomb[1] is None and bomb[2] == "Image of 400000000 pixels exceeds the 20000 pixel limit"
+    assert ok[2] is None and ok[1].shape == (224, 224, 3) and ok[1].dtype == np.uint8
+    assert too_large[1] is None and "pixel limit" in too_large[2]
+    assert unreadable[1] is None and unreadable[2]
+
+
+class ConstantDetector:
+    # Stands in for ForgeryDetectionModel in the page-by-page path.
+    preprocessor = Preprocessor()
+
+    def predict_batch(self, images, **kwargs):
+        return [{"is_forged": False, "confidence": 0.75, "details": {"forged_probability": 0.25}} for _ in images]
+
+
+def test_score_documents_applies_the_pixel_limit_to_every_page(tmp_path):
+    pages = [Image.new("RGB", (100, 100)), Image.new("RGB", (400, 400))]
+    buffer = io.BytesIO()
+    pages[0].save(buffer, "TIFF", save_all=True, append_images=pages[1:])
+
+    assert score_documents(ConstantDetector(), buffer.getvalue(), max_pixels=200_000)["page_count"] == 2
+    with pytest.raises(ImageTooLarge):
+        score_documents(ConstantDetector(), buffer.getvalue(), max_pixels=50_000)
+
+
+def test_run_refuses_to_write_mock_verdicts_without_weights(tmp_path, monkeypatch):
+    import model_loader
+
+    class NoWeights:
+        backend, backend_name, models_dir = None, "eager", str(tmp_path)
+
+    monkeypatch.setattr(model_loader, "ForgeryDetectionModel", NoWeights)
+    Image.new("RGB", (64, 64)).save(tmp_path / "a.png")
+    output = tmp_path / "scores.csv"
+    args = Namespace(inputs=[str(tmp_path)], manifest=None, output=str(output), checkpoint=None, restart=False, heatmaps=None)
+
+    with pytest.raises(SystemExit, match="weights"):
+        run(args)
+    assert not output.exists()
@@ -0,0 +1,31 @@
+from argparse import Namespace
+
+import numpy as np
+from PIL import Image
+
+from evaluate import score_dataset
+from preprocessing import Preprocessor
+
+
+class ConstantDetector:
+    # Stands in for ForgeryDetectionModel: every decoded image gets the same score.
+    preprocessor = Preprocessor()
+
+    def predict_preprocessed(self, batch, resized, explain=True, heatmap_format="overlay"):
+        return [{"details": {"forged_probability": 0.25}} for _ in resized]
+
+
+def test_score_dataset_counts_undecodable_images_instead_of_aborting(tmp_path, bomb_png):
+    paths = []
+    for name in ("a.png", "b.png"):
+        Image.new("RGB", (64, 64), "gray").save(tmp_path / name)
+        paths.append(str(tmp_path / name))
+    paths.insert(1, bomb_png)
+
+    args = Namespace(workers=1, batch_size=2, max_pixels=None)
+    probabilities, failed = score_dataset(ConstantDetector(), paths, args)
+
+    assert np.isnan(probabilities[1])
+    assert probabilities[[0, 2]].tolist() == [0.25, 0.25]
+    assert [(index, path) for index, path, _ in failed] == [(1, bomb_png)]
+    assert failed[0][2] == "Image of 400000000 pixels exceeds the 178956970 pixel limit"